@@ -24,7 +24,13 @@ index = {"AutoBaseModel": "auto.ipynb",
          "inv_median_scaler": "data__scalers.ipynb",
          "invariant_scaler": "data__scalers.ipynb",
          "inv_invariant_scaler": "data__scalers.ipynb",
+         "PanelScaler": "data__scalers.ipynb",
+         "STORAGE_DTYPES": "data__tsdataset.ipynb",
+         "SeriesMetaData": "data__tsdataset.ipynb",
          "BaseDataset": "data__tsdataset.ipynb",
+         "write_panel": "data__tsdataset.ipynb",
+         "write_wide_panel": "data__tsdataset.ipynb",
+         "BaseDataset.append": "data__tsdataset.ipynb",
          "BaseDataset.__getitem__": "data__tsdataset.ipynb",
          "BaseDataset.__len__": "data__tsdataset.ipynb",
          "BaseDataset.get_n_variables": "data__tsdataset.ipynb",
@@ -40,10 +46,19 @@ index = {"AutoBaseModel": "auto.ipynb",
          "IterateWindowsDataset.__len__": "data__tsdataset.ipynb",
          "WindowsDataset": "data__tsdataset.ipynb",
          "WindowsDataset.__getitem__": "data__tsdataset.ipynb",
+         "WindowsDataset.__getitems__": "data__tsdataset.ipynb",
+         "WindowsDataset.append": "data__tsdataset.ipynb",
+         "WindowsDataset.with_windows": "data__tsdataset.ipynb",
          "TimeSeriesLoader": "data__tsloader.ipynb",
+         "LengthBucketSampler": "data__tsloader.ipynb",
+         "LengthBucketSampler.__iter__": "data__tsloader.ipynb",
+         "LengthBucketSampler.__len__": "data__tsloader.ipynb",
+         "LengthBucketSampler.padding_fraction": "data__tsloader.ipynb",
+         "LengthBucketSampler.padding_saved": "data__tsloader.ipynb",
          "FastTimeSeriesLoader": "data__tsloader.ipynb",
          "FastTimeSeriesLoader.__iter__": "data__tsloader.ipynb",
          "FastTimeSeriesLoader.__next__": "data__tsloader.ipynb",
+         "FastTimeSeriesLoader.__getitem__": "data__tsloader.ipynb",
          "FastTimeSeriesLoader.__len__": "data__tsloader.ipynb",
          "create_synthetic_tsdata": "data__utils.ipynb",
          "NP": "data_datasets__epf.ipynb",
@@ -176,8 +191,13 @@ index = {"AutoBaseModel": "auto.ipynb",
          "TourismL": "data_datasets__tourismL.ipynb",
          "HierTimeseriesDataset": "data_datasets__tourismL.ipynb",
          "download_file": "data_datasets__utils.ipynb",
+         "download_files": "data_datasets__utils.ipynb",
+         "missing_files": "data_datasets__utils.ipynb",
          "Info": "data_datasets__utils.ipynb",
          "TimeSeriesDataclass": "data_datasets__utils.ipynb",
+         "get_cache_path": "data_datasets__utils.ipynb",
+         "write_cache": "data_datasets__utils.ipynb",
+         "read_cache": "data_datasets__utils.ipynb",
          "get_holiday_dates": "data_datasets__utils.ipynb",
          "holiday_kernel": "data_datasets__utils.ipynb",
          "create_calendar_variables": "data_datasets__utils.ipynb",
@@ -215,6 +235,21 @@ index = {"AutoBaseModel": "auto.ipynb",
          "rmae": "losses__numpy.ipynb",
          "quantile_loss": "losses__numpy.ipynb",
          "mqloss": "losses__numpy.ipynb",
+         "panel_metrics": "losses__numpy.ipynb",
+         "PANEL_METRICS": "losses__numpy.ipynb",
+         "MetricAccumulator": "losses__numpy.ipynb",
+         "MAEAccumulator": "losses__numpy.ipynb",
+         "MSEAccumulator": "losses__numpy.ipynb",
+         "RMSEAccumulator": "losses__numpy.ipynb",
+         "MAPEAccumulator": "losses__numpy.ipynb",
+         "SMAPEAccumulator": "losses__numpy.ipynb",
+         "MASEAccumulator": "losses__numpy.ipynb",
+         "RMAEAccumulator": "losses__numpy.ipynb",
+         "QuantileLossAccumulator": "losses__numpy.ipynb",
+         "MQLossAccumulator": "losses__numpy.ipynb",
+         "LossAccumulator": "losses__numpy.ipynb",
+         "get_accumulator": "losses__numpy.ipynb",
+         "ACCUMULATORS": "losses__numpy.ipynb",
          "MAELoss": "losses__pytorch.ipynb",
          "MSELoss": "losses__pytorch.ipynb",
          "RMSELoss": "losses__pytorch.ipynb",
@@ -245,6 +280,8 @@ index = {"AutoBaseModel": "auto.ipynb",
          "TimeDistributed3d": "models_components__common.ipynb",
          "RepeatVector": "models_components__common.ipynb",
          "L1Regularizer": "models_components__common.ipynb",
+         "WindowNormalizer": "models_components__common.ipynb",
+         "NORMALIZERS": "models_components__common.ipynb",
          "LSTMCell": "models_components__drnn.ipynb",
          "ResLSTMCell": "models_components__drnn.ipynb",
          "ResLSTMLayer": "models_components__drnn.ipynb",
@@ -10,7 +10,7 @@ from typing import List, Optional, Tuple
 import numpy as np
 import pandas as pd
 
-from .utils import download_file, Info
+from .utils import download_files, Info, missing_files, read_cache, write_cache
 
 # Cell
 @dataclass
@@ -46,12 +46,14 @@ EPFInfo = Info(groups=('NP', 'PJM', 'BE', 'FR', 'DE'),
 class EPF:
 
     source_url = 'https://sandbox.zenodo.org/api/files/da5b2c6f-8418-4550-a7d0-7f2497b40f1b/'
+    cache_version = 1
 
     @staticmethod
     def load(directory: str,
-             group: str) -> Tuple[pd.DataFrame,
-                                  Optional[pd.DataFrame],
-                                  Optional[pd.DataFrame]]:
+             group: str,
+             cache: bool = True) -> Tuple[pd.DataFrame,
+                                          Optional[pd.DataFrame],
+                                          Optional[pd.DataFrame]]:
         """
         Downloads and loads EPF data.
 
@@ -62,6 +64,8 @@ class EPF:
         group: str
             Group name.
             Allowed groups: 'NP', 'PJM', 'BE', 'FR', 'DE'.
+        cache: bool
+            If `True` saves and loads the typed columnar cache of the group.
 
         Returns
         -------
@@ -70,6 +74,12 @@ class EPF:
         X: pd.DataFrame
             Exogenous time series with columns ['unique_id', 'ds', 'y'].
         """
+        if cache:
+            dfs = read_cache(directory=directory, dataset='epf', group=group,
+                             version=EPF.cache_version)
+            if dfs is not None:
+                return dfs
+
         EPF.download(directory)
         class_group = EPFInfo.get_group(group)
 
@@ -94,6 +104,13 @@ class EPF:
         X = df.filter(items=['unique_id', 'ds', 'Exogenous1', 'Exogenous2', 'week_day'] + \
                       dummies_cols)
 
+        if cache:
+            write_cache(dfs=(Y, X, None), directory=directory, dataset='epf', group=group,
+                        version=EPF.cache_version)
+            # Same dtypes as the loads from the cache
+            return read_cache(directory=directory, dataset='epf', group=group,
+                              version=EPF.cache_version)
+
         return Y, X, None
 
     @staticmethod
@@ -150,9 +167,7 @@ class EPF:
             Directory path to download dataset.
         """
         path = f'{directory}/epf/datasets'
-        if not os.path.exists(path):
-            for group in EPFInfo.groups:
-                download_file(path, EPF.source_url + f'{group}.csv')
+        download_files(path, missing_files(path, [EPF.source_url + f'{group}.csv' for group in EPFInfo.groups]))
 
 # Cell
 # TODO: extend this to group_by unique_id application
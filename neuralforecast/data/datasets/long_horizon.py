@@ -4,14 +4,13 @@ __all__ = ['ETTh1', 'ETTh2', 'ETTm1', 'ETTm2', 'ECL', 'Exchange', 'TrafficL', 'I
            'LongHorizon']
 
 # Cell
-import os
 from dataclasses import dataclass
 from typing import Optional, Tuple
 
 import numpy as np
 import pandas as pd
 
-from .utils import download_file, Info
+from .utils import download_files, Info, missing_files, read_cache, write_cache
 
 # Cell
 @dataclass
@@ -188,6 +187,7 @@ class LongHorizon:
     """
 
     source_url: str = 'https://nhits-experiments.s3.amazonaws.com/datasets.zip'
+    cache_version: int = 1
 
     @staticmethod
     def load(directory: str,
@@ -225,13 +225,11 @@ class LongHorizon:
         if group not in LongHorizonInfo.groups:
             raise Exception(f'group not found {group}')
 
-        path = f'{directory}/longhorizon/datasets'
-        file_cache = f'{path}/{group}.p'
-
-        if os.path.exists(file_cache) and cache:
-            df, X_df, S_df = pd.read_pickle(file_cache)
-
-            return df, X_df, S_df
+        if cache:
+            dfs = read_cache(directory=directory, dataset='longhorizon', group=group,
+                             version=LongHorizon.cache_version)
+            if dfs is not None:
+                return dfs
 
         LongHorizon.download(directory)
         path = f'{directory}/longhorizon/datasets'
@@ -246,7 +244,11 @@ class LongHorizon:
 
         S_df = None
         if cache:
-            pd.to_pickle((y_df, X_df, S_df), file_cache)
+            write_cache(dfs=(y_df, X_df, S_df), directory=directory, dataset='longhorizon', group=group,
+                        version=LongHorizon.cache_version)
+            # Same dtypes as the loads from the cache
+            return read_cache(directory=directory, dataset='longhorizon', group=group,
+                              version=LongHorizon.cache_version)
 
         return y_df, X_df, S_df
 
@@ -261,5 +263,4 @@ class LongHorizon:
             Directory path to download dataset.
         """
         path = f'{directory}/longhorizon/datasets/'
-        if not os.path.exists(path):
-             download_file(path, LongHorizon.source_url, decompress=True)
\ No newline at end of file
+        download_files(path, missing_files(path, [LongHorizon.source_url]), decompress=True)
\ No newline at end of file
@@ -3,13 +3,14 @@
 __all__ = ['Yearly', 'Quarterly', 'Monthly', 'Other', 'M3Info', 'M3']
 
 # Cell
-import os
 from dataclasses import dataclass
 from typing import Optional, Tuple
 
+import numpy as np
 import pandas as pd
 
-from .utils import download_file, Info, TimeSeriesDataclass
+from .utils import download_files, Info, missing_files, TimeSeriesDataclass, read_cache, write_cache
+from ..tsdataset import write_wide_panel
 
 # Cell
 @dataclass
@@ -59,17 +60,71 @@ def _return_year(ts: pd.DataFrame) -> int:
 
     return year
 
+# Internal Cell
+def _read_sheet(directory: str, group: str) -> pd.DataFrame:
+    """Wide sheet of a group, one row per time series."""
+    class_group = M3Info.get_group(group)
+    df = pd.read_excel(f'{directory}/m3/datasets/M3C.xls', sheet_name=class_group.sheet_name)
+    df = df.rename(columns={'Series': 'unique_id',
+                            'Category': 'category',
+                            'Starting Year': 'year',
+                            'Starting Month': 'month'})
+    df['unique_id'] = [class_group.name[0] + str(i + 1) for i in range(len(df))]
+
+    return df
+
+def _sheet_to_long(df: pd.DataFrame, group: str) -> pd.DataFrame:
+    """Long format of the wide sheet of a group."""
+    class_group = M3Info.get_group(group)
+    id_vars = list(df.columns[:6])
+    df = pd.melt(df, id_vars=id_vars, var_name='ds', value_name='y')
+    df = df.dropna().sort_values(['unique_id', 'ds']).reset_index(drop=True)
+
+    freq = pd.tseries.frequencies.to_offset(class_group.freq)
+
+    if group == 'Other':
+        df['year'] = 1970
+
+    df['ds'] = df.groupby('unique_id')['year'] \
+                 .transform(lambda df: pd.date_range(f'{_return_year(df)}-01-01',
+                                                     periods=df.shape[0],
+                                                     freq=freq))
+    df = df.filter(items=['unique_id', 'ds', 'y'])
+
+    return df
+
+def _sheet_to_wide(df: pd.DataFrame, group: str) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """Values, ds, unique_ids and observed mask of the wide sheet of a group.
+    The ds of the time series starting each year are built once."""
+    class_group = M3Info.get_group(group)
+    Y = df.iloc[:, 6:].values.astype(np.float32)
+    mask = ~np.isnan(Y) & df.iloc[:, :6].notna().values.all(axis=1, keepdims=True)
+
+    years = np.full(len(df), 1970) if group == 'Other' else df['year'].fillna(0).values.astype(int)
+    years = np.where(years == 0, 1970, years)
+    unique_years, year_idxs = np.unique(years, return_inverse=True)
+    freq = pd.tseries.frequencies.to_offset(class_group.freq)
+    year_ds = np.stack([pd.date_range(f'{year}-01-01', periods=Y.shape[1], freq=freq).values \
+                        for year in unique_years])
+    stamps = (np.cumsum(mask, axis=1) - 1).clip(0)
+    ds = year_ds[year_idxs[:, None], stamps]
+
+    return Y, ds, df['unique_id'].values, mask
+
+
 # Cell
 @dataclass
 class M3(TimeSeriesDataclass):
 
     source_url = 'https://forecasters.org/data/m3comp/M3C.xls'
+    cache_version = 1
 
     @staticmethod
     def load(directory: str,
-             group: str) -> Tuple[pd.DataFrame,
-                                  Optional[pd.DataFrame],
-                                  Optional[pd.DataFrame]]:
+             group: str,
+             cache: bool = True) -> Tuple[pd.DataFrame,
+                                          Optional[pd.DataFrame],
+                                          Optional[pd.DataFrame]]:
         """
         Downloads and loads M3 data.
 
@@ -80,43 +135,69 @@ class M3(TimeSeriesDataclass):
         group: str
             Group name.
             Allowed groups: 'Yearly', 'Quarterly', 'Monthly', 'Other'.
+        cache: bool
+            If `True` saves and loads the typed columnar cache of the group.
 
         Returns
         -------
         df: pd.DataFrame
             Target time series with columns ['unique_id', 'ds', 'y'].
         """
-        M3.download(directory)
-
-        path = f'{directory}/m3/datasets/'
-        file = f'{path}/M3C.xls'
-
-        class_group = M3Info.get_group(group)
+        if cache:
+            dfs = read_cache(directory=directory, dataset='m3', group=group,
+                             version=M3.cache_version)
+            if dfs is not None:
+                return dfs
 
-        df = pd.read_excel(file, sheet_name=class_group.sheet_name)
-        df = df.rename(columns={'Series': 'unique_id',
-                                'Category': 'category',
-                                'Starting Year': 'year',
-                                'Starting Month': 'month'})
-        df['unique_id'] = [class_group.name[0] + str(i + 1) for i in range(len(df))]
-        S = df.filter(items=['unique_id', 'category'])
+        M3.download(directory)
 
-        id_vars = list(df.columns[:6])
-        df = pd.melt(df, id_vars=id_vars, var_name='ds', value_name='y')
-        df = df.dropna().sort_values(['unique_id', 'ds']).reset_index(drop=True)
+        df = _read_sheet(directory=directory, group=group)
+        df = _sheet_to_long(df=df, group=group)
 
-        freq = pd.tseries.frequencies.to_offset(class_group.freq)
+        if cache:
+            write_cache(dfs=(df, None, None), directory=directory, dataset='m3', group=group,
+                        version=M3.cache_version)
+            # Same dtypes as the loads from the cache
+            return read_cache(directory=directory, dataset='m3', group=group,
+                              version=M3.cache_version)
 
-        if group == 'Other':
-            df['year'] = 1970
+        return df, None, None
 
-        df['ds'] = df.groupby('unique_id')['year'] \
-                     .transform(lambda df: pd.date_range(f'{_return_year(df)}-01-01',
-                                                         periods=df.shape[0],
-                                                         freq=freq))
-        df = df.filter(items=['unique_id', 'ds', 'y'])
+    @staticmethod
+    def write_panel(directory: str,
+                    group: str,
+                    path: str,
+                    ds_in_test: int = 0,
+                    is_test: bool = False,
+                    dtype: str = 'float32') -> None:
+        """Downloads M3 data and writes a group to an on-disk panel
+        that datasets open passing path as Y_df, see `write_wide_panel`.
+
+        The sheet of the group is written as a wide matrix, the ds of
+        the time series starting each year are built once.
 
-        return df, None, None
+        Parameters
+        ----------
+        directory: str
+            Directory where data will be downloaded.
+        group: str
+            Group name.
+            Allowed groups: 'Yearly', 'Quarterly', 'Monthly', 'Other'.
+        path: str
+            Directory of the panel.
+        ds_in_test: int
+            Numer of datestamps to use as outsample.
+        is_test: bool
+            Wheter target time series belongs to test set.
+        dtype: str
+            Storage dtype of the temporal data, 'float32' or 'float16'.
+        """
+        M3.download(directory)
+        df = _read_sheet(directory=directory, group=group)
+        Y, ds, uids, mask = _sheet_to_wide(df=df, group=group)
+        write_wide_panel(path=path, Y=Y, ds=ds, uids=uids, mask=mask,
+                         ds_in_test=ds_in_test, is_test=is_test, dtype=dtype,
+                         frequency=M3Info[group].freq)
 
     @staticmethod
     def download(directory: str) -> None:
@@ -129,5 +210,4 @@ class M3(TimeSeriesDataclass):
             Directory path to download dataset.
         """
         path = f'{directory}/m3/datasets/'
-        if not os.path.exists(path):
-            download_file(path, M3.source_url)
\ No newline at end of file
+        download_files(path, missing_files(path, [M3.source_url]))
\ No newline at end of file
@@ -10,8 +10,9 @@ from typing import Optional, Tuple, Union
 import numpy as np
 import pandas as pd
 
-from .utils import download_file, Info
-from ...losses.numpy import smape, mase
+from .utils import download_file, download_files, Info, missing_files, read_cache, write_cache
+from ..tsdataset import write_wide_panel
+from ...losses.numpy import _seasonal_naive_scales, mae, smape
 
 # Cell
 @dataclass
@@ -76,12 +77,26 @@ class Other:
 M4Info = Info(groups=('Yearly', 'Quarterly', 'Monthly', 'Weekly', 'Daily', 'Hourly', 'Other'),
               class_groups=(Yearly, Quarterly, Monthly, Weekly, Daily, Hourly, Other))
 
+# Internal Cell
+def _read_static(directory: str, group: str) -> pd.DataFrame:
+    """Category codes of the time series of a group, sorted by unique_id."""
+    class_group = M4Info[group]
+    S_df = pd.read_csv(f'{directory}/m4/datasets/M4-info.csv',
+                       usecols=['M4id','category'])
+    S_df['category'] = S_df['category'].astype('category').cat.codes
+    S_df.rename({'M4id': 'unique_id'}, axis=1, inplace=True)
+    S_df = S_df[S_df['unique_id'].str.startswith(class_group.name[0])]
+
+    return S_df.sort_values('unique_id').reset_index(drop=True)
+
+
 # Cell
 @dataclass
 class M4:
 
     source_url: str = 'https://raw.githubusercontent.com/Mcompetitions/M4-methods/master/Dataset/'
     naive2_forecast_url: str = 'https://github.com/Nixtla/m4-forecasts/raw/master/forecasts/submission-Naive2.zip'
+    cache_version: int = 1
 
     @staticmethod
     def load(directory: str,
@@ -110,13 +125,11 @@ class M4:
             Static exogenous variables with columns ['unique_id', 'ds'].
             and static variables.
         """
-        path = f'{directory}/m4/datasets'
-        file_cache = f'{path}/{group}.p'
-
-        if os.path.exists(file_cache) and cache:
-            df, X_df, S_df = pd.read_pickle(file_cache)
-
-            return df, X_df, S_df
+        if cache:
+            dfs = read_cache(directory=directory, dataset='m4', group=group,
+                             version=M4.cache_version)
+            if dfs is not None:
+                return dfs
 
         if group == 'Other':
             #Special case.
@@ -125,14 +138,9 @@ class M4:
             df, *_ = zip(*included_dfs)
             df = pd.concat(df)
         else:
-            M4.download(directory)
+            M4.download(directory, group)
             path = f'{directory}/m4/datasets'
-            class_group = M4Info[group]
-            S_df = pd.read_csv(f'{directory}/m4/datasets/M4-info.csv',
-                               usecols=['M4id','category'])
-            S_df['category'] = S_df['category'].astype('category').cat.codes
-            S_df.rename({'M4id': 'unique_id'}, axis=1, inplace=True)
-            S_df = S_df[S_df['unique_id'].str.startswith(class_group.name[0])]
+            S_df = _read_static(directory=directory, group=group)
 
             def read_and_melt(file):
                 df = pd.read_csv(file)
@@ -154,16 +162,78 @@ class M4:
             df = pd.concat([df_train, df_test])
             df = df.sort_values(['unique_id', 'ds']).reset_index(drop=True)
 
-            S_df = S_df.sort_values('unique_id').reset_index(drop=True)
-
         X_df = None
         if cache:
-            pd.to_pickle((df, X_df, S_df), file_cache)
+            write_cache(dfs=(df, X_df, S_df), directory=directory, dataset='m4', group=group,
+                        version=M4.cache_version)
+            # Same dtypes as the loads from the cache
+            return read_cache(directory=directory, dataset='m4', group=group,
+                              version=M4.cache_version)
 
         return df, None, S_df
 
     @staticmethod
-    def download(directory: str) -> None:
+    def write_panel(directory: str,
+                    group: str,
+                    path: str,
+                    ds_in_test: int = 0,
+                    is_test: bool = False,
+                    dtype: str = 'float32') -> None:
+        """Downloads M4 data and writes a group to an on-disk panel
+        that datasets open passing path as Y_df, see `write_wide_panel`.
+
+        The wide train and test files are read as float32 matrices and
+        the test values are placed after the last train ds of each time
+        series, without the long format of `M4.load`.
+
+        Parameters
+        ----------
+        directory: str
+            Directory where data will be downloaded.
+        group: str
+            Group name.
+            Allowed groups: 'Yearly', 'Quarterly', 'Monthly',
+                            'Weekly', 'Daily', 'Hourly'.
+        path: str
+            Directory of the panel.
+        ds_in_test: int
+            Numer of datestamps to use as outsample.
+        is_test: bool
+            Wheter target time series belongs to test set.
+        dtype: str
+            Storage dtype of the temporal data, 'float32' or 'float16'.
+        """
+        if group == 'Other':
+            raise Exception('Write the panels of the groups included in Other')
+
+        M4.download(directory, group)
+        data_path = f'{directory}/m4/datasets'
+
+        def read_wide(file):
+            columns = pd.read_csv(file, nrows=0).columns
+            df = pd.read_csv(file, index_col=0, dtype={col: np.float32 for col in columns[1:]})
+
+            return df.index.values, df.values
+
+        uids, train = read_wide(file=f'{data_path}/{group}-train.csv')
+        test_uids, test = read_wide(file=f'{data_path}/{group}-test.csv')
+        assert np.array_equal(uids, test_uids), 'Time series of train and test files do not match'
+
+        # Test values after the last train ds of each time series
+        n_series, n_train = train.shape
+        len_train = n_train - np.argmax(~np.isnan(train[:, ::-1]), axis=1)
+        Y = np.full((n_series, n_train + test.shape[1]), np.nan, dtype=np.float32)
+        Y[:, :n_train] = train
+        del train
+        Y[np.arange(n_series)[:, None], len_train[:, None] + np.arange(test.shape[1])] = test
+
+        S_df = _read_static(directory=directory, group=group)
+        write_wide_panel(path=path, Y=Y, ds=np.arange(1, Y.shape[1] + 1), uids=uids, S_df=S_df,
+                         ds_in_test=ds_in_test, is_test=is_test, dtype=dtype,
+                         frequency=M4Info[group].freq)
+
+    @staticmethod
+    def download(directory: str, group: Optional[str] = None) -> None:
         """
         Download M4 Dataset.
 
@@ -171,18 +241,23 @@ class M4:
         ----------
         directory: str
             Directory path to download dataset.
+        group: str, optional
+            Group name, only downloads its files and M4-info.
+            If `None` downloads every group and the Naive2 forecasts.
         """
         path = f'{directory}/m4/datasets/'
-        if not os.path.exists(path):
-            for group in M4Info.groups:
-                download_file(path, f'{M4.source_url}/Train/{group}-train.csv')
-                download_file(path, f'{M4.source_url}/Test/{group}-test.csv')
-            download_file(path, f'{M4.source_url}/M4-info.csv')
-            download_file(path, M4.naive2_forecast_url, decompress=True)
+        groups = [gr for gr in M4Info.groups if gr != 'Other'] if group is None else [group]
+        download_files(path, missing_files(path, [f'{M4.source_url}/Train/{gr}-train.csv' for gr in groups] + \
+                                                 [f'{M4.source_url}/Test/{gr}-test.csv' for gr in groups] + \
+                                                 [f'{M4.source_url}/M4-info.csv']))
+        if group is None:
+            download_files(path, missing_files(path, [M4.naive2_forecast_url]), decompress=True)
 
 # Cell
 class M4Evaluation:
 
+    _scales: dict = {}
+
     @staticmethod
     def load_benchmark(directory: str, group: str,
                        source_url: Optional[str] = None) -> np.ndarray:
@@ -215,6 +290,7 @@ class M4Evaluation:
                 download_file(path, source_url, decompress=True)
 
         else:
+            download_files(path, missing_files(path, [M4.naive2_forecast_url]), decompress=True)
             filepath = f'{path}/submission-Naive2.csv'
 
         benchmark = pd.read_csv(filepath)
@@ -224,6 +300,42 @@ class M4Evaluation:
 
         return benchmark
 
+    @staticmethod
+    def load_scales(directory: str, group: str) -> Tuple[np.ndarray, np.ndarray]:
+        """Loads the test values and the seasonal naive MASE scales
+        of a group, computed once and cached.
+
+        Parameters
+        ----------
+        directory: str
+            Directory where data will be downloaded.
+        group: str
+            Group name.
+            Allowed groups: 'Yearly', 'Quarterly', 'Monthly',
+                            'Weekly', 'Daily', 'Hourly'.
+
+        Returns
+        -------
+        y_test: numpy array
+            Numpy array of shape (n_series, horizon).
+        scales: numpy array
+            Numpy array of shape (n_series,).
+        """
+        key = (str(directory), group)
+        if key not in M4Evaluation._scales:
+            class_group = M4Info[group]
+            y_df, *_ = M4.load(directory, group)
+            len_series = y_df.groupby('unique_id', observed=True, sort=False).size().values
+            offsets = np.append(0, np.cumsum(len_series))
+            y = y_df['y'].values.astype(np.float64)
+            y_test = y[offsets[1:, None] - class_group.horizon + np.arange(class_group.horizon)]
+            scales = _seasonal_naive_scales(y_train=y, train_offsets=offsets,
+                                            seasonality=class_group.seasonality,
+                                            horizon=class_group.horizon)
+            M4Evaluation._scales[key] = y_test, scales
+
+        return M4Evaluation._scales[key]
+
     @staticmethod
     def evaluate(directory: str, group: str,
                  y_hat: Union[np.ndarray, str]) -> pd.DataFrame:
@@ -238,7 +350,8 @@ class M4Evaluation:
             Allowed groups: 'Yearly', 'Quarterly', 'Monthly',
                             'Weekly', 'Daily', 'Hourly'.
         y_hat: numpy array, str
-            Group forecasts as numpy array or
+            Group forecasts as numpy array of shape (n_series, horizon),
+            candidate forecasts of shape (n_candidates, n_series, horizon) or
             benchmark url from
             https://github.com/Nixtla/m4-forecasts/tree/master/forecasts.
 
@@ -246,40 +359,26 @@ class M4Evaluation:
         -------
         evaluation: pandas dataframe
             DataFrame with columns OWA, SMAPE, MASE
-            and group as index.
+            and group as index, one row per candidate.
         """
         if isinstance(y_hat, str):
             y_hat = M4Evaluation.load_benchmark(directory, group, y_hat)
 
-        initial = group[0]
-        class_group = M4Info[group]
-        horizon = class_group.horizon
-        seasonality = class_group.seasonality
-        path = f'{directory}/m4/datasets'
-        y_df, *_ = M4.load(directory, group)
-
-        y_train = y_df.groupby('unique_id')['y']
-        y_train = y_train.apply(lambda x: x.head(-horizon).values)
-        y_train = y_train.values
-
-        y_test = y_df.groupby('unique_id')['y']
-        y_test = y_test.tail(horizon)
-        y_test = y_test.values.reshape(-1, horizon)
-
+        y_test, scales = M4Evaluation.load_scales(directory, group)
         naive2 = M4Evaluation.load_benchmark(directory, group)
-        smape_y_hat = smape(y_test, y_hat)
-        smape_naive2 = smape(y_test, naive2)
 
-        mase_y_hat = np.mean([mase(y_test[i], y_hat[i], y_train[i], seasonality)
-                              for i in range(class_group.n_ts)])
-        mase_naive2 = np.mean([mase(y_test[i], naive2[i], y_train[i], seasonality)
-                               for i in range(class_group.n_ts)])
+        # Naive2 and every candidate scored in one pass
+        y_hats = np.concatenate([naive2[None], np.reshape(y_hat, (-1, *y_test.shape))])
+        y_tests = np.broadcast_to(y_test, y_hats.shape)
+        smapes = smape(y_tests, y_hats, axis=(1, 2))
+        mases = np.mean(mae(y_tests, y_hats, axis=2) / scales, axis=1)
 
-        owa = .5 * (mase_y_hat / mase_naive2 + smape_y_hat / smape_naive2)
+        owa = .5 * (mases[1:] / mases[0] + smapes[1:] / smapes[0])
+        index = [group] if np.ndim(y_hat) == 2 else pd.RangeIndex(len(owa), name=group)
 
-        evaluation = pd.DataFrame({'SMAPE': smape_y_hat,
-                                   'MASE': mase_y_hat,
+        evaluation = pd.DataFrame({'SMAPE': smapes[1:],
+                                   'MASE': mases[1:],
                                    'OWA': owa},
-                                   index=[group])
+                                   index=index)
 
-        return evaluation
\ No newline at end of file
+        return evaluation
@@ -10,7 +10,66 @@ from typing import Optional, Tuple, Union
 import numpy as np
 import pandas as pd
 
-from .utils import download_file
+from .utils import download_file, download_files, missing_files, read_cache, write_cache
+from ..tsdataset import write_wide_panel
+
+# Internal Cell
+def _read_files(path: str) -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+    """Reads the calendar, the weekly sell prices and the wide sales
+    of train and test, with the id of each time series."""
+    # Calendar data
+    cal_dtypes = {
+        'wm_yr_wk': np.uint16,
+        'event_name_1': 'category',
+        'event_type_1': 'category',
+        'event_name_2': 'category',
+        'event_type_2': 'category',
+        'snap_CA': np.uint8,
+        'snap_TX': np.uint8,
+        'snap_WI': np.uint8,
+    }
+    cal = pd.read_csv(f'{path}/calendar.csv',
+                      dtype=cal_dtypes,
+                      usecols=list(cal_dtypes.keys()) + ['date'],
+                      parse_dates=['date'])
+    cal['d'] = np.arange(cal.shape[0]) + 1
+    cal['d'] = 'd_' + cal['d'].astype('str')
+    cal['d'] = cal['d'].astype('category')
+
+    event_cols = [k for k in cal_dtypes if k.startswith('event')]
+    for col in event_cols:
+        cal[col] = cal[col].cat.add_categories('nan').fillna('nan')
+
+    # Prices
+    prices_dtypes = {
+        'store_id': 'category',
+        'item_id': 'category',
+        'wm_yr_wk': np.uint16,
+        'sell_price': np.float32
+    }
+
+    prices = pd.read_csv(f'{path}/sell_prices.csv',
+                         dtype=prices_dtypes)
+
+    # Sales
+    sales_dtypes = {
+        'item_id': prices.item_id.dtype,
+        'dept_id': 'category',
+        'cat_id': 'category',
+        'store_id': 'category',
+        'state_id': 'category',
+        **{f'd_{i+1}': np.float32 for i in range(1969)}
+    }
+    # Reading train and test sets
+    sales_train = pd.read_csv(f'{path}/sales_train_evaluation.csv',
+                              dtype=sales_dtypes)
+    sales_test = pd.read_csv(f'{path}/sales_test_evaluation.csv',
+                             dtype=sales_dtypes)
+    sales = sales_train.merge(sales_test, how='left',
+                              on=['item_id', 'dept_id', 'cat_id', 'store_id', 'state_id'])
+    sales['id'] = sales[['item_id', 'store_id']].astype(str).agg('_'.join, axis=1).astype('category')
+
+    return cal, prices, sales
 
 # Cell
 @dataclass
@@ -20,6 +79,7 @@ class M5:
     # pip install kaggle --upgrade
     # kaggle competitions download -c m5-forecasting-accuracy
     source_url: str = 'https://github.com/Nixtla/m5-forecasts/raw/main/datasets/m5.zip'
+    cache_version: int = 1
 
     @staticmethod
     def download(directory: str) -> None:
@@ -32,10 +92,7 @@ class M5:
             Directory path to download dataset.
         """
         path = f'{directory}/m5/datasets'
-        if not os.path.exists(path):
-            download_file(directory=path,
-                          source_url=M5.source_url,
-                          decompress=True)
+        download_files(path, missing_files(path, [M5.source_url]), decompress=True)
 
     @staticmethod
     def load(directory: str, cache: bool = True) -> Tuple[pd.DataFrame,
@@ -61,65 +118,16 @@ class M5:
             and static variables.
         """
         path = f'{directory}/m5/datasets'
-        file_cache = f'{path}/m5.p'
 
-        if os.path.exists(file_cache) and cache:
-            Y_df, X_df, S_df = pd.read_pickle(file_cache)
-
-            return Y_df, X_df, S_df
+        if cache:
+            dfs = read_cache(directory=directory, dataset='m5', group='M5',
+                             version=M5.cache_version)
+            if dfs is not None:
+                return dfs
 
         M5.download(directory)
-        # Calendar data
-        cal_dtypes = {
-            'wm_yr_wk': np.uint16,
-            'event_name_1': 'category',
-            'event_type_1': 'category',
-            'event_name_2': 'category',
-            'event_type_2': 'category',
-            'snap_CA': np.uint8,
-            'snap_TX': np.uint8,
-            'snap_WI': np.uint8,
-        }
-        cal = pd.read_csv(f'{path}/calendar.csv',
-                          dtype=cal_dtypes,
-                          usecols=list(cal_dtypes.keys()) + ['date'],
-                          parse_dates=['date'])
-        cal['d'] = np.arange(cal.shape[0]) + 1
-        cal['d'] = 'd_' + cal['d'].astype('str')
-        cal['d'] = cal['d'].astype('category')
-
-        event_cols = [k for k in cal_dtypes if k.startswith('event')]
-        for col in event_cols:
-            cal[col] = cal[col].cat.add_categories('nan').fillna('nan')
-
-        # Prices
-        prices_dtypes = {
-            'store_id': 'category',
-            'item_id': 'category',
-            'wm_yr_wk': np.uint16,
-            'sell_price': np.float32
-        }
-
-        prices = pd.read_csv(f'{path}/sell_prices.csv',
-                             dtype=prices_dtypes)
-
-        # Sales
-        sales_dtypes = {
-            'item_id': prices.item_id.dtype,
-            'dept_id': 'category',
-            'cat_id': 'category',
-            'store_id': 'category',
-            'state_id': 'category',
-            **{f'd_{i+1}': np.float32 for i in range(1969)}
-        }
-        # Reading train and test sets
-        sales_train = pd.read_csv(f'{path}/sales_train_evaluation.csv',
-                                  dtype=sales_dtypes)
-        sales_test = pd.read_csv(f'{path}/sales_test_evaluation.csv',
-                                 dtype=sales_dtypes)
-        sales = sales_train.merge(sales_test, how='left',
-                                  on=['item_id', 'dept_id', 'cat_id', 'store_id', 'state_id'])
-        sales['id'] = sales[['item_id', 'store_id']].astype(str).agg('_'.join, axis=1).astype('category')
+        cal, prices, sales = _read_files(path=path)
+
         # Long format
         long = sales.melt(id_vars=['id', 'item_id', 'dept_id', 'cat_id', 'store_id', 'state_id'],
                           var_name='d', value_name='y')
@@ -128,19 +136,10 @@ class M5:
         long = long.merge(prices, on=['store_id', 'item_id', 'wm_yr_wk'])
         long = long.drop(columns=['d', 'wm_yr_wk'])
 
-        def first_nz_mask(values, index):
-            """Return a boolean mask where the True starts at the first non-zero value."""
-            mask = np.full(values.size, True)
-            for idx, value in enumerate(values):
-                if value == 0:
-                    mask[idx] = False
-                else:
-                    break
-            return mask
-
+        # Each time series starts at its first non-zero value
         long = long.sort_values(['id', 'date'], ignore_index=True)
-        keep_mask = long.groupby('id')['y'].transform(first_nz_mask, engine='numba')
-        long = long[keep_mask.astype(bool)]
+        keep_mask = long['y'].ne(0).groupby(long['id'], observed=True).cummax()
+        long = long[keep_mask.values]
         long.rename(columns={'id': 'unique_id', 'date': 'ds'}, inplace=True)
         Y_df = long.filter(items=['unique_id', 'ds', 'y'])
         cats = ['item_id', 'dept_id', 'cat_id', 'store_id', 'state_id']
@@ -149,10 +148,101 @@ class M5:
         X_df = long.drop(columns=['y'] + cats)
 
         if cache:
-            pd.to_pickle((Y_df, X_df, S_df), file_cache)
+            write_cache(dfs=(Y_df, X_df, S_df), directory=directory, dataset='m5', group='M5',
+                        version=M5.cache_version)
+            # Same dtypes as the loads from the cache
+            return read_cache(directory=directory, dataset='m5', group='M5',
+                              version=M5.cache_version)
 
         return Y_df, X_df, S_df
 
+    @staticmethod
+    def write_panel(directory: str,
+                    path: str,
+                    ds_in_test: int = 0,
+                    is_test: bool = False,
+                    dtype: str = 'float32') -> None:
+        """Downloads M5 data and writes it to an on-disk panel
+        that datasets open passing path as Y_df, see `write_wide_panel`.
+
+        The wide sales are written without the long format of `M5.load`,
+        weekly prices are scattered in a (n_series, n_weeks) matrix and
+        gathered for each day. As in `M5.load`, each time series starts at
+        its first sale among the days with price, the exogenous variables
+        are the calendar events, as category codes, the snap days and the
+        sell price, and the static variables are the category codes of
+        ['item_id', 'dept_id', 'cat_id', 'store_id', 'state_id'].
+
+        Parameters
+        ----------
+        directory: str
+            Directory where data will be downloaded.
+        path: str
+            Directory of the panel.
+        ds_in_test: int
+            Numer of datestamps to use as outsample.
+        is_test: bool
+            Wheter target time series belongs to test set.
+        dtype: str
+            Storage dtype of the temporal data, 'float32' or 'float16'.
+        """
+        M5.download(directory)
+        cal, prices, sales = _read_files(path=f'{directory}/m5/datasets')
+        Y = sales[[f'd_{i+1}' for i in range(len(cal))]].values.astype(np.float32)
+
+        # Position of the time series and week of each price
+        n_items, n_stores = len(sales['item_id'].cat.categories), len(sales['store_id'].cat.categories)
+        price_stores = pd.Categorical(prices['store_id'], categories=sales['store_id'].cat.categories).codes
+        series_idxs = np.full(n_items * n_stores, -1)
+        series_idxs[sales['item_id'].cat.codes.values * n_stores + sales['store_id'].cat.codes.values] = np.arange(len(sales))
+        price_series = series_idxs[prices['item_id'].cat.codes.values * n_stores + price_stores]
+        weeks, day_weeks = np.unique(cal['wm_yr_wk'].values, return_inverse=True)
+        price_weeks = np.searchsorted(weeks, prices['wm_yr_wk'].values).clip(max=len(weeks) - 1)
+        keep = (price_series >= 0) & (price_stores >= 0) & (weeks[price_weeks] == prices['wm_yr_wk'].values)
+
+        weekly_prices = np.full((len(sales), len(weeks)), np.nan, dtype=np.float32)
+        weekly_prices[price_series[keep], price_weeks[keep]] = prices['sell_price'].values[keep]
+        sell_price = weekly_prices[:, day_weeks]
+        del weekly_prices
+
+        # Days with price since the first sale
+        mask = ~np.isnan(sell_price)
+        mask &= np.logical_or.accumulate(mask & (Y != 0), axis=1)
+
+        event_cols = ['event_name_1', 'event_type_1', 'event_name_2', 'event_type_2']
+        X = {col: cal[col].cat.codes.values for col in event_cols}
+        X.update({col: cal[col].values for col in ['snap_CA', 'snap_TX', 'snap_WI']})
+        X['sell_price'] = sell_price
+
+        cats = ['item_id', 'dept_id', 'cat_id', 'store_id', 'state_id']
+        S_df = sales[cats].apply(lambda col: col.cat.codes)
+        S_df.insert(0, 'unique_id', sales['id'].astype(str).values)
+
+        # Time series without sales are left out, as in M5.load
+        series = mask.any(axis=1)
+        if not series.all():
+            Y, mask, X['sell_price'], S_df = Y[series], mask[series], sell_price[series], S_df[series]
+        write_wide_panel(path=path, Y=Y, ds=cal['date'].values, uids=S_df['unique_id'].values,
+                         mask=mask, X=X, S_df=S_df, ds_in_test=ds_in_test, is_test=is_test,
+                         dtype=dtype, frequency='D')
+
+# Internal Cell
+def _rmsse_scales(sales: pd.DataFrame) -> pd.DataFrame:
+    """Mean squared naive error of each aggregated time series of sales
+    after its first non zero sale, in one pass over the wide matrix."""
+    values = sales.values
+    rows = np.arange(len(values))
+    start = np.argmax(values != 0, axis=1)
+    errors = np.diff(values, axis=1)
+    errors = np.einsum('ij,ij->i', errors, errors)
+    # Leading zeros only add the error of the first sale
+    errors = errors - np.where(start > 0, values[rows, start], 0) ** 2
+    scales = errors / (values.shape[1] - 1 - start)
+    scales = pd.Series(scales, index=sales.index, name='scale').reset_index()
+
+    return scales
+
+
 # Cell
 class M5Evaluation:
 
@@ -170,6 +260,7 @@ class M5Evaluation:
         Level11=['state_id', 'item_id'],
         Level12=['item_id', 'store_id']
     )
+    _scales: dict = {}
 
     @staticmethod
     def load_benchmark(directory: str,
@@ -256,6 +347,48 @@ class M5Evaluation:
 
         return df_agg
 
+    @staticmethod
+    def load_scales(directory: str,
+                    validation: bool = False) -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+        """Loads the weights, RMSSE scales and aggregated test values
+        of the 42_840 series, computed once and cached.
+
+        Parameters
+        ----------
+        directory: str
+            Directory where data will be downloaded.
+        validation: bool
+            Wheter load the validation set.
+            Default False, load the test set.
+
+        Returns
+        -------
+        weights: pd.DataFrame
+            Weights of the aggregated series.
+        scales: pd.DataFrame
+            Scales of the aggregated series.
+        y_test: pd.DataFrame
+            Aggregated test values as wide pandas dataframe.
+        """
+        key = (str(directory), validation)
+        if key not in M5Evaluation._scales:
+            M5.download(directory)
+            path = f'{directory}/m5/datasets'
+            if validation:
+                weights = pd.read_csv(f'{path}/weights_validation.csv')
+                sales = pd.read_csv(f'{path}/sales_train_validation.csv')
+                y_test = pd.read_csv(f'{path}/sales_test_validation.csv')
+            else:
+                weights = pd.read_csv(f'{path}/weights_evaluation.csv')
+                sales = pd.read_csv(f'{path}/sales_train_evaluation.csv')
+                y_test = pd.read_csv(f'{path}/sales_test_evaluation.csv')
+
+            scales = _rmsse_scales(M5Evaluation.aggregate_levels(sales))
+            y_test = M5Evaluation.aggregate_levels(y_test)
+            M5Evaluation._scales[key] = weights, scales, y_test
+
+        return M5Evaluation._scales[key]
+
     @staticmethod
     def evaluate(directory: str,
                  y_hat: Union[pd.DataFrame, str],
@@ -284,28 +417,7 @@ class M5Evaluation:
         if isinstance(y_hat, str):
             y_hat = M5Evaluation.load_benchmark(directory, y_hat, validation)
 
-        M5.download(directory)
-        path = f'{directory}/m5/datasets'
-        if validation:
-            weights = pd.read_csv(f'{path}/weights_validation.csv')
-            sales = pd.read_csv(f'{path}/sales_train_validation.csv')
-            y_test = pd.read_csv(f'{path}/sales_test_validation.csv')
-        else:
-            weights = pd.read_csv(f'{path}/weights_evaluation.csv')
-            sales = pd.read_csv(f'{path}/sales_train_evaluation.csv')
-            y_test = pd.read_csv(f'{path}/sales_test_evaluation.csv')
-
-        # sales
-        sales = M5Evaluation.aggregate_levels(sales)
-        def scale(x):
-            x = x.values
-            x = x[np.argmax(x!=0):]
-            scale = ((x[1:] - x[:-1]) ** 2).mean()
-            return scale
-        scales = sales.agg(scale, 1).rename('scale').reset_index()
-
-        # y_test
-        y_test = M5Evaluation.aggregate_levels(y_test)
+        weights, scales, y_test = M5Evaluation.load_scales(directory, validation)
 
         #y_hat
         y_hat = M5Evaluation.aggregate_levels(y_hat)
@@ -10,7 +10,7 @@ from typing import Optional, Tuple
 import pandas as pd
 from pandas.tseries.frequencies import to_offset
 
-from .utils import download_file, Info, TimeSeriesDataclass
+from .utils import download_files, Info, missing_files, TimeSeriesDataclass, read_cache, write_cache
 
 # Cell
 @dataclass
@@ -48,12 +48,14 @@ TourismInfo = Info(groups=('Yearly', 'Quarterly', 'Monthly'),
 class Tourism(TimeSeriesDataclass):
 
     source_url = 'https://robjhyndman.com/data/27-3-Athanasopoulos1.zip'
+    cache_version = 1
 
     @staticmethod
     def load(directory: str,
-             group: str) -> Tuple[pd.DataFrame,
-                                  Optional[pd.DataFrame],
-                                  Optional[pd.DataFrame]]:
+             group: str,
+             cache: bool = True) -> Tuple[pd.DataFrame,
+                                          Optional[pd.DataFrame],
+                                          Optional[pd.DataFrame]]:
         """
         Downloads and loads Tourism data.
 
@@ -64,12 +66,20 @@ class Tourism(TimeSeriesDataclass):
         group: str
             Group name.
             Allowed groups: 'Yearly', 'Quarterly', 'Monthly'.
+        cache: bool
+            If `True` saves and loads the typed columnar cache of the group.
 
         Returns
         -------
         df: pd.DataFrame
             Target time series with columns ['unique_id', 'ds', 'y'].
         """
+        if cache:
+            dfs = read_cache(directory=directory, dataset='tourism', group=group,
+                             version=Tourism.cache_version)
+            if dfs is not None:
+                return dfs
+
         Tourism.download(directory)
 
         path = f'{directory}/tourism/datasets'
@@ -107,6 +117,13 @@ class Tourism(TimeSeriesDataclass):
         df = df.reset_index().filter(items=['unique_id', 'ds', 'y'])
         df = df.sort_values(['unique_id', 'ds'])
 
+        if cache:
+            write_cache(dfs=(df, None, None), directory=directory, dataset='tourism', group=group,
+                        version=Tourism.cache_version)
+            # Same dtypes as the loads from the cache
+            return read_cache(directory=directory, dataset='tourism', group=group,
+                              version=Tourism.cache_version)
+
         return df, None, None
 
     @staticmethod
@@ -121,5 +138,4 @@ class Tourism(TimeSeriesDataclass):
         """
         path = f'{directory}/tourism/datasets'
 
-        if not os.path.exists(path):
-            download_file(path, Tourism.source_url, decompress=True)
\ No newline at end of file
+        download_files(path, missing_files(path, [Tourism.source_url]), decompress=True)
\ No newline at end of file
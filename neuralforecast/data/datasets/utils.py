@@ -1,12 +1,19 @@
 # AUTOGENERATED! DO NOT EDIT! File to edit: nbs/data_datasets__utils.ipynb (unless otherwise specified).
 
-__all__ = ['logger', 'download_file', 'Info', 'TimeSeriesDataclass', 'get_holiday_dates', 'holiday_kernel',
+__all__ = ['logger', 'download_file', 'download_files', 'missing_files', 'Info', 'TimeSeriesDataclass',
+           'get_cache_path', 'write_cache', 'read_cache', 'get_holiday_dates', 'holiday_kernel',
            'create_calendar_variables', 'create_us_holiday_distance_variables', 'US_FEDERAL_HOLIDAYS']
 
 # Cell
+import hashlib
+import json
 import logging
+import os
 import requests
+import shutil
+import threading
 import zipfile
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from dataclasses import dataclass
 from typing import List, Optional, Tuple, Union
@@ -19,10 +26,98 @@ import pandas as pd
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Internal Cell
+_manifest_lock = threading.Lock()
+
+def _sha256(filepath: Path, chunk_size: int = 2**20) -> str:
+    """Sha256 hex digest of filepath read in chunks."""
+    sha = hashlib.sha256()
+    with open(filepath, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            sha.update(chunk)
+
+    return sha.hexdigest()
+
+def _filename(source_url: str) -> str:
+    """Name of the file of source_url inside the download directory."""
+    filename = Path(source_url.split('/')[-1])
+
+    # On windows file must have only zip in suffix
+    if '.zip' in filename.suffix:
+        filename = Path(filename).stem + ".zip"
+
+    return str(filename)
+
+def _read_manifest(directory: Path) -> dict:
+    """Files downloaded inside directory with their url, size and sha256."""
+    manifest = directory / 'manifest.json'
+    if not manifest.exists():
+        return {}
+
+    with open(manifest) as f:
+        return json.load(f)
+
+def _update_manifest(directory: Path, filename: str, entry: dict) -> None:
+    """Records entry of filename in the manifest of directory."""
+    with _manifest_lock:
+        files = _read_manifest(directory)
+        files[filename] = entry
+        tmp = directory / 'manifest.json.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(files, f, indent=1, sort_keys=True)
+        os.replace(tmp, directory / 'manifest.json')
+
+def _fetch(source_url: str, filepath: Path, chunk_size: int, max_retries: int) -> None:
+    """Streams source_url to filepath through a .part file, resuming
+    the part already downloaded with an http range request."""
+    part = Path(f'{filepath}.part')
+    headers = {'User-Agent': 'Mozilla/5.0'}
+    for attempt in range(max_retries + 1):
+        start = part.stat().st_size if part.exists() else 0
+        range_headers = {**headers, 'Range': f'bytes={start}-'} if start else headers
+        try:
+            with requests.get(source_url, stream=True, headers=range_headers, timeout=60) as r:
+                if start and r.status_code == 416:
+                    # Part already complete
+                    break
+                r.raise_for_status()
+                if start and r.status_code != 206:
+                    # Server ignored the range, restart the file
+                    start = 0
+                total_size = start + int(r.headers.get('content-length', 0))
+                with open(part, 'ab' if start else 'wb') as f, \
+                     tqdm(total=total_size, initial=start, unit='iB', unit_scale=True) as t:
+                    for data in r.iter_content(chunk_size):
+                        t.update(len(data))
+                        f.write(data)
+            size = part.stat().st_size
+            if total_size != start and size != total_size:
+                raise IOError(f'Downloaded {size} of {total_size} bytes of {source_url}')
+            break
+        except (requests.RequestException, IOError) as e:
+            if attempt == max_retries or \
+               (isinstance(e, requests.HTTPError) and e.response.status_code < 500):
+                raise Exception(f'Failed downloading {source_url}: {e}') from e
+            logger.warning(f'Retrying {source_url} after: {e}')
+
+    os.replace(part, filepath)
+
+
 # Cell
-def download_file(directory: str, source_url: str, decompress: bool = False) -> None:
+def download_file(directory: str,
+                  source_url: str,
+                  decompress: bool = False,
+                  mirror: Optional[str] = None,
+                  sha256: Optional[str] = None,
+                  chunk_size: int = 2**20,
+                  max_retries: int = 3) -> None:
     """Download data from source_ulr inside directory.
 
+    Files are streamed to a .part file that later calls resume with
+    an http range request. The url, size and sha256 of every complete file
+    are kept in the manifest.json of directory, files already in the
+    manifest are not downloaded again.
+
     Parameters
     ----------
     directory: str, Path
@@ -31,38 +126,44 @@ def download_file(directory: str, source_url: str, decompress: bool = False) ->
         URL where data is hosted.
     decompress: bool
         Wheter decompress downloaded file. Default False.
+    mirror: str
+        Local directory with copies of the files, used instead of source_url
+        when it contains the file. Default env NEURALFORECAST_MIRROR.
+    sha256: str
+        Expected sha256 of the file. Default the one in the manifest.
+    chunk_size: int
+        Bytes written to disk at a time.
+    max_retries: int
+        Retries of failed or interrupted downloads.
     """
     if isinstance(directory, str):
         directory = Path(directory)
     directory.mkdir(parents=True, exist_ok=True)
 
-    filename = Path(source_url.split('/')[-1])
-
-    # On windows file must have only zip in suffix
-    if '.zip' in filename.suffix:
-        filename = Path(filename).stem + ".zip"
-
+    filename = _filename(source_url)
     filepath = Path(f'{directory}/{filename}')
+    entry = _read_manifest(directory).get(filename)
+    sha256 = sha256 or (entry or {}).get('sha256')
 
-    # Streaming, so we can iterate over the response.
-    headers = {'User-Agent': 'Mozilla/5.0'}
-    r = requests.get(source_url, stream=True, headers=headers)
-    # Total size in bytes.
-    total_size = int(r.headers.get('content-length', 0))
-    block_size = 1024 #1 Kibibyte
-
-    t = tqdm(total=total_size, unit='iB', unit_scale=True)
-    with open(filepath, 'wb') as f:
-        for data in r.iter_content(block_size):
-            t.update(len(data))
-            f.write(data)
-            f.flush()
-    t.close()
-
-    if total_size != 0 and t.n != total_size:
-        logger.error('ERROR, something went wrong downloading data')
+    if filepath.exists() and entry is not None and entry['size'] == filepath.stat().st_size \
+       and sha256 == entry['sha256']:
+        logger.info(f'{filename} already downloaded.')
+        return
+
+    mirror = mirror or os.environ.get('NEURALFORECAST_MIRROR')
+    if mirror is not None and Path(f'{mirror}/{filename}').exists():
+        shutil.copyfile(f'{mirror}/{filename}', filepath)
+        logger.info(f'Copied {filename} from mirror {mirror}.')
+    elif not filepath.exists() or entry is not None:
+        _fetch(source_url=source_url, filepath=filepath,
+               chunk_size=chunk_size, max_retries=max_retries)
 
+    digest = _sha256(filepath, chunk_size=chunk_size)
+    if sha256 is not None and digest != sha256:
+        filepath.unlink()
+        raise Exception(f'Checksum of {filename} {digest} does not match {sha256}')
     size = filepath.stat().st_size
+    _update_manifest(directory, filename, {'url': source_url, 'size': size, 'sha256': digest})
     logger.info(f'Successfully downloaded {filename}, {size}, bytes.')
 
     if decompress:
@@ -75,6 +176,65 @@ def download_file(directory: str, source_url: str, decompress: bool = False) ->
             extract_archive(filepath, outdir=directory)
         logger.info(f'Successfully decompressed {filepath}')
 
+
+# Cell
+def download_files(directory: str,
+                   source_urls: List[str],
+                   decompress: bool = False,
+                   mirror: Optional[str] = None,
+                   max_workers: int = 8) -> None:
+    """Downloads source_urls inside directory concurrently, see `download_file`.
+
+    Parameters
+    ----------
+    directory: str, Path
+        Custom directory where data will be downloaded.
+    source_urls: List[str]
+        URLs where data is hosted.
+    decompress: bool
+        Wheter decompress downloaded files. Default False.
+    mirror: str
+        Local directory with copies of the files.
+    max_workers: int
+        Maximum number of concurrent downloads.
+    """
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(download_file, directory=directory, source_url=source_url,
+                                   decompress=decompress, mirror=mirror)
+                   for source_url in source_urls]
+        for future in futures:
+            future.result()
+
+
+# Cell
+def missing_files(directory: str, source_urls: List[str]) -> List[str]:
+    """Source_urls whose files are not complete in the manifest of directory,
+    interrupted downloads included, see `download_file`.
+
+    Parameters
+    ----------
+    directory: str, Path
+        Custom directory where data is downloaded.
+    source_urls: List[str]
+        URLs where data is hosted.
+
+    Returns
+    -------
+    missing_urls: List[str]
+        URLs to download.
+    """
+    directory = Path(directory)
+    manifest = _read_manifest(directory)
+    missing_urls = []
+    for source_url in source_urls:
+        filename = _filename(source_url)
+        filepath = directory / filename
+        if filename not in manifest or not filepath.exists() \
+           or manifest[filename]['size'] != filepath.stat().st_size:
+            missing_urls.append(source_url)
+
+    return missing_urls
+
 # Cell
 @dataclass
 class Info:
@@ -128,6 +288,137 @@ class TimeSeriesDataclass:
     idx_categorical_static: Optional[List] = None
     group: Union[str, List[str]] = None
 
+# Cell
+def get_cache_path(directory: str, dataset: str, group: str, version: int) -> str:
+    """Directory of the cache of a group of a dataset,
+    keyed by the version of the transformations of its loader."""
+    return f'{directory}/{dataset}/cache/{group}-v{version}'
+
+def _write_column(path: str, values: pd.Series) -> dict:
+    """Writes a column as typed npy files, returns its kind."""
+    if isinstance(values.dtype, pd.CategoricalDtype) or values.dtype == object:
+        kind = 'object' if values.dtype == object else 'category'
+        values = pd.Categorical(values)
+        categories = np.asarray(values.categories)
+        if categories.dtype == object:
+            categories = categories.astype(str)
+        np.save(f'{path}.codes.npy', values.codes)
+        np.save(f'{path}.categories.npy', categories)
+        return kind
+
+    values = values.values
+    if np.issubdtype(values.dtype, np.floating):
+        values = values.astype(np.float32)
+    np.save(f'{path}.npy', values)
+    return 'values'
+
+def _read_column(path: str, kind: str, mmap: bool):
+    """Reads a column written with _write_column."""
+    # Copy-on-write, in place changes of the frames never reach the files
+    mmap_mode = 'c' if mmap else None
+    if kind == 'values':
+        return np.load(f'{path}.npy', mmap_mode=mmap_mode)
+
+    codes = np.load(f'{path}.codes.npy', mmap_mode=mmap_mode)
+    categories = np.load(f'{path}.categories.npy')
+    values = pd.Categorical.from_codes(codes, categories=categories)
+    if kind == 'object':
+        # Unique_ids are kept as categories, other columns recover their dtype
+        values = np.asarray(values).astype(object)
+    return values
+
+def write_cache(dfs: Tuple[Optional[pd.DataFrame], ...],
+                directory: str, dataset: str, group: str,
+                version: int = 1) -> None:
+    """Writes the dataframes of a group of a dataset as typed columnar files.
+
+    Each column is stored as a npy file: object and category columns
+    as category codes and categories, floats as float32 and
+    datetimes and integers with their dtype.
+
+    Parameters
+    ----------
+    dfs: Tuple[Optional[pd.DataFrame], ...]
+        Dataframes returned by the loader, Nones are kept.
+    directory: str
+        Directory where data is downloaded.
+    dataset: str
+        Dataset name, e.g. 'm4'.
+    group: str
+        Group name, e.g. 'Yearly'.
+    version: int
+        Version of the transformations of the loader,
+        caches of other versions are ignored.
+    """
+    path = get_cache_path(directory=directory, dataset=dataset, group=group, version=version)
+    tmp_path = f'{path}.tmp'
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+
+    meta = []
+    for i, df in enumerate(dfs):
+        if df is None:
+            meta.append(None)
+            continue
+        columns = []
+        for j, col in enumerate(df.columns):
+            kind = _write_column(f'{tmp_path}/{i}_{j}', df[col])
+            if col == 'unique_id' and kind == 'object':
+                kind = 'category'
+            columns.append({'name': col, 'kind': kind})
+        meta.append(columns)
+
+    with open(f'{tmp_path}/meta.json', 'w') as f:
+        json.dump(meta, f)
+
+    # Complete caches are renamed, so that failed writes are never read
+    shutil.rmtree(path, ignore_errors=True)
+    os.rename(tmp_path, path)
+
+def read_cache(directory: str, dataset: str, group: str,
+               version: int = 1, mmap: bool = True) -> Optional[Tuple[Optional[pd.DataFrame], ...]]:
+    """Reads the dataframes written with `write_cache`.
+
+    Parameters
+    ----------
+    directory: str
+        Directory where data is downloaded.
+    dataset: str
+        Dataset name, e.g. 'm4'.
+    group: str
+        Group name, e.g. 'Yearly'.
+    version: int
+        Version of the transformations of the loader.
+    mmap: bool
+        Whether memory-map the npy files instead of reading them,
+        numeric and datetime columns stay on disk until they are used.
+
+    Returns
+    -------
+    dfs: Tuple[Optional[pd.DataFrame], ...]
+        Cached dataframes, None if the cache does not exist.
+        Unique_ids are returned as categories.
+    """
+    path = get_cache_path(directory=directory, dataset=dataset, group=group, version=version)
+    if not os.path.exists(f'{path}/meta.json'):
+        return None
+
+    with open(f'{path}/meta.json', 'r') as f:
+        meta = json.load(f)
+
+    dfs = []
+    for i, columns in enumerate(meta):
+        if columns is None:
+            dfs.append(None)
+            continue
+        # Without copy the columns keep their memory-maps
+        df = pd.DataFrame({col['name']: _read_column(f'{path}/{i}_{j}', kind=col['kind'], mmap=mmap) \
+                           for j, col in enumerate(columns)}, copy=False)
+        dfs.append(df)
+
+    return tuple(dfs)
+
+
 # Cell
 import pandas as pd
 from pandas.tseries.holiday import (
@@ -154,35 +445,47 @@ US_FEDERAL_HOLIDAYS = {'new_year': Holiday("New Years Day", month=1, day=1, obse
                        'christmas': Holiday("Christmas", month=12, day=25, observance=nearest_workday)}
 
 def get_holiday_dates(holiday, dates):
-    start_date = min(dates) + pd.DateOffset(days=-366)
-    end_date = max(dates) + pd.DateOffset(days=366)
+    dates = pd.DatetimeIndex(dates)
+    start_date = dates.min() + pd.DateOffset(days=-366)
+    end_date = dates.max() + pd.DateOffset(days=366)
     holiday_calendar = AbstractHolidayCalendar(rules=[US_FEDERAL_HOLIDAYS[holiday]])
     holiday_dates = holiday_calendar.holidays(start=start_date, end=end_date)
     return np.array(holiday_dates)
 
 def holiday_kernel(holiday, dates):
-    # Get holidays around dates
-    dates = pd.DatetimeIndex(dates)
-    dates_np = np.array(dates).astype('datetime64[D]')
-    holiday_dates = get_holiday_dates(holiday, dates)
-    holiday_dates_np = np.array(pd.DatetimeIndex(holiday_dates)).astype('datetime64[D]')
+    # Unique days of the dates, distances are broadcast back
+    dates_np = np.array(pd.DatetimeIndex(dates)).astype('datetime64[D]')
+    days, inverse = np.unique(dates_np, return_inverse=True)
+    holiday_dates_np = np.array(get_holiday_dates(holiday, days)).astype('datetime64[D]')
+
+    # Compute day distance to the nearest holiday, found with a binary search
+    # between the holidays before and after each day, the one before on ties
+    nearest_holiday_idx = np.searchsorted(holiday_dates_np, days).clip(1, len(holiday_dates_np) - 1)
+    diff_before = (days - holiday_dates_np[nearest_holiday_idx - 1]).astype(np.int64)
+    diff_after = (days - holiday_dates_np[nearest_holiday_idx]).astype(np.int64)
+    holiday_diff = np.where(np.abs(diff_before) <= np.abs(diff_after), diff_before, diff_after)
+    return holiday_diff[inverse.reshape(-1)]
 
-    # Compute day distance to holiday
-    nearest_holiday_idx = np.expand_dims(dates_np, axis=1) - np.expand_dims(holiday_dates_np, axis=0)
-    nearest_holiday_idx = np.argmin(np.abs(nearest_holiday_idx), axis=1)
-    nearest_holiday = pd.DatetimeIndex([holiday_dates[idx] for idx in nearest_holiday_idx])
-    holiday_diff = (dates - nearest_holiday).days.values
-    return holiday_diff
+def _unique_ds(X_df: pd.DataFrame, freq: str = None):
+    """Unique ds of X_df, floored to freq, and the position of each row in them."""
+    ds = X_df['ds'].values
+    if freq is not None:
+        ds = ds.astype(f'datetime64[{freq}]')
+    codes, unique_ds = pd.factorize(ds)
+    return codes, pd.DatetimeIndex(unique_ds)
 
 def create_calendar_variables(X_df: pd.DataFrame):
-    X_df['day_of_year'] = X_df.ds.dt.dayofyear
-    X_df['day_of_week'] = X_df.ds.dt.dayofweek
-    X_df['hour'] = X_df.ds.dt.hour
+    # Calendar of the unique ds, broadcast to the rows
+    codes, ds = _unique_ds(X_df)
+    X_df['day_of_year'] = ds.dayofyear.values[codes]
+    X_df['day_of_week'] = ds.dayofweek.values[codes]
+    X_df['hour'] = ds.hour.values[codes]
     return X_df
 
 def create_us_holiday_distance_variables(X_df: pd.DataFrame):
-    dates = X_df.ds.dt.date
+    # Distances of the unique days, broadcast to the rows
+    codes, dates = _unique_ds(X_df, freq='D')
     for holiday in US_FEDERAL_HOLIDAYS.keys():
         X_df[f'holiday_dist_{holiday}'] = holiday_kernel(holiday=holiday,
-                                                         dates=dates)
+                                                         dates=dates)[codes]
     return X_df
\ No newline at end of file
@@ -1,7 +1,8 @@
 # AUTOGENERATED! DO NOT EDIT! File to edit: nbs/data__scalers.ipynb (unless otherwise specified).
 
 __all__ = ['Scaler', 'norm_scaler', 'inv_norm_scaler', 'norm1_scaler', 'inv_norm1_scaler', 'std_scaler',
-           'inv_std_scaler', 'median_scaler', 'inv_median_scaler', 'invariant_scaler', 'inv_invariant_scaler']
+           'inv_std_scaler', 'median_scaler', 'inv_median_scaler', 'invariant_scaler', 'inv_invariant_scaler',
+           'PanelScaler']
 
 # Cell
 import numpy as np
@@ -113,3 +114,154 @@ def invariant_scaler(x, mask):
 
 def inv_invariant_scaler(x, x_median, x_mad):
     return np.sinh(x) * x_mad + x_median
+
+
+# Cell
+def _segment_sort(x, segments, n_segments):
+    """Sorts x within each segment with a single argsort of x,
+    segments and ranks are sorted together as integer keys.
+    Returns the sorted values and the offsets of each segment."""
+    order = np.argsort(x)
+    ranks = np.empty(len(x), dtype=np.int64)
+    ranks[order] = np.arange(len(x))
+    keys = np.sort(segments.astype(np.int64) * len(x) + ranks)
+    x_sorted = x[order][keys % max(len(x), 1)]
+    offsets = np.append(0, np.cumsum(np.bincount(segments, minlength=n_segments)))
+    return x_sorted, offsets
+
+def _segment_median(x_sorted, offsets):
+    """Median of each segment of values sorted within segments,
+    nan for empty segments."""
+    counts = np.diff(offsets)
+    nonempty = counts > 0
+    low = (offsets[:-1] + (counts - 1) // 2)[nonempty]
+    high = (offsets[:-1] + counts // 2)[nonempty]
+    median = np.full(len(counts), np.nan)
+    median[nonempty] = (x_sorted[low] + x_sorted[high]) / 2
+    return median
+
+def _segment_mean(x, segments, n_segments):
+    """Mean of each segment, nan for empty segments."""
+    counts = np.bincount(segments, minlength=n_segments)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.bincount(segments, weights=x, minlength=n_segments) / counts
+
+
+# Cell
+class PanelScaler(object):
+    """
+    Scaler of a panel of time series with a shift and scale per time series,
+    computed for all time series at once with segment reductions of the rows
+    sorted by time series. The statistics of each time series are the ones
+    of `Scaler`, stored in numpy arrays of shape (n_series,). Time series
+    without masked rows keep shift 0 and scale 1, and constant time series
+    are only shifted.
+    """
+    def __init__(self, normalizer):
+        assert (normalizer in ['std', 'invariant', 'norm', 'norm1', 'median']), 'Normalizer not defined'
+        self.normalizer = normalizer
+        self.x_shift = None
+        self.x_scale = None
+
+    def scale(self, x, mask, offsets):
+        """
+        Parameters
+        ----------
+        x: np.ndarray
+            Values of shape (n_rows,) sorted by time series.
+        mask: np.ndarray
+            Rows with value 1 are used for the statistics, shape (n_rows,).
+        offsets: np.ndarray
+            Position of the first row of each time series
+            and number of rows, shape (n_series + 1,).
+
+        Returns
+        -------
+        x_scaled: np.ndarray
+            Scaled values of shape (n_rows,).
+        """
+        x = np.asarray(x, dtype=np.float64)
+        n_series = len(offsets) - 1
+        series = np.repeat(np.arange(n_series), np.diff(offsets))
+        x_mask, series_mask = x[mask==1], series[mask==1]
+        counts = np.bincount(series_mask, minlength=n_series)
+
+        if self.normalizer in ['norm', 'norm1']:
+            # Min and max
+            x_sorted, mask_offsets = _segment_sort(x_mask, series_mask, n_series)
+            x_shift = np.where(counts > 0, x_sorted[np.minimum(mask_offsets[:-1], len(x_sorted) - 1)], 0)
+            x_scale = np.where(counts > 0, x_sorted[np.maximum(mask_offsets[1:] - 1, 0)], 1)
+            x_scale = np.where(x_scale == x_shift, x_shift + 1, x_scale)
+        else:
+            x_mean = _segment_mean(x_mask, series_mask, n_series)
+            x_ss = np.bincount(series_mask, weights=(x_mask - x_mean[series_mask])**2, minlength=n_series)
+            if self.normalizer == 'std':
+                with np.errstate(invalid='ignore', divide='ignore'):
+                    x_shift, x_scale = x_mean, np.sqrt(x_ss / counts)
+            else:
+                # Median and MAD, std with ddof=1 if MAD is 0
+                x_sorted, mask_offsets = _segment_sort(x_mask, series_mask, n_series)
+                x_shift = _segment_median(x_sorted, mask_offsets)
+                deviation = np.abs(x_mask - x_shift[series_mask])
+                x_scale = _segment_median(_segment_sort(deviation, series_mask, n_series)[0], mask_offsets)
+                x_scale = x_scale / 0.6744897501960817
+                with np.errstate(invalid='ignore', divide='ignore'):
+                    x_std = np.sqrt(x_ss / (counts - 1)) / 0.6744897501960817
+                x_scale = np.where(x_scale == 0, x_std, x_scale)
+            x_shift = np.where(counts > 0, x_shift, 0)
+            x_scale = np.where((counts > 0) & (x_scale > 0) & np.isfinite(x_scale), x_scale, 1)
+
+        x_scaled = self._transform(x, x_shift[series], x_scale[series])
+
+        nan_before_scale = np.sum(np.isnan(x))
+        nan_after_scale = np.sum(np.isnan(x_scaled))
+        assert nan_before_scale == nan_after_scale, 'Scaler induced nans'
+
+        self.x_shift = x_shift
+        self.x_scale = x_scale
+        return x_scaled
+
+    def _transform(self, x, x_shift, x_scale):
+        if self.normalizer == 'invariant':
+            return np.arcsinh((x - x_shift) / x_scale)
+        elif self.normalizer in ['median', 'std']:
+            return (x - x_shift) / x_scale
+
+        x = (x - x_shift) / (x_scale - x_shift)
+        if self.normalizer == 'norm1':
+            x = x * (2) - 1
+        return x
+
+    def inv_scale(self, x, idxs):
+        """
+        Parameters
+        ----------
+        x: np.ndarray
+            Scaled values, forecasts included, of shape (n, ...).
+        idxs: np.ndarray
+            Time series of each of the n rows of x.
+
+        Returns
+        -------
+        x_inv_scaled: np.ndarray
+            Values in the original scale of shape (n, ...).
+        """
+        assert self.x_shift is not None
+        assert self.x_scale is not None
+
+        shape = (-1,) + (1,) * (np.ndim(x) - 1)
+        x_shift = self.x_shift[idxs].reshape(shape)
+        x_scale = self.x_scale[idxs].reshape(shape)
+
+        if self.normalizer == 'invariant':
+            x_inv_scaled = inv_invariant_scaler(x, x_shift, x_scale)
+        elif self.normalizer == 'median':
+            x_inv_scaled = inv_median_scaler(x, x_shift, x_scale)
+        elif self.normalizer == 'std':
+            x_inv_scaled = inv_std_scaler(x, x_shift, x_scale)
+        elif self.normalizer == 'norm':
+            x_inv_scaled = inv_norm_scaler(x, x_shift, x_scale)
+        elif self.normalizer == 'norm1':
+            x_inv_scaled = inv_norm1_scaler(x, x_shift, x_scale)
+
+        return np.array(x_inv_scaled)
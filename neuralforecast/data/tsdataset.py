@@ -1,10 +1,13 @@
 # AUTOGENERATED! DO NOT EDIT! File to edit: nbs/data__tsdataset.ipynb (unless otherwise specified).
 
-__all__ = ['BaseDataset', 'get_default_mask_df', 'TimeSeriesDataset', 'IterateWindowsDataset', 'WindowsDataset']
+__all__ = ['STORAGE_DTYPES', 'SeriesMetaData', 'BaseDataset', 'write_panel', 'write_wide_panel', 'get_default_mask_df',
+           'TimeSeriesDataset', 'IterateWindowsDataset', 'WindowsDataset']
 
 # Cell
-import gc
+import copy
+import json
 import logging
+import os
 from typing import Dict, List, Optional, Tuple, Union
 
 import numpy as np
@@ -13,6 +16,143 @@ import torch as t
 from fastcore.foundation import patch
 from torch.utils.data import Dataset
 
+# Storage dtypes of the temporal data
+STORAGE_DTYPES = {'float32': t.float32, 'float16': t.float16, 'bfloat16': t.bfloat16}
+
+# Cell
+class SeriesMetaData:
+    """
+    Meta data of the time series of a panel, kept as the unique_id,
+    first ds and number of ds of each time series and the step
+    between consecutive ds. The ds of every row are only expanded
+    when requested, time series with irregular steps keep them.
+    """
+
+    def __init__(self,
+                 uids: np.ndarray,
+                 first_ds: np.ndarray,
+                 len_series: np.ndarray,
+                 step: Optional[np.ndarray],
+                 ds: Optional[np.ndarray] = None) -> 'SeriesMetaData':
+        """
+        Parameters
+        ----------
+        uids: np.ndarray
+            Sorted unique_ids of the time series.
+        first_ds: np.ndarray
+            First ds of each time series.
+        len_series: np.ndarray
+            Number of ds of each time series.
+        step: np.ndarray
+            Step between consecutive ds of every time series.
+            None for time series with irregular steps.
+        ds: np.ndarray
+            Sorted ds of all time series, only with irregular steps.
+        """
+        self.uids = uids
+        self.first_ds = first_ds
+        self.len_series = np.asarray(len_series)
+        self.step = step
+        self._ds = ds
+        self._appended_ds = []
+
+    @classmethod
+    def from_ds(cls,
+                uids: np.ndarray,
+                ds: np.ndarray,
+                len_series: np.ndarray) -> 'SeriesMetaData':
+        """Meta data of time series from their sorted ds, compact
+        when all time series share the same step between ds."""
+        offsets = np.append(0, np.cumsum(len_series))
+        first_ds = ds[offsets[:-1]]
+        if ds.dtype == object:
+            return cls(uids=uids, first_ds=first_ds, len_series=len_series, step=None, ds=ds)
+
+        steps = np.diff(ds)
+        steps = np.delete(steps, offsets[1:-1] - 1) # steps between time series
+        step = steps[0] if len(steps) else np.zeros((), dtype=steps.dtype)
+        if not np.all(steps == step):
+            return cls(uids=uids, first_ds=first_ds, len_series=len_series, step=None, ds=np.asarray(ds))
+
+        return cls(uids=uids, first_ds=first_ds, len_series=len_series, step=step)
+
+    @property
+    def offsets(self) -> np.ndarray:
+        """Position of the first row of each time series."""
+        return np.append(0, np.cumsum(self.len_series))
+
+    @property
+    def ds(self) -> np.ndarray:
+        """Sorted ds of all time series."""
+        if self.step is None:
+            self._merge_appended_ds()
+            return self._ds
+
+        offsets = self.offsets
+        stamps = np.arange(offsets[-1]) - np.repeat(offsets[:-1], self.len_series)
+
+        return np.repeat(self.first_ds, self.len_series) + stamps * self.step
+
+    @property
+    def last_ds(self) -> np.ndarray:
+        """Last ds of each time series."""
+        if self.step is None:
+            return self.ds[self.offsets[1:] - 1]
+
+        return self.first_ds + (self.len_series - 1) * self.step
+
+    def append(self,
+               series: np.ndarray,
+               n_new: np.ndarray,
+               ds: np.ndarray) -> None:
+        """Appends the sorted ds of new rows of the series time series,
+        n_new[series] rows each, after their last ds."""
+        rows_series = np.repeat(series, n_new[series])
+        if self.step is not None:
+            stamps = np.arange(len(ds)) - np.repeat(np.cumsum(n_new[series]) - n_new[series], n_new[series])
+            if np.array_equal(ds, self.last_ds[rows_series] + (stamps + 1) * self.step):
+                self.len_series = self.len_series + n_new
+                return
+            # Appended ds with other steps
+            self._ds, self.step = self.ds, None
+
+        self.len_series = self.len_series + n_new
+        self._appended_ds.append((rows_series, ds))
+
+    def _merge_appended_ds(self) -> None:
+        """Inserts the ds of appended rows in the sorted ds of all time series."""
+        if not self._appended_ds:
+            return
+
+        rows_series = np.concatenate([rows_series for rows_series, _ in self._appended_ds])
+        dss = np.concatenate([dss for _, dss in self._appended_ds])
+        len_series = self.len_series - np.bincount(rows_series, minlength=len(self.len_series))
+        self._ds = np.insert(self._ds, np.cumsum(len_series)[rows_series], dss)
+        self._appended_ds = []
+
+    def to_frame(self) -> pd.DataFrame:
+        """Dataframe with columns ['unique_id', 'ds'] of all time series."""
+        return pd.DataFrame({'unique_id': np.repeat(self.uids, self.len_series),
+                             'ds': self.ds})
+
+    def __len__(self) -> int:
+        return len(self.uids)
+
+    def __getitem__(self, idx: int) -> np.ndarray:
+        """Numpy array of shape (lenght of the time series, 2)
+        with the unique_id and ds of the idx time series."""
+        if not -len(self) <= idx < len(self):
+            raise IndexError(f'Time series {idx} out of range')
+        idx = idx % len(self)
+        if self.step is None:
+            offsets = self.offsets
+            ds = self.ds[offsets[idx]:offsets[idx + 1]]
+        else:
+            ds = self.first_ds[idx] + np.arange(self.len_series[idx]) * self.step
+
+        return pd.DataFrame({'unique_id': np.repeat(self.uids[idx], len(ds)), 'ds': ds}).values
+
+
 # Cell
 class BaseDataset(Dataset):
     """
@@ -20,22 +160,27 @@ class BaseDataset(Dataset):
     """
 
     def __init__(self,
-                 Y_df: pd.DataFrame,
+                 Y_df: Union[pd.DataFrame, str],
                  X_df: Optional[pd.DataFrame] = None,
                  S_df: Optional[pd.DataFrame] = None,
                  f_cols: Optional[List] = None,
+                 shared_cols: Optional[List] = None,
                  mask_df: Optional[pd.DataFrame] = None,
                  ds_in_test: int = 0,
                  is_test: bool = False,
                  input_size: int = None,
                  output_size: int = None,
                  complete_windows: bool = True,
+                 storage: str = 'dense',
+                 dtype: str = 'float32',
+                 static_lookup: bool = False,
                  verbose: bool = False) -> 'BaseDataset':
         """
         Parameters
         ----------
-        Y_df: pd.DataFrame
-            Target time series with columns ['unique_id', 'ds', 'y'].
+        Y_df: Union[pd.DataFrame, str]
+            Target time series with columns ['unique_id', 'ds', 'y'],
+            or path of a panel written with `write_panel`.
         X_df: pd.DataFrame
             Exogenous time series with columns ['unique_id', 'ds', 'y'].
         S_df: pd.DataFrame
@@ -43,6 +188,11 @@ class BaseDataset(Dataset):
             and static variables.
         f_cols: list
             List of exogenous variables of the future.
+        shared_cols: list
+            List of exogenous variables equal for every time series
+            at the same ds, e.g. calendar variables. They are stored
+            once per ds of the panel in shared_values and broadcast
+            into the batches. Time series must cover contiguous ds.
         mask_df: pd.DataFrame
             Outsample mask with columns ['unique_id', 'ds', 'sample_mask']
             and optionally 'available_mask'.
@@ -60,60 +210,75 @@ class BaseDataset(Dataset):
         complete_windows: bool
             Whether consider only windows with sample_mask equal to output_size.
             Default False.
+        storage: str
+            Memory layout of the temporal data, one of 'dense' or 'ragged'.
+            'dense' left pads every series to max_len in ts_tensor.
+            'ragged' stores the rows of all series in a flat ts_values
+            buffer indexed by ts_offsets and pads lazily on each batch.
+            Panels are opened with 'ragged' storage.
+        dtype: str
+            Storage dtype of the temporal data, one of 'float32', 'float16'
+            or 'bfloat16', masks included since 0 and 1 are exact in every
+            dtype. Batches are upcasted to float32, so half precision halves
+            the resident memory at the cost of ~3 significant digits.
+            'bfloat16' is only available with dense storage.
+            Panels keep the dtype they were written with.
+        static_lookup: bool
+            Whether batches leave out the static variables 'S',
+            so that models gather the rows of s_tensor with the batch 'idxs'.
+            Default False: batches carry the static rows of their windows.
         verbose: bool
             Wheter or not log outputs.
         """
-        assert type(Y_df) == pd.core.frame.DataFrame
-        assert all([(col in Y_df) for col in ['unique_id', 'ds', 'y']])
+        assert storage in ['dense', 'ragged'], f'Storage {storage} not implemented'
+        assert dtype in STORAGE_DTYPES, f'dtype {dtype} not implemented'
+        assert storage == 'dense' or dtype != 'bfloat16', "bfloat16 is only available with storage='dense'"
         self.verbose = verbose
-
-        if X_df is not None:
-            assert type(X_df) == pd.core.frame.DataFrame
-            assert all([(col in X_df) for col in ['unique_id', 'ds']])
-            assert len(Y_df)==len(X_df), 'The dimensions of Y_df and X_df are not the same'
-
-        if mask_df is not None:
-            assert len(Y_df)==len(mask_df), 'The dimensions of Y_df and mask_df are not the same'
-            assert all([(col in mask_df) for col in ['unique_id', 'ds', 'sample_mask']])
-            if 'available_mask' not in mask_df.columns:
-                if self.verbose:
-                    logging.info('Available mask not provided, defaulted with 1s.')
-                mask_df['available_mask'] = 1
-            assert np.sum(np.isnan(mask_df.available_mask.values)) == 0
-            assert np.sum(np.isnan(mask_df.sample_mask.values)) == 0
+        self.storage = storage
+        self.dtype = dtype
+        self.shared_cols = shared_cols or []
+
+        if isinstance(Y_df, str):
+            # Panel written with write_panel, opened with memory mapping
+            assert storage == 'ragged', "Panels are opened with storage='ragged'"
+            assert X_df is None and S_df is None and mask_df is None, 'X_df, S_df and masks are stored in the panel'
+            assert not self.shared_cols, 'Panels store every exogenous variable per time series'
+            self.ts_tensor, self.ts_values, self.len_series, self.s_matrix, self.uids, dss, \
+                self.t_cols, self.s_cols, self.frequency, self.n_x, self.n_s = self._open_panel(path=Y_df)
+            self.shared_values, self.shared_starts = None, None
+            self.dtype = str(self.ts_values.dtype)
         else:
-            mask_df = get_default_mask_df(Y_df=Y_df,
-                                          is_test=is_test,
-                                          ds_in_test=ds_in_test)
-
-        n_ds  = len(mask_df)
-        n_avl = mask_df.available_mask.sum()
-        n_ins = mask_df.sample_mask.sum()
-        n_out = len(mask_df) - mask_df.sample_mask.sum()
-
-        avl_prc = np.round((100 * n_avl) / n_ds, 2)
-        ins_prc = np.round((100 * n_ins) / n_ds, 2)
-        out_prc = np.round((100 * n_out) / n_ds, 2)
-        if self.verbose:
-            logging.info('Train Validation splits\n')
-            if len(mask_df.unique_id.unique()) < 10:
-                logging.info(mask_df.groupby(['unique_id', 'sample_mask']).agg({'ds': ['min', 'max']}))
-            else:
-                logging.info(mask_df.groupby(['sample_mask']).agg({'ds': ['min', 'max']}))
-            dataset_info  = f'\nTotal data \t\t\t{n_ds} time stamps \n'
-            dataset_info += f'Available percentage={avl_prc}, \t{n_avl} time stamps \n'
-            dataset_info += f'Insample  percentage={ins_prc}, \t{n_ins} time stamps \n'
-            dataset_info += f'Outsample percentage={out_prc}, \t{n_out} time stamps \n'
-            logging.info(dataset_info)
-
-        self.ts_data, self.s_matrix, self.meta_data, self.t_cols, self.s_cols \
-                         = self._df_to_lists(Y_df=Y_df, S_df=S_df, X_df=X_df, mask_df=mask_df)
+            mask_df = self._check_dfs(Y_df=Y_df, X_df=X_df, mask_df=mask_df,
+                                      ds_in_test=ds_in_test, is_test=is_test)
+
+            # Balances panel and creates
+            # numpy  s_matrix of shape (n_series, n_s)
+            # torch ts_tensor of shape (n_series, n_channels, max_len) n_channels = t_cols + masks
+            # or, with ragged storage, numpy ts_values of shape (n_rows, n_channels)
+            # without shared_cols, stored in numpy shared_values of shape (n_ds, n_shared)
+            self.ts_tensor, self.ts_values, self.shared_values, self.shared_starts, self.len_series, \
+                self.s_matrix, self.uids, dss, self.t_cols, self.s_cols = \
+                    self._df_to_tensor(Y_df=Y_df, S_df=S_df, X_df=X_df, mask_df=mask_df,
+                                       ds_in_test=ds_in_test, is_test=is_test)
+            self.frequency = pd.infer_freq(Y_df.head()['ds'])
+
+            # Number of X and S features
+            self.n_x = 0 if X_df is None else X_df.shape[1] - 2 # -2 for unique_id and ds
+            self.n_s = 0 if S_df is None else S_df.shape[1] - 1 # -1 for unique_id
+
+        # Meta data of the time series, unique_id, first ds and length
+        self._meta_data = SeriesMetaData.from_ds(uids=self.uids, ds=dss, len_series=self.len_series)
+
+        # Static variables table, float32 copy of s_matrix
+        self.s_tensor = t.as_tensor(self.s_matrix.astype(np.float32))
+        self.static_lookup = static_lookup
 
         # Dataset attributes
-        self.n_series = len(self.ts_data)
-        self.max_len = max([len(ts) for ts in self.ts_data])
+        self.n_series = len(self.len_series)
+        self.ts_offsets = np.append(0, np.cumsum(self.len_series))
+        self.max_len = int(self.len_series.max())
         self.n_channels = len(self.t_cols) # t_cols insample_mask and outsample_mask
-        self.frequency = pd.infer_freq(Y_df.head()['ds'])
+        self.stored_cols = [col for col in self.t_cols if col not in self.shared_cols] # ts_tensor or ts_values
         self.f_cols = f_cols
         self.f_idxs = self._get_f_idxs(f_cols) if f_cols else []
         self.input_size = input_size
@@ -121,14 +286,8 @@ class BaseDataset(Dataset):
         self.complete_windows = complete_windows
         self.first_ds = 0
 
-        # Number of X and S features
-        self.n_x = 0 if X_df is None else X_df.shape[1] - 2 # -2 for unique_id and ds
-        self.n_s = 0 if S_df is None else S_df.shape[1] - 1 # -1 for unique_id
-
-        # Balances panel and creates
-        # numpy  s_matrix of shape (n_series, n_s)
-        # numpy ts_tensor of shape (n_series, n_channels, max_len) n_channels = t_cols + masks
-        self.len_series, self.ts_tensor = self._create_tensor()
+        # Growable buffer of ts_tensor
+        self._ts_buffer = self.ts_tensor
 
         # Defining sampleable time series
         self.ts_idxs = np.arange(self.n_series)
@@ -137,24 +296,162 @@ class BaseDataset(Dataset):
 
         self._define_sampleable_ts_idxs()
 
+    @property
+    def meta_data(self) -> SeriesMetaData:
+        """Meta data of the time series. Each of its elements
+        is a numpy array of shape (lenght of the time series, 2)
+        and corresponds to unique_id, ds, built on demand."""
+        return self._meta_data
+
+
+# Cell
+@patch
+def _check_dfs(self: BaseDataset,
+               Y_df: pd.DataFrame,
+               X_df: pd.DataFrame,
+               mask_df: pd.DataFrame,
+               ds_in_test: int,
+               is_test: bool) -> Optional[pd.DataFrame]:
+    """Checks input dataframes and logs the train validation splits.
+
+    Returns
+    -------
+    mask_df, defaulted based on ds_in_test and is_test if None
+    and verbose. Otherwise the default masks are built with the
+    tensor, without sorting Y_df again.
+    """
+    assert type(Y_df) == pd.core.frame.DataFrame
+    assert all([(col in Y_df) for col in ['unique_id', 'ds', 'y']])
+
+    if X_df is not None:
+        assert type(X_df) == pd.core.frame.DataFrame
+        assert all([(col in X_df) for col in ['unique_id', 'ds']])
+        assert len(Y_df)==len(X_df), 'The dimensions of Y_df and X_df are not the same'
+
+    if mask_df is not None:
+        assert len(Y_df)==len(mask_df), 'The dimensions of Y_df and mask_df are not the same'
+        assert all([(col in mask_df) for col in ['unique_id', 'ds', 'sample_mask']])
+        if 'available_mask' not in mask_df.columns:
+            if self.verbose:
+                logging.info('Available mask not provided, defaulted with 1s.')
+            mask_df['available_mask'] = 1
+        assert np.sum(np.isnan(mask_df.available_mask.values)) == 0
+        assert np.sum(np.isnan(mask_df.sample_mask.values)) == 0
+    elif not self.verbose:
+        return None
+    else:
+        mask_df = get_default_mask_df(Y_df=Y_df,
+                                      is_test=is_test,
+                                      ds_in_test=ds_in_test)
+
+    n_ds  = len(mask_df)
+    n_avl = mask_df.available_mask.sum()
+    n_ins = mask_df.sample_mask.sum()
+    n_out = len(mask_df) - mask_df.sample_mask.sum()
+
+    avl_prc = np.round((100 * n_avl) / n_ds, 2)
+    ins_prc = np.round((100 * n_ins) / n_ds, 2)
+    out_prc = np.round((100 * n_out) / n_ds, 2)
+    if self.verbose:
+        logging.info('Train Validation splits\n')
+        if len(mask_df.unique_id.unique()) < 10:
+            logging.info(mask_df.groupby(['unique_id', 'sample_mask']).agg({'ds': ['min', 'max']}))
+        else:
+            logging.info(mask_df.groupby(['sample_mask']).agg({'ds': ['min', 'max']}))
+        dataset_info  = f'\nTotal data \t\t\t{n_ds} time stamps \n'
+        dataset_info += f'Available percentage={avl_prc}, \t{n_avl} time stamps \n'
+        dataset_info += f'Insample  percentage={ins_prc}, \t{n_ins} time stamps \n'
+        dataset_info += f'Outsample percentage={out_prc}, \t{n_out} time stamps \n'
+        logging.info(dataset_info)
+
+    return mask_df
+
 # Cell
 @patch
 def _define_sampleable_ts_idxs(self: BaseDataset) -> None:
-    self.n_sampleable_ts = len(self.ts_tensor)
+    self.n_sampleable_ts = self.n_series
     self.sampleable_ts_idxs = self.ts_idxs.copy()
 
+# Cell
+def _sort_panel(df: pd.DataFrame) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Sorts a panel by ['unique_id', 'ds'] with a single stable
+    argsort of a combined key, linear for already sorted panels.
+
+    Parameters
+    ----------
+    df: pd.DataFrame
+        Panel with columns ['unique_id', 'ds'].
+
+    Returns
+    -------
+    Tuple of three elements:
+        - Permutation that sorts the rows of df.
+        - Sorted unique_ids.
+        - Offsets of each unique_id in the sorted rows,
+          numpy array of shape (n_series + 1,).
+    """
+    uid_codes, uids = pd.factorize(df['unique_id'].values, sort=True)
+    ds_codes, dss = pd.factorize(df['ds'].values, sort=True)
+    order = np.argsort(uid_codes.astype(np.int64) * len(dss) + ds_codes, kind='stable')
+    offsets = np.searchsorted(uid_codes[order], np.arange(len(uids) + 1))
+
+    return order, uids, offsets
+
+def _align_panel(df: pd.DataFrame, Y_df: pd.DataFrame,
+                 y_order: np.ndarray, name: str) -> np.ndarray:
+    """Permutation that sorts df like Y_df.
+    The sort is skipped when df rows are already aligned with Y_df."""
+    uids, dss = df['unique_id'].values, df['ds'].values
+    if np.array_equal(uids, Y_df['unique_id'].values) and np.array_equal(dss, Y_df['ds'].values):
+        return y_order
+
+    order, _, _ = _sort_panel(df)
+    assert np.array_equal(uids[order], Y_df['unique_id'].values[y_order]), f'Mismatch in {name}, Y unique_ids'
+    assert np.array_equal(dss[order], Y_df['ds'].values[y_order]), f'Mismatch in {name}, Y ds'
+
+    return order
+
+def _tail_mask(offsets: np.ndarray, n: int) -> np.ndarray:
+    """Boolean mask of the last n rows of each time series
+    in rows sorted by ['unique_id', 'ds'] with offsets."""
+    len_series = np.diff(offsets)
+
+    return np.arange(offsets[-1]) >= np.repeat(offsets[1:] - n, len_series)
+
+def _tail_panel(df: pd.DataFrame, n: int) -> pd.DataFrame:
+    """Last n rows of each time series of df,
+    sorted by ['unique_id', 'ds']."""
+    order, _, offsets = _sort_panel(df)
+
+    return df.iloc[order[_tail_mask(offsets, n)]].reset_index(drop=True)
+
+
 # Cell
 @patch
-def _df_to_lists(self: BaseDataset,
-                 S_df: pd.DataFrame,
-                 Y_df: pd.DataFrame,
-                 X_df: pd.DataFrame,
-                 mask_df: pd.DataFrame) -> Tuple[List[np.ndarray],
-                                                 List[np.ndarray],
-                                                 List[np.ndarray],
-                                                 List[str],
-                                                 List[str]]:
-    """Transforms input dataframes to lists.
+def _df_to_tensor(self: BaseDataset,
+                  S_df: pd.DataFrame,
+                  Y_df: pd.DataFrame,
+                  X_df: pd.DataFrame,
+                  mask_df: Optional[pd.DataFrame],
+                  ds_in_test: int = 0,
+                  is_test: bool = False) -> Tuple[Optional[t.Tensor],
+                                                  Optional[np.ndarray],
+                                                  Optional[np.ndarray],
+                                                  Optional[np.ndarray],
+                                                  np.ndarray,
+                                                  np.ndarray,
+                                                  np.ndarray,
+                                                  np.ndarray,
+                                                  List[str],
+                                                  List[str]]:
+    """Transforms input dataframes to a left padded tensor.
+
+    Sorts Y_df once, computes the offsets of each time series
+    and scatters every temporal column straight into a
+    preallocated tensor of the storage dtype. With ragged storage
+    the columns are written to a flat (n_rows, n_channels) buffer
+    without padding instead. The shared_cols are written once per
+    ds of the panel to a (n_ds, n_shared) buffer.
 
     Parameters
     ----------
@@ -169,19 +466,28 @@ def _df_to_lists(self: BaseDataset,
         Outsample mask with columns ['unique_id', 'ds', 'sample_mask']
         and optionally 'available_mask'.
         Default None: constructs default mask based on ds_in_test.
+    ds_in_test: int
+        Only used when mask_df = None.
+        Numer of datestamps to use as outsample.
+    is_test: bool
+        Only used when mask_df = None.
+        Wheter target time series belongs to test set.
 
     Returns
     -------
-    Tuple of five lists:
-        - List of time series. Each element of the list is a
-          numpy array of shape (length of the time series, n_channels),
-          where n_channels = t_cols + masks.
-        - List of static variables. Each element of the list is a
-          numpy array of shape (1, n_s).
-          where n_channels = t_cols + masks.
-        - List of meta data. Each element of the list is a
-          numpy array of shape (lenght of the time series, 2)
-          and corresponds to unique_id, ds.
+    Tuple of ten elements:
+        - Time series tensor of shape (n_series, n_channels, max_len),
+          where n_channels = t_cols + masks. None for ragged storage.
+        - Numpy array of shape (n_rows, n_channels) with the rows of
+          all time series. None for dense storage.
+        - Numpy array of shape (n_ds, n_shared) with the shared_cols
+          of each ds of the panel. None without shared_cols.
+        - Numpy array with the position in the ds of the panel of the
+          first ds of each time series. None without shared_cols.
+        - Numpy array with the length of each time series.
+        - Numpy array of static variables of shape (n_series, n_s).
+        - Numpy array of sorted unique_ids.
+        - Numpy array of sorted ds of all time series.
         - List of temporal variables (including target and masks).
         - List of statitc variables.
     """
@@ -192,62 +498,407 @@ def _df_to_lists(self: BaseDataset,
     if S_df is None:
         S_df = Y_df[['unique_id']].drop_duplicates()
 
-    # Protect order of data
-    Y = Y_df.sort_values(by=['unique_id', 'ds'], ignore_index=True).copy()
-    X = X_df.sort_values(by=['unique_id', 'ds'], ignore_index=True).copy()
-    M = mask_df.sort_values(by=['unique_id', 'ds'], ignore_index=True).copy()
-
-    assert np.array_equal(X.unique_id.values, Y.unique_id.values), f'Mismatch in X, Y unique_ids'
-    assert np.array_equal(X.ds.values, Y.ds.values), f'Mismatch in X, Y ds'
-    assert np.array_equal(M.unique_id.values, Y.unique_id.values), f'Mismatch in M, Y unique_ids'
-    assert np.array_equal(M.ds.values, Y.ds.values), f'Mismatch in M, Y ds'
+    # Protect order of data, X_df and mask_df reuse the sort of Y_df when aligned
+    y_order, uids, offsets = _sort_panel(Y_df)
+    x_order = _align_panel(X_df, Y_df, y_order, 'X')
+    if mask_df is None:
+        # Default masks of the sorted rows, see get_default_mask_df
+        mask_df = pd.DataFrame({'available_mask': np.ones(len(Y_df), dtype=np.int64),
+                                'sample_mask': (_tail_mask(offsets, ds_in_test) == is_test).astype(np.int64)})
+        m_order = np.arange(len(Y_df))
+    else:
+        m_order = _align_panel(mask_df, Y_df, y_order, 'M')
 
-    # Create bigger grouped by dataframe G to parse
-    M = M[['available_mask', 'sample_mask']]
-    X.drop(labels=['unique_id', 'ds'], axis=1, inplace=True)
-    G = Y.join(X).join(M)
+    # time columns and static columns for future indexing
+    y_cols = [col for col in Y_df.columns if col not in ['unique_id', 'ds']]
+    x_cols = [col for col in X_df.columns if col not in ['unique_id', 'ds']]
+    m_cols = ['available_mask', 'sample_mask']
+    t_cols = y_cols + x_cols + m_cols
+    assert all(col in x_cols for col in self.shared_cols), 'shared_cols must be exogenous variables of X_df'
 
     S = S_df.sort_values('unique_id')
-
-    # time columns and static columns for future indexing
-    t_cols = [col for col in G.columns if col not in ['unique_id', 'ds']]# avoid unique_id and ds
     s_cols = [col for col in S.columns if col not in ['unique_id']] # avoid unique_id
 
-    grouped = G.groupby('unique_id')
-    meta = G[['unique_id', 'ds']].values
-    data = G.drop(columns=['unique_id', 'ds']).values
-    sizes = grouped.size()
-    idxs = np.append(0, sizes.cumsum())
-    ts_data = []
-    meta_data = []
-    for start, end in zip(idxs[:-1], idxs[1:]):
-        ts_data.append(data[start:end])
-        meta_data.append(meta[start:end])
+    channels = [(Y_df, y_order, col) for col in y_cols] + \
+               [(X_df, x_order, col) for col in x_cols] + \
+               [(mask_df, m_order, col) for col in m_cols]
+    channels = [channel for channel in channels if channel[2] not in self.shared_cols]
+    len_series = np.diff(offsets).astype(np.int32)
+    n_series, n_channels, max_len = len(len_series), len(channels), len_series.max()
+
+    if self.storage == 'ragged':
+        ts_tensor = None
+        ts_values = np.empty((len(Y_df), n_channels), dtype=self.dtype)
+        for channel, (df, order, col) in enumerate(channels):
+            ts_values[:, channel] = df[col].values[order]
+    else:
+        # Flat position of each sorted row in the left padded tensor
+        rows_series = np.repeat(np.arange(n_series), len_series)
+        rows_stamps = np.arange(len(Y_df)) - offsets[rows_series] + (max_len - len_series)[rows_series]
+        rows_flat = rows_series * (n_channels * max_len) + rows_stamps
+        del rows_series, rows_stamps
+
+        ts_values = None
+        dtype = STORAGE_DTYPES[self.dtype]
+        ts_tensor = t.zeros((n_series, n_channels, max_len), dtype=dtype)
+        ts_flat = ts_tensor.view(-1)
+        for channel, (df, order, col) in enumerate(channels):
+            ts_flat[t.from_numpy(rows_flat + channel * max_len)] = \
+                t.as_tensor(df[col].values[order].astype(np.float32), dtype=dtype)
+
+    dss = Y_df['ds'].values[y_order]
+
+    # Shared exogenous variables, once per ds of the panel
+    shared_values, shared_starts = None, None
+    if self.shared_cols:
+        panel_ds, positions = np.unique(dss, return_inverse=True)
+        shared_starts = positions[offsets[:-1]]
+        if not np.array_equal(positions - np.repeat(shared_starts - offsets[:-1], len_series), np.arange(len(Y_df))):
+            raise ValueError('Time series with shared_cols must cover contiguous ds of the panel')
+        values = X_df[self.shared_cols].values[x_order].astype(np.float32)
+        shared_values = np.zeros((len(panel_ds), len(self.shared_cols)), dtype=np.float32)
+        shared_values[positions] = values
+        if not np.array_equal(shared_values[positions], values, equal_nan=True):
+            raise ValueError('shared_cols must be equal for every time series at the same ds')
 
     if S['unique_id'].value_counts().max() > 1:
         raise ValueError('Found duplicated unique_ids in S_df')
     s_data = S.drop(columns='unique_id').values
 
-    del S, Y, X, M, G
-    gc.collect()
+    return ts_tensor, ts_values, shared_values, shared_starts, len_series, s_data, uids, dss, t_cols, s_cols
 
-    return ts_data, s_data, meta_data, t_cols, s_cols
 
 # Cell
 @patch
-def _create_tensor(self: BaseDataset) -> Tuple[np.array, t.Tensor]:
-    """Transforms outputs from self._df_to_lists to numpy arrays."""
-    ts_tensor = np.zeros((self.n_series, self.n_channels, self.max_len))
+def _get_tensor(self: BaseDataset,
+                idx: Union[slice, int, list, np.ndarray],
+                length: Optional[int] = None) -> t.Tensor:
+    """Gets the left padded temporal data of the idx time series.
+
+    Parameters
+    ----------
+    idx: Union[slice, int, list, np.ndarray]
+        Indexes of time series to consider.
+    length: int
+        Number of trailing time stamps to return.
+        Default None: max_len for dense storage and the length
+        of the longest requested series for ragged storage.
 
-    len_series = np.empty(self.n_series, dtype=np.int32)
-    for idx, ts_idx in enumerate(self.ts_data):
-        # Left padded time series tensor
-        ts_tensor[idx, :, -ts_idx.shape[0]:] = ts_idx.T
-        len_series[idx] = ts_idx.shape[0]
+    Returns
+    -------
+    Float32 tensor of shape (len(idx), n_channels, length),
+    shared_cols included.
+    """
+    if self.storage == 'dense':
+        tensor = self.ts_tensor[idx]
+        if length is not None:
+            tensor = tensor[..., -length:]
+        ts_idxs = np.atleast_1d(self.ts_idxs[idx])
+        return self._insert_shared(tensor.float(), ts_idxs, self.len_series[ts_idxs] - tensor.size(-1))
 
-    ts_tensor = t.Tensor(ts_tensor)
+    # Ragged storage, pads only up to the requested length
+    idx = np.atleast_1d(self.ts_idxs[idx])
+    len_series = self.len_series[idx]
+    if length is None:
+        length = int(len_series.max()) if len(idx) else 0
+    len_series = np.minimum(len_series, length)
+    starts = self.ts_offsets[idx + 1] - len_series
+
+    rows_series = np.repeat(np.arange(len(idx)), len_series)
+    rows_stamps = np.arange(len_series.sum()) - np.repeat(np.cumsum(len_series) - len_series, len_series)
+
+    tensor = np.zeros((len(idx), len(self.stored_cols), length), dtype=np.float32)
+    tensor[rows_series, :, rows_stamps + (length - len_series)[rows_series]] = \
+        self.ts_values[starts[rows_series] + rows_stamps]
+
+    return self._insert_shared(t.from_numpy(tensor), idx, self.len_series[idx] - length)
+
+
+# Cell
+@patch
+def _get_channel_values(self: BaseDataset,
+                        col: str) -> np.ndarray:
+    """Gets the values of a temporal variable without padding.
+
+    Parameters
+    ----------
+    col: str
+        Temporal variable, one of stored_cols.
+
+    Returns
+    -------
+    Numpy array of shape (n_rows,) sorted by unique_id and ds.
+    """
+    channel = self.stored_cols.index(col)
+    if self.storage == 'ragged':
+        return self.ts_values[:, channel]
+
+    values = self.ts_tensor[:, channel, :].float().numpy()
+
+    return values[np.arange(self.max_len) >= (self.max_len - self.len_series)[:, None]]
+
+
+# Cell
+@patch
+def _insert_shared(self: BaseDataset,
+                   tensor: t.Tensor,
+                   ts_idxs: np.ndarray,
+                   first: np.ndarray) -> t.Tensor:
+    """Inserts the shared_cols in the temporal data of stored_cols,
+    zero outside the time series as the padding of the stored data.
+
+    Parameters
+    ----------
+    tensor: t.Tensor
+        Float32 tensor of shape (n, len(stored_cols), length).
+    ts_idxs: np.ndarray
+        Time series of the n rows of tensor.
+    first: np.ndarray
+        Stamp of each time series in the first column of tensor,
+        negative when tensor starts before the time series.
+
+    Returns
+    -------
+    Float32 tensor of shape (n, n_channels, length).
+    """
+    if not self.shared_cols:
+        return tensor
+
+    length, n_shared = tensor.size(-1), len(self.shared_cols)
+    len_series = self.len_series[ts_idxs]
+    starts = self.shared_starts[ts_idxs] + first # positions in shared_values
+    shared = np.empty((len(tensor), n_shared, length), dtype=np.float32)
+
+    # Windows of shared_values inside the time series, and stamp by stamp otherwise
+    inside = (first >= 0) & (first + length <= len_series)
+    if inside.any():
+        views = np.lib.stride_tricks.sliding_window_view(self.shared_values, length, axis=0)
+        shared[inside] = views[starts[inside]]
+    if not inside.all():
+        outside = ~inside
+        stamps = first[outside, None] + np.arange(length)
+        in_series = (stamps >= 0) & (stamps < len_series[outside, None])
+        outside_shared = np.zeros((outside.sum(), n_shared, length), dtype=np.float32)
+        outside_shared.transpose(0, 2, 1)[in_series] = self.shared_values[(starts[outside, None] + np.arange(length))[in_series]]
+        shared[outside] = outside_shared
+
+    stored = tensor.numpy()
+    full = np.empty((len(tensor), self.n_channels, length), dtype=np.float32)
+    for channel, col in enumerate(self.t_cols):
+        if col in self.shared_cols:
+            full[:, channel] = shared[:, self.shared_cols.index(col)]
+        else:
+            full[:, channel] = stored[:, self.stored_cols.index(col)]
+
+    return t.from_numpy(full)
+
+
+# Cell
+@patch
+def _open_panel(self: BaseDataset,
+                path: str) -> Tuple[None, np.memmap, np.ndarray, np.ndarray, np.ndarray,
+                                    np.memmap, List[str], List[str], str, int, int]:
+    """Opens a panel written with `write_panel`.
+
+    The rows of the time series and their ds are memory mapped,
+    so only the pages of the requested series are read from disk.
+
+    Parameters
+    ----------
+    path: str
+        Directory of the panel.
+
+    Returns
+    -------
+    Tuple of eleven elements:
+        - None, the panel has no dense tensor.
+        - Memory mapped array of shape (n_rows, n_channels).
+        - Numpy array with the length of each time series.
+        - Numpy array of static variables of shape (n_series, n_s).
+        - Numpy array of sorted unique_ids.
+        - Memory mapped array of sorted ds of all time series.
+        - List of temporal variables (including target and masks).
+        - List of statitc variables.
+        - Frequency of the time series.
+        - Number of X and S features.
+    """
+    with open(f'{path}/panel.json') as f:
+        panel = json.load(f)
+    ts_values = np.load(f'{path}/ts_values.npy', mmap_mode='r')
+    dss = np.load(f'{path}/ds.npy', mmap_mode='r')
+    len_series = np.load(f'{path}/len_series.npy')
+    s_data = np.load(f'{path}/s_matrix.npy')
+    uids = np.load(f'{path}/uids.npy')
+
+    return None, ts_values, len_series, s_data, uids, dss, \
+           panel['t_cols'], panel['s_cols'], panel['frequency'], panel['n_x'], panel['n_s']
+
+
+# Cell
+def _write_panel_meta(path: str,
+                      len_series: np.ndarray,
+                      s_matrix: np.ndarray,
+                      uids: np.ndarray,
+                      panel: dict) -> None:
+    """Writes the lengths, static matrix, unique_ids and columns of a panel."""
+    uids = np.asarray(uids)
+    uids = uids.astype(str) if uids.dtype == object else uids
+    np.save(f'{path}/len_series.npy', len_series)
+    np.save(f'{path}/s_matrix.npy', s_matrix)
+    np.save(f'{path}/uids.npy', uids)
+    with open(f'{path}/panel.json', 'w') as f:
+        json.dump(panel, f)
+
+def write_panel(path: str,
+                Y_df: pd.DataFrame,
+                X_df: Optional[pd.DataFrame] = None,
+                S_df: Optional[pd.DataFrame] = None,
+                mask_df: Optional[pd.DataFrame] = None,
+                ds_in_test: int = 0,
+                is_test: bool = False,
+                dtype: str = 'float32') -> None:
+    """Writes dataframes to an on-disk panel that datasets
+    open with memory mapping passing its path as Y_df.
+
+    The panel directory contains the rows of all time series
+    sorted by unique_id and ds (ts_values.npy, ds.npy), the length
+    of each time series, the static matrix, the unique_ids and
+    the temporal and static columns (panel.json).
+
+    Parameters
+    ----------
+    path: str
+        Directory of the panel, created if it does not exist.
+    Y_df: pd.DataFrame
+        Target time series with columns ['unique_id', 'ds', 'y'].
+    X_df: pd.DataFrame
+        Exogenous time series with columns ['unique_id', 'ds', 'y'].
+    S_df: pd.DataFrame
+        Static exogenous variables with columns ['unique_id', 'ds']
+        and static variables.
+    mask_df: pd.DataFrame
+        Outsample mask with columns ['unique_id', 'ds', 'sample_mask']
+        and optionally 'available_mask'.
+        Default None: constructs default mask based on ds_in_test.
+    ds_in_test: int
+        Only used when mask_df = None.
+        Numer of datestamps to use as outsample.
+    is_test: bool
+        Only used when mask_df = None.
+        Wheter target time series belongs to test set.
+    dtype: str
+        Storage dtype of the temporal data, 'float32' or 'float16'.
+    """
+    dataset = BaseDataset(Y_df=Y_df, X_df=X_df, S_df=S_df, mask_df=mask_df,
+                          ds_in_test=ds_in_test, is_test=is_test, storage='ragged', dtype=dtype)
+    os.makedirs(path, exist_ok=True)
+    np.save(f'{path}/ts_values.npy', dataset.ts_values)
+    np.save(f'{path}/ds.npy', dataset.meta_data.ds)
+    _write_panel_meta(path=path, len_series=dataset.len_series, s_matrix=dataset.s_matrix, uids=dataset.uids,
+                      panel={'t_cols': dataset.t_cols, 's_cols': dataset.s_cols, 'frequency': dataset.frequency,
+                             'n_x': dataset.n_x, 'n_s': dataset.n_s})
+
+# Cell
+def write_wide_panel(path: str,
+                     Y: np.ndarray,
+                     ds: np.ndarray,
+                     uids: np.ndarray,
+                     mask: Optional[np.ndarray] = None,
+                     X: Optional[Dict[str, np.ndarray]] = None,
+                     S_df: Optional[pd.DataFrame] = None,
+                     ds_in_test: int = 0,
+                     is_test: bool = False,
+                     dtype: str = 'float32',
+                     frequency: Optional[str] = None) -> None:
+    """Writes time series stored as wide matrices to an on-disk panel,
+    as `write_panel` does without the long format dataframes.
+
+    Row i of the wide matrices is the time series uids[i] and column j
+    its j-th ds. The observed entries of each row are written, sorted by
+    unique_id, channel by channel straight into the memory mapped
+    ts_values.npy, so the peak memory is about one wide matrix.
+
+    Parameters
+    ----------
+    path: str
+        Directory of the panel, created if it does not exist.
+    Y: np.ndarray
+        Target time series of shape (n_series, n_ds).
+    ds: np.ndarray
+        ds of the columns of shape (n_ds,), or of each entry
+        of shape (n_series, n_ds).
+    uids: np.ndarray
+        unique_id of each row of Y.
+    mask: np.ndarray
+        Boolean array of shape (n_series, n_ds) of the observed entries.
+        Default None: the entries of Y that are not NaN.
+    X: Dict[str, np.ndarray]
+        Exogenous variables by name, of shape (n_series, n_ds)
+        or (n_ds,) if equal for every time series.
+    S_df: pd.DataFrame
+        Static exogenous variables with columns ['unique_id']
+        and static variables.
+    ds_in_test: int
+        Numer of datestamps to use as outsample.
+    is_test: bool
+        Wheter target time series belongs to test set.
+    dtype: str
+        Storage dtype of the temporal data, 'float32' or 'float16'.
+    frequency: str
+        Frequency of the time series.
+        Default None: inferred from the first ds of datetime panels.
+    """
+    assert dtype in ['float32', 'float16'], f'dtype {dtype} not implemented for panels'
+    X = X or {}
+    uids = np.asarray(uids)
+    mask = ~np.isnan(Y) if mask is None else mask
+
+    # Rows sorted by unique_id, wide matrices are only permuted if needed
+    order = np.argsort(uids, kind='stable')
+    sorted_rows = np.array_equal(order, np.arange(len(uids)))
+    uids = uids[order]
+    if np.any(uids[1:] == uids[:-1]):
+        raise ValueError('Found duplicated unique_ids')
+    mask = mask if sorted_rows else mask[order]
+
+    def entries(values: np.ndarray) -> np.ndarray:
+        """Observed entries of a wide matrix, in the sorted rows."""
+        values = np.asarray(values)
+        if values.ndim == 1:
+            return np.broadcast_to(values, mask.shape)[mask]
+        return values[mask] if sorted_rows else values[order][mask]
+
+    len_series = mask.sum(axis=1).astype(np.int32)
+    assert np.all(len_series > 0), 'Every time series needs an observed ds'
+    offsets = np.append(0, np.cumsum(len_series))
+    t_cols = ['y'] + list(X.keys()) + ['available_mask', 'sample_mask']
+
+    os.makedirs(path, exist_ok=True)
+    ts_values = np.lib.format.open_memmap(f'{path}/ts_values.npy', mode='w+',
+                                          dtype=dtype, shape=(offsets[-1], len(t_cols)))
+    for channel, values in enumerate([Y] + list(X.values())):
+        ts_values[:, channel] = entries(values)
+    ts_values[:, -2] = 1
+    ts_values[:, -1] = _tail_mask(offsets, ds_in_test) == is_test
+    ts_values.flush()
+    del ts_values
+
+    dss = entries(ds)
+    np.save(f'{path}/ds.npy', dss)
+    if frequency is None and np.issubdtype(dss.dtype, np.datetime64):
+        frequency = pd.infer_freq(pd.DatetimeIndex(dss[:5]))
+
+    if S_df is None:
+        s_matrix, s_cols = np.zeros((len(uids), 0)), []
+    else:
+        S = S_df.sort_values('unique_id')
+        assert np.array_equal(S['unique_id'].values, uids), 'S_df must have one row per unique_id'
+        s_cols = [col for col in S.columns if col != 'unique_id']
+        s_matrix = S[s_cols].values
+    _write_panel_meta(path=path, len_series=len_series, s_matrix=s_matrix, uids=uids,
+                      panel={'t_cols': t_cols, 's_cols': s_cols, 'frequency': frequency,
+                             'n_x': len(X), 'n_s': len(s_cols)})
 
-    return len_series, ts_tensor
 
 # Cell
 @patch
@@ -273,6 +924,104 @@ def _get_f_idxs(self: BaseDataset,
 
     return f_idxs
 
+# Cell
+@patch
+def append(self: BaseDataset,
+           new_Y_df: pd.DataFrame,
+           new_X_df: Optional[pd.DataFrame] = None,
+           new_mask_df: Optional[pd.DataFrame] = None) -> None:
+    """Appends new observations of existing time series in place.
+
+    With dense storage ts_tensor is a view of a buffer that grows
+    amortized, so appending the same number of stamps to every
+    time series only writes the new rows. Series that receive fewer
+    stamps than the rest are shifted to keep the left padding.
+    With ragged storage the new rows are inserted in ts_values.
+
+    Parameters
+    ----------
+    new_Y_df: pd.DataFrame
+        New target observations with columns ['unique_id', 'ds', 'y'],
+        after the last ds of each time series.
+    new_X_df: pd.DataFrame
+        New exogenous observations with columns ['unique_id', 'ds']
+        and the exogenous variables of the dataset.
+    new_mask_df: pd.DataFrame
+        Mask of the new observations with columns ['unique_id', 'ds',
+        'available_mask', 'sample_mask'].
+        Default None: new observations are available and sampleable.
+    """
+    if isinstance(self.ts_values, np.memmap):
+        raise Exception('Memory mapped panels are read only, write a new panel instead.')
+    assert not self.shared_cols, 'Datasets with shared_cols can not be appended'
+    assert all([(col in new_Y_df) for col in ['unique_id', 'ds', 'y']])
+    if self.n_x > 0:
+        assert new_X_df is not None, 'new_X_df is required by the exogenous variables'
+        assert len(new_Y_df)==len(new_X_df), 'The dimensions of new_Y_df and new_X_df are not the same'
+    else:
+        new_X_df = new_Y_df[['unique_id', 'ds']]
+    if new_mask_df is None:
+        new_mask_df = new_Y_df[['unique_id', 'ds']].assign(available_mask=1, sample_mask=1)
+
+    y_order, uids, offsets = _sort_panel(new_Y_df)
+    x_order = _align_panel(new_X_df, new_Y_df, y_order, 'X')
+    m_order = _align_panel(new_mask_df, new_Y_df, y_order, 'M')
+
+    # Time series of the new rows
+    series = np.minimum(np.searchsorted(self.uids, uids), self.n_series - 1)
+    assert np.array_equal(self.uids[series], uids), 'Only existing unique_ids can be appended'
+    n_new = np.zeros(self.n_series, dtype=np.int32)
+    n_new[series] = np.diff(offsets)
+    rows_series = np.repeat(series, n_new[series])
+    dss = new_Y_df['ds'].values[y_order]
+    assert np.all(dss[offsets[:-1]] > self._meta_data.last_ds[series]), 'New ds must follow the last ds of each time series'
+
+    n_y = self.n_channels - self.n_x - 2
+    channels = [(new_Y_df, y_order, col) for col in self.t_cols[:n_y]] + \
+               [(new_X_df, x_order, col) for col in self.t_cols[n_y:-2]] + \
+               [(new_mask_df, m_order, col) for col in self.t_cols[-2:]]
+    values = np.empty((len(new_Y_df), self.n_channels), dtype=np.float32)
+    for channel, (df, order, col) in enumerate(channels):
+        values[:, channel] = df[col].values[order]
+
+    len_series = self.len_series + n_new
+    max_len = int(len_series.max())
+    if self.storage == 'ragged':
+        self.ts_values = np.insert(self.ts_values, self.ts_offsets[1:][rows_series], values, axis=0)
+    else:
+        # Amortized growth of the buffer
+        if self._ts_buffer.shape[-1] < max_len:
+            capacity = max(max_len, int(1.25 * self._ts_buffer.shape[-1]))
+            buffer = t.zeros((self.n_series, self.n_channels, capacity), dtype=self._ts_buffer.dtype)
+            buffer[..., :self.max_len] = self.ts_tensor
+            self._ts_buffer = buffer
+
+        # Keeps every time series ending at max_len
+        shifts = (max_len - n_new) - self.max_len
+        for shift in np.unique(shifts[shifts != 0]):
+            rows = t.as_tensor(np.flatnonzero(shifts == shift))
+            block = self._ts_buffer[rows, :, :self.max_len]
+            self._ts_buffer[rows, :, :max_len] = 0
+            if shift > 0:
+                self._ts_buffer[rows, :, shift:(shift + self.max_len)] = block
+            else:
+                self._ts_buffer[rows, :, :(self.max_len + shift)] = block[..., -shift:]
+
+        rows_stamps = np.arange(len(values)) - np.repeat(offsets[:-1], n_new[series]) \
+                      + (max_len - n_new)[rows_series]
+        self._ts_buffer[t.as_tensor(rows_series), :, t.as_tensor(rows_stamps)] = \
+            t.from_numpy(values).to(self._ts_buffer.dtype)
+        self.ts_tensor = self._ts_buffer[..., :max_len]
+
+    # Dataset attributes
+    self.len_series = len_series
+    self.ts_offsets = np.append(0, np.cumsum(self.len_series))
+    self.max_len = max_len
+    self._meta_data.append(series=series, n_new=n_new, ds=dss)
+
+    self._define_sampleable_ts_idxs()
+
+
 # Cell
 @patch
 def __getitem__(self: BaseDataset,
@@ -348,22 +1097,14 @@ def get_default_mask_df(Y_df: pd.DataFrame,
     Mask DataFrame with columns
     ['unique_id', 'ds', 'available_mask', 'sample_mask'].
     """
+    # Last ds_in_test rows of each time series, scattered back to the order of Y_df
+    order, _, offsets = _sort_panel(Y_df)
+    sample_mask = np.empty(len(Y_df), dtype=np.int64)
+    sample_mask[order] = _tail_mask(offsets, ds_in_test) == is_test
+
     mask_df = Y_df[['unique_id', 'ds']].copy()
     mask_df['available_mask'] = 1
-    mask_df['sample_mask'] = 1
-    mask_df = mask_df.set_index(['unique_id', 'ds'])
-
-    mask_df_s = mask_df.sort_values(by=['unique_id', 'ds'])
-    zero_idx = mask_df_s.groupby('unique_id').tail(ds_in_test).index
-    mask_df.loc[zero_idx, 'sample_mask'] = 0
-    mask_df = mask_df.reset_index()
-    mask_df.index = Y_df.index
-
-    assert len(mask_df)==len(Y_df), \
-        f'The mask_df length {len(mask_df)} is not equal to Y_df length {len(Y_df)}'
-
-    if is_test:
-        mask_df['sample_mask'] = 1 - mask_df['sample_mask']
+    mask_df['sample_mask'] = sample_mask
 
     return mask_df
 
@@ -376,22 +1117,27 @@ class TimeSeriesDataset(BaseDataset):
     """
 
     def __init__(self,
-                 Y_df: pd.DataFrame,
+                 Y_df: Union[pd.DataFrame, str],
                  input_size: int,
                  output_size: int,
                  X_df: Optional[pd.DataFrame] = None,
                  S_df: Optional[pd.DataFrame] = None,
                  f_cols: Optional[List] = None,
+                 shared_cols: Optional[List] = None,
                  mask_df: Optional[pd.DataFrame] = None,
                  ds_in_test: int = 0,
                  is_test: bool = False,
                  complete_windows: bool = True,
+                 storage: str = 'dense',
+                 dtype: str = 'float32',
+                 static_lookup: bool = False,
                  verbose: bool = False) -> 'TimeSeriesDataset':
         """
         Parameters
         ----------
-        Y_df: pd.DataFrame
-            Target time series with columns ['unique_id', 'ds', 'y'].
+        Y_df: Union[pd.DataFrame, str]
+            Target time series with columns ['unique_id', 'ds', 'y'],
+            or path of a panel written with `write_panel`.
         input_size: int
             Size of the training sets.
         output_size: int
@@ -403,6 +1149,9 @@ class TimeSeriesDataset(BaseDataset):
             and static variables.
         f_cols: list
             List of exogenous variables of the future.
+        shared_cols: list
+            List of exogenous variables equal for every time series
+            at the same ds, stored once per ds.
         mask_df: pd.DataFrame
             Outsample mask with columns ['unique_id', 'ds', 'sample_mask']
             and optionally 'available_mask'.
@@ -413,14 +1162,24 @@ class TimeSeriesDataset(BaseDataset):
         is_test: bool
             Only used when mask_df = None.
             Wheter target time series belongs to test set.
+        storage: str
+            Memory layout of the temporal data, one of 'dense' or 'ragged'.
+            Ragged batches are left padded to their longest series.
+        dtype: str
+            Storage dtype of the temporal data, one of 'float32', 'float16'
+            or 'bfloat16'. Batches are upcasted to float32.
+        static_lookup: bool
+            Whether batches leave out the static variables 'S',
+            models gather them from s_tensor with the batch 'idxs'.
         verbose: bool
             Wheter or not log outputs.
         """
         super(TimeSeriesDataset, self).__init__(Y_df=Y_df, input_size=input_size,
                                                 output_size=output_size,
-                                                X_df=X_df, S_df=S_df, f_cols=f_cols,
+                                                X_df=X_df, S_df=S_df, f_cols=f_cols, shared_cols=shared_cols,
                                                 mask_df=mask_df, ds_in_test=ds_in_test,
                                                 is_test=is_test, complete_windows=complete_windows,
+                                                storage=storage, dtype=dtype, static_lookup=static_lookup,
                                                 verbose=verbose)
 
 # Cell
@@ -437,7 +1196,7 @@ def __getitem__(self: TimeSeriesDataset,
     Returns
     -------
     Dictionary with keys:
-        - S
+        - S, unless static_lookup
         - Y
         - X
         - available_mask
@@ -453,18 +1212,20 @@ def __getitem__(self: TimeSeriesDataset,
         raise Exception('Use slices, int or list for getitem.')
 
     # Parse windows to elements of batch
-    S = t.Tensor(self.s_matrix[idx])
-    Y = self.ts_tensor[idx, self.t_cols.index('y'), :]
-    X = self.ts_tensor[idx, (self.t_cols.index('y') + 1):self.t_cols.index('available_mask'), :]
+    tensor = self._get_tensor(idx)
+    Y = tensor[:, self.t_cols.index('y'), :]
+    X = tensor[:, (self.t_cols.index('y') + 1):self.t_cols.index('available_mask'), :]
 
-    available_mask = self.ts_tensor[idx, self.t_cols.index('available_mask'), :]
-    sample_mask = self.ts_tensor[idx, self.t_cols.index('sample_mask'), :]
-    ts_idxs = t.as_tensor(idx, dtype=t.long)
+    available_mask = tensor[:, self.t_cols.index('available_mask'), :]
+    sample_mask = tensor[:, self.t_cols.index('sample_mask'), :]
+    ts_idxs = t.as_tensor(self.ts_idxs[idx], dtype=t.long)
 
-    batch = {'S': S, 'Y': Y, 'X': X,
+    batch = {'Y': Y, 'X': X,
              'available_mask': available_mask,
              'sample_mask': sample_mask,
              'idxs': ts_idxs}
+    if not self.static_lookup:
+        batch['S'] = self.s_tensor[idx]
 
     return batch
 
@@ -530,13 +1291,15 @@ class IterateWindowsDataset(BaseDataset):
 # Cell
 @patch
 def __getitem__(self: IterateWindowsDataset,
-                idx: int) -> Dict[str, t.Tensor]:
+                idx: Union[int, list]) -> Dict[str, t.Tensor]:
     """Creates batch based on index.
 
     Parameters
     ----------
     idx:
         Index of windowß to consider.
+        A list of indexes creates the batch of all its windows,
+        see `_gather_windows`.
 
     Returns
     -------
@@ -549,6 +1312,8 @@ def __getitem__(self: IterateWindowsDataset,
         - idxs
     """
     # Checks for idx
+    if isinstance(idx, list):
+        return self._gather_windows(idx)
     if not isinstance(idx, int):
         raise Exception('idx should be an integer')
 
@@ -558,7 +1323,7 @@ def __getitem__(self: IterateWindowsDataset,
 
     # Parse windows to elements of batch
     end = idx + self.input_size + self.output_size
-    S = t.Tensor(self.s_matrix)
+    S = self.s_tensor
     Y = self.ts_tensor[:, self.t_cols.index('y'), idx:end]
     X = self.ts_tensor[:, (self.t_cols.index('y') + 1):self.t_cols.index('available_mask'), idx:end]
 
@@ -573,6 +1338,61 @@ def __getitem__(self: IterateWindowsDataset,
 
     return batch
 
+# Cell
+@patch
+def _gather_windows(self: IterateWindowsDataset,
+                    idxs: List[int]) -> Dict[str, t.Tensor]:
+    """Creates batch with the windows of idxs, stacked as the
+    default collate stacks the windows of `__getitem__`.
+
+    Every variable is gathered with a single advanced indexing op
+    over a strided window view of ts_tensor. DataLoaders get the whole
+    batch of indexes using a `BatchSampler` as sampler and batch_size=None.
+
+    Parameters
+    ----------
+    idxs:
+        Indexes of windows to consider.
+
+    Returns
+    -------
+    Dictionary with keys:
+        - S
+        - Y
+        - X
+        - available_mask
+        - sample_mask
+        - idxs
+    """
+    idxs = np.asarray(idxs, dtype=np.int64)
+
+    # Add first sampleable stamp and shift by input_size if possible (this will never happen during training)
+    if self.first_sampleable_stamps + 1 > self.input_size:
+        idxs = idxs + self.first_sampleable_stamps - self.input_size
+    ts_values = self.ts_tensor.numpy()
+
+    def gather(channels):
+        # (n_series, [n_channels,] n_windows, windows_size) view to (len(idxs), n_series, [n_channels,] windows_size)
+        views = np.lib.stride_tricks.sliding_window_view(ts_values[:, channels], self.input_size + self.output_size, axis=-1)
+        return t.from_numpy(np.moveaxis(views, -2, 0)[idxs])
+
+    # Parse windows to elements of batch
+    S = self.s_tensor.expand(len(idxs), -1, -1).contiguous()
+    Y = gather(self.t_cols.index('y'))
+    X = gather(slice(self.t_cols.index('y') + 1, self.t_cols.index('available_mask')))
+
+    available_mask = gather(self.t_cols.index('available_mask'))
+    sample_mask = gather(self.t_cols.index('sample_mask'))
+    ts_idxs = t.arange(self.n_series).expand(len(idxs), -1).contiguous()
+
+    batch = {'S': S, 'Y': Y, 'X': X,
+             'available_mask': available_mask,
+             'sample_mask': sample_mask,
+             'idxs': ts_idxs}
+
+    return batch
+
+
 # Cell
 @patch
 def __len__(self: IterateWindowsDataset):
@@ -588,24 +1408,29 @@ class WindowsDataset(BaseDataset):
     """
 
     def __init__(self,
-                 Y_df: pd.DataFrame,
+                 Y_df: Union[pd.DataFrame, str],
                  input_size: int,
                  output_size: int,
                  X_df: Optional[pd.DataFrame] = None,
                  S_df: Optional[pd.DataFrame] = None,
                  f_cols: Optional[List] = None,
+                 shared_cols: Optional[List] = None,
                  mask_df: Optional[pd.DataFrame] = None,
                  ds_in_test: int = 0,
                  is_test: bool = False,
                  sample_freq: int = 1,
                  complete_windows: bool = False,
                  last_window: bool = False,
+                 storage: str = 'dense',
+                 dtype: str = 'float32',
+                 static_lookup: bool = False,
                  verbose: bool = False) -> 'TimeSeriesDataset':
         """
         Parameters
         ----------
-        Y_df: pd.DataFrame
-            Target time series with columns ['unique_id', 'ds', 'y'].
+        Y_df: Union[pd.DataFrame, str]
+            Target time series with columns ['unique_id', 'ds', 'y'],
+            or path of a panel written with `write_panel`.
         input_size: int
             Size of the training sets.
         output_size: int
@@ -617,6 +1442,9 @@ class WindowsDataset(BaseDataset):
             and static variables.
         f_cols: list
             List of exogenous variables of the future.
+        shared_cols: list
+            List of exogenous variables equal for every time series
+            at the same ds, stored once per ds.
         mask_df: pd.DataFrame
             Outsample mask with columns ['unique_id', 'ds', 'sample_mask']
             and optionally 'available_mask'.
@@ -630,14 +1458,24 @@ class WindowsDataset(BaseDataset):
         last_window: bool
             Only used for forecast (test)
             Wheter the dataset will include only last window for each time serie.
+        storage: str
+            Memory layout of the temporal data, one of 'dense' or 'ragged'.
+            Ragged batches are left padded to their longest series.
+        dtype: str
+            Storage dtype of the temporal data, one of 'float32', 'float16'
+            or 'bfloat16'. Batches are upcasted to float32.
+        static_lookup: bool
+            Whether batches leave out the static variables 'S',
+            models gather them from s_tensor with the batch 'idxs'.
         verbose: bool
             Wheter or not log outputs.
         """
         super(WindowsDataset, self).__init__(Y_df=Y_df, input_size=input_size,
                                              output_size=output_size,
-                                             X_df=X_df, S_df=S_df, f_cols=f_cols,
+                                             X_df=X_df, S_df=S_df, f_cols=f_cols, shared_cols=shared_cols,
                                              mask_df=mask_df, ds_in_test=ds_in_test,
                                              is_test=is_test, complete_windows=complete_windows,
+                                             storage=storage, dtype=dtype, static_lookup=static_lookup,
                                              verbose=verbose)
         # WindowsDataset parameters
         self.windows_size = self.input_size + self.output_size
@@ -646,57 +1484,83 @@ class WindowsDataset(BaseDataset):
         self.last_window = last_window
         self.device = 'cuda' if t.cuda.is_available() else 'cpu'
 
+        # Sampleable windows index, CSR by series
+        self.windows_starts, self.windows_offsets = self._build_windows_index()
+
 # Cell
 @patch
-def _create_windows_tensor(self: WindowsDataset,
-                           idx: slice) -> Tuple[t.Tensor, t.Tensor, t.Tensor]:
-    """Creates windows of size windows_size from
-    the ts_tensor of the TimeSeriesDataset filtered by
-    window_sampling_limit and ts_idxs. The step of each window
-    is defined by idx_to_sample_freq.
+def _build_windows_index(self: WindowsDataset) -> Tuple[np.ndarray, np.ndarray]:
+    """Builds the index of sampleable windows of all time series.
 
-    Parameters
-    ----------
-    index: slice
-        Indexes of time series to consider.
+    Windows are taken every sample_freq stamps of the left padded
+    time series, as unfolding the padded ts_tensor would, and are
+    kept if they fulfill the sample_mask, complete_windows and
+    last_window conditions.
 
     Returns
     -------
-    Tuple of three elements:
-        - Windows tensor of shape (windows, channels, input_size + output_size)
-        - Static variables tensor of shape (windows * series, n_static)
-        - Time Series indexes for each window.
+    Tuple of two elements:
+        - Numpy array with the first output stamp of each window,
+          relative to the start of its time series.
+        - Numpy array of shape (n_series + 1,) with the offsets of
+          the windows of each time series.
     """
-    # Default ts_idxs=ts_idxs sends all the data, otherwise filters series
-    tensor = self.ts_tensor[idx, :, self.first_ds:]
+    len_series = self.len_series.astype(np.int64)
+    pad_len = self.max_len - len_series
 
-    padder = t.nn.ConstantPad1d(padding=self.padding, value=0)
-    tensor = padder(tensor)
+    if self.last_window:
+        starts = (self.max_len // self.sample_freq) * self.sample_freq - pad_len
+        return starts.astype(np.int32), np.arange(self.n_series + 1)
+
+    # Candidate windows with at least one output stamp inside the time series
+    first = np.maximum(-pad_len, 1 - self.output_size)
+    first += (-pad_len - first) % self.sample_freq
+    n_windows = np.maximum((len_series - 1 - first) // self.sample_freq + 1, 0)
+    series = np.repeat(np.arange(self.n_series), n_windows)
+    steps = np.arange(n_windows.sum()) - np.repeat(np.cumsum(n_windows) - n_windows, n_windows)
+    starts = first[series] + steps * self.sample_freq
+    del steps
+
+    # Number of sampled stamps in the output of each window
+    sample_mask = self._get_channel_values('sample_mask') > 0 # Converts continuous sample_mask (with weights) to 0-1
+    cum_mask = np.append(0, np.cumsum(sample_mask))
+    offsets = self.ts_offsets[series]
+    ends = np.minimum(starts + self.output_size, len_series[series])
+    n_sampled = cum_mask[offsets + ends] - cum_mask[offsets + np.maximum(starts, 0)]
+    del offsets, ends
 
-    # Creating rolling windows and 'flattens' them
-    tensor = tensor.to(self.device)
-    windows = tensor.unfold(dimension=-1,
-                            size=self.windows_size,
-                            step=self.sample_freq)
-    # n_serie, n_channel, n_time, window_size -> n_serie, n_time, n_channel, window_size
-    windows = windows.permute(0, 2, 1, 3)
-    windows = windows.reshape(-1, self.n_channels, self.windows_size)
+    if self.complete_windows:
+        sampleable = n_sampled == self.output_size
+    else:
+        sampleable = n_sampled > 0
 
-    # Broadcast s_matrix: This works because unfold in windows_tensor, orders: serie, time
+    starts, series = starts[sampleable], series[sampleable]
+    windows_offsets = np.searchsorted(series, np.arange(self.n_series + 1))
 
-    ts_idxs = self.ts_idxs[idx]
-    n_ts = len(ts_idxs)
-    windows_per_serie = len(windows) / n_ts
+    return starts.astype(np.int32), windows_offsets
 
-    ts_idxs = ts_idxs.repeat(repeats=windows_per_serie)
-    s_matrix = self.s_matrix[idx]
-    s_matrix = s_matrix.repeat(repeats=windows_per_serie, axis=0)
 
-    s_matrix = t.Tensor(s_matrix)
-    ts_idxs = t.as_tensor(ts_idxs, dtype=t.long)
+# Cell
+@patch
+def _get_windows_idxs(self: WindowsDataset,
+                      idx: Union[slice, int, list, np.ndarray]) -> np.ndarray:
+    """Gets the positions in the windows index of the
+    sampleable windows of the idx time series.
+
+    Parameters
+    ----------
+    idx: Union[slice, int, list, np.ndarray]
+        Indexes of time series to consider.
 
-    windows_idxs = self._get_sampleable_windows_idxs(ts_windows_flatten=windows,
-                                                     ts_idxs=ts_idxs)
+    Returns
+    -------
+    Numpy array of positions in windows_starts.
+    """
+    ts_idxs = np.atleast_1d(self.ts_idxs[idx])
+    first = self.windows_offsets[ts_idxs]
+    n_windows = self.windows_offsets[ts_idxs + 1] - first
+    windows_idxs = np.repeat(first - (np.cumsum(n_windows) - n_windows), n_windows) \
+                   + np.arange(n_windows.sum())
 
     # Raise error if nothing to sample from
     if not windows_idxs.size:
@@ -706,59 +1570,92 @@ def _create_windows_tensor(self: WindowsDataset,
             'input_size, output_size, masks.'
         )
 
-    # Index the windows and s_matrix tensors of batch
-    windows = windows[windows_idxs]
-    s_matrix = s_matrix[windows_idxs]
-    ts_idxs = ts_idxs[windows_idxs]
+    return windows_idxs
 
-    return windows, s_matrix, ts_idxs
 
 # Cell
 @patch
-#TODO: do we want complete? inputs seems irrelevant, NBEATS dont use it, for now is our only model
-def _get_sampleable_windows_idxs(self: WindowsDataset,
-                                 ts_windows_flatten: t.Tensor,
-                                 ts_idxs: t.Tensor) -> np.ndarray:
-    """Gets indexes of windows that fulfills conditions.
+def _gather_windows(self: WindowsDataset,
+                    windows_idxs: np.ndarray) -> Dict[str, t.Tensor]:
+    """Creates batch with the windows_idxs windows of the index,
+    padding with zeros the stamps outside their time series.
+
+    Windows inside the stored data are copied from strided
+    window views of ts_tensor or ts_values, so only the batch
+    is allocated. The stamps of the few windows that cross
+    the bounds of the stored series are gathered one by one.
+    The shared_cols are broadcast from shared_values.
 
     Parameters
     ----------
-    ts_windows_flatten: t.Tensor
-        Tensor of shape (windows, n_channels, windows_size)
+    windows_idxs: np.ndarray
+        Positions in windows_starts.
 
     Returns
     -------
-    Numpy array of indexes of ts_windows_flatten that
-    fulfills conditions.
-
-    Notes
-    -----
+    Dictionary with keys:
+        - S, unless static_lookup
+        - Y
+        - X
+        - available_mask
+        - sample_mask
+        - idxs
     """
+    ts_idxs = np.searchsorted(self.windows_offsets, windows_idxs, side='right') - 1
+    windows = np.empty((len(windows_idxs), len(self.stored_cols), self.windows_size), dtype=np.float32)
+
+    # First stamp of each window relative to the start of its time series,
+    # and positions of the time series starts in ts_values rows or ts_tensor columns
+    first = self.windows_starts[windows_idxs].astype(np.int64) - self.input_size
+    len_series = self.len_series[ts_idxs]
+    if self.storage == 'ragged':
+        starts = self.ts_offsets[ts_idxs]
+        inside = (first >= 0) & (first + self.windows_size <= len_series)
+    else:
+        starts = self.max_len - len_series
+        inside = (starts + first >= 0) & (first + self.windows_size <= len_series) # left padding is zero
 
-    if self.last_window:
-        _, idxs_counts = t.unique(ts_idxs, return_counts=True)
-        last_idxs = idxs_counts.cumsum(0) - 1
-        last_idxs = last_idxs.numpy()
-
-        return last_idxs
+    if inside.any():
+        if self.storage == 'ragged':
+            views = np.lib.stride_tricks.sliding_window_view(self.ts_values, self.windows_size, axis=0)
+            windows[inside] = views[(starts + first)[inside]]
+        else:
+            views = self.ts_tensor.unfold(-1, self.windows_size, 1)
+            windows[inside] = views[t.as_tensor(ts_idxs[inside]), :,
+                                    t.as_tensor((starts + first)[inside])].float().numpy()
+
+    # Windows crossing the bounds, zero outside their time series
+    if not inside.all():
+        outside = ~inside
+        stamps = first[outside, None] + np.arange(self.windows_size)
+        in_series = (stamps >= 0) & (stamps < len_series[outside, None])
+        positions = (starts[outside, None] + stamps)[in_series]
+        outside_windows = np.zeros((outside.sum(), len(self.stored_cols), self.windows_size), dtype=np.float32)
+        outside_view = outside_windows.transpose(0, 2, 1)
+        if self.storage == 'ragged':
+            outside_view[in_series] = self.ts_values[positions]
+        else:
+            series = np.broadcast_to(ts_idxs[outside, None], stamps.shape)[in_series]
+            outside_view[in_series] = self.ts_tensor[t.as_tensor(series), :, t.as_tensor(positions)].float().numpy()
+        windows[outside] = outside_windows
+    windows = self._insert_shared(t.from_numpy(windows), ts_idxs, first)
 
-    if self.complete_windows:
-        sample_condition = ts_windows_flatten[:, self.t_cols.index('sample_mask'), -(self.output_size):]
-        sample_condition = (sample_condition > 0) * 1 # Converts continuous sample_mask (with weights) to 0-1
-        sample_condition = t.sum(sample_condition, axis=1)
-        sample_condition = (sample_condition == self.output_size) * 1
+    # Parse windows to elements of batch
+    Y = windows[:, self.t_cols.index('y'), :]
+    X = windows[:, (self.t_cols.index('y') + 1):self.t_cols.index('available_mask'), :]
+    available_mask = windows[:, self.t_cols.index('available_mask'), :]
+    sample_mask = windows[:, self.t_cols.index('sample_mask'), :]
+    ts_idxs = t.as_tensor(self.ts_idxs[ts_idxs], dtype=t.long)
 
-    else:
-        sample_condition = ts_windows_flatten[:, self.t_cols.index('sample_mask'), -self.output_size:]
-        sample_condition = (sample_condition > 0) * 1 # Converts continuous sample_mask (with weights) to 0-1
-        sample_condition = t.sum(sample_condition, axis=1)
-        sample_condition = (sample_condition > 0) * 1
+    batch = {'Y': Y, 'X': X,
+             'available_mask': available_mask,
+             'sample_mask': sample_mask,
+             'idxs': ts_idxs}
+    if not self.static_lookup:
+        batch['S'] = self.s_tensor[ts_idxs]
 
-    sampling_idx = t.nonzero(sample_condition > 0)
-    sampling_idx = sampling_idx.cpu().detach().numpy()
-    sampling_idx = sampling_idx.flatten()
+    return batch
 
-    return sampling_idx
 
 # Cell
 @patch
@@ -774,7 +1671,7 @@ def __getitem__(self: WindowsDataset,
     Returns
     -------
     Dictionary with keys:
-        - S
+        - S, unless static_lookup
         - Y
         - X
         - available_mask
@@ -789,18 +1686,100 @@ def __getitem__(self: WindowsDataset,
     else:
         raise Exception('Use slices, int or list for getitem.')
 
-    # Create windows for each sampled ts and sample random unmasked windows from each ts
-    windows, S, ts_idxs = self._create_windows_tensor(idx=idx)
+    # Gathers all the sampleable windows of each ts
+    windows_idxs = self._get_windows_idxs(idx=idx)
+    batch = self._gather_windows(windows_idxs=windows_idxs)
 
-    # Parse windows to elements of batch
-    Y = windows[:, self.t_cols.index('y'), :]
-    X = windows[:, (self.t_cols.index('y') + 1):self.t_cols.index('available_mask'), :]
-    available_mask = windows[:, self.t_cols.index('available_mask'), :]
-    sample_mask = windows[:, self.t_cols.index('sample_mask'), :]
+    return batch
 
-    batch = {'S': S, 'Y': Y, 'X': X,
-             'available_mask': available_mask,
-             'sample_mask': sample_mask,
-             'idxs': ts_idxs}
+# Cell
+@patch
+def __getitems__(self: WindowsDataset,
+                 idxs: List[int]) -> List[np.ndarray]:
+    """Gets the positions of the sampleable windows of a batch
+    of time series.
+
+    Called by the `DataLoader` of torch>=2.0 instead of one
+    `__getitem__` per time series, so that `TimeSeriesLoader`
+    draws the windows of the batch and only gathers those.
+
+    Parameters
+    ----------
+    idxs: List[int]
+        Indexes of time series to consider.
 
-    return batch
\ No newline at end of file
+    Returns
+    -------
+    List with the numpy array of positions in windows_starts.
+    """
+    return [self._get_windows_idxs(idx=list(idxs))]
+
+
+# Cell
+@patch
+def append(self: WindowsDataset,
+           new_Y_df: pd.DataFrame,
+           new_X_df: Optional[pd.DataFrame] = None,
+           new_mask_df: Optional[pd.DataFrame] = None) -> None:
+    """Appends new observations of existing time series in place
+    and rebuilds the sampleable windows index.
+
+    Parameters
+    ----------
+    new_Y_df: pd.DataFrame
+        New target observations with columns ['unique_id', 'ds', 'y'],
+        after the last ds of each time series.
+    new_X_df: pd.DataFrame
+        New exogenous observations with columns ['unique_id', 'ds']
+        and the exogenous variables of the dataset.
+    new_mask_df: pd.DataFrame
+        Mask of the new observations with columns ['unique_id', 'ds',
+        'available_mask', 'sample_mask'].
+        Default None: new observations are available and sampleable.
+    """
+    BaseDataset.append(self, new_Y_df=new_Y_df, new_X_df=new_X_df, new_mask_df=new_mask_df)
+    self.windows_starts, self.windows_offsets = self._build_windows_index()
+
+
+# Cell
+@patch
+def with_windows(self: WindowsDataset,
+                 input_size: int,
+                 output_size: int,
+                 sample_freq: int = 1,
+                 complete_windows: bool = False,
+                 last_window: bool = False) -> 'WindowsDataset':
+    """Creates a dataset with other windows of the same time series.
+
+    Only the sampleable windows index is built, the temporal and
+    static data are shared with this dataset and must not be appended.
+
+    Parameters
+    ----------
+    input_size: int
+        Size of the training sets.
+    output_size: int
+        Forecast horizon.
+    sample_freq: int
+        Step size between windows.
+    complete_windows: bool
+        Whether consider only windows with sample_mask equal to output_size.
+    last_window: bool
+        Wheter the dataset will include only last window for each time serie.
+
+    Returns
+    -------
+    WindowsDataset with the new windows.
+    """
+    dataset = copy.copy(self)
+    dataset.input_size = input_size
+    dataset.output_size = output_size
+    dataset.windows_size = input_size + output_size
+    dataset.padding = (input_size, output_size)
+    dataset.sample_freq = sample_freq
+    dataset.complete_windows = complete_windows
+    dataset.last_window = last_window
+    dataset._define_sampleable_ts_idxs()
+    dataset.windows_starts, dataset.windows_offsets = dataset._build_windows_index()
+
+    return dataset
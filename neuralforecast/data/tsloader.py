@@ -1,6 +1,6 @@
 # AUTOGENERATED! DO NOT EDIT! File to edit: nbs/data__tsloader.ipynb (unless otherwise specified).
 
-__all__ = ['TimeSeriesLoader', 'FastTimeSeriesLoader']
+__all__ = ['TimeSeriesLoader', 'LengthBucketSampler', 'FastTimeSeriesLoader']
 
 # Cell
 import warnings
@@ -10,10 +10,18 @@ from typing import Dict, List, Optional, Union
 import numpy as np
 import torch as t
 from fastcore.foundation import patch
-from torch.utils.data import DataLoader
+from torch.utils.data import DataLoader, Sampler
 
 from .tsdataset import TimeSeriesDataset, WindowsDataset
 
+# Cell
+def _worker_init_fn(worker_id: int) -> None:
+    """Seeds numpy in each worker process from its torch seed,
+    so that windows sampling is deterministic given the seed
+    of the main process and different across workers."""
+    np.random.seed(t.initial_seed() % 2**32)
+
+
 # Cell
 class TimeSeriesLoader(DataLoader):
 
@@ -41,10 +49,22 @@ class TimeSeriesLoader(DataLoader):
         n_windows: int
             Number of windows to sample after
             batching batch_size series.
+
+        Notes
+        -----
+        With `num_workers > 0` the batches are built by worker processes
+        and prefetched, while the time series tensor of the dataset
+        is moved to shared memory. Each worker seeds numpy
+        from its torch seed unless `worker_init_fn` is given.
         """
         if 'collate_fn' in kwargs:
             kwargs.pop('collate_fn')
 
+        if kwargs.get('num_workers', 0) > 0:
+            kwargs.setdefault('worker_init_fn', _worker_init_fn)
+            if getattr(dataset, 'ts_tensor', None) is not None:
+                dataset.ts_tensor.share_memory_()
+
         kwargs_ = {**kwargs, **dict(collate_fn=self._collate_fn)}
         DataLoader.__init__(self, dataset=dataset, **kwargs_)
         self.eq_batch_size = eq_batch_size
@@ -60,6 +80,17 @@ def _check_batch_size(self: TimeSeriesLoader, batch: t.Tensor) -> t.Tensor:
 
     return complete_batch
 
+# Cell
+@patch
+def _sample_w_idxs(self: TimeSeriesLoader, n_windows: int) -> None:
+    if self.eq_batch_size and self.batch_size is not None:
+        self.w_idxs = np.random.choice(n_windows, size=self.batch_size,
+                                       replace=(n_windows < self.batch_size))
+    if not self.eq_batch_size and self.n_windows is not None:
+        self.w_idxs = np.random.choice(n_windows, size=self.n_windows,
+                                       replace=(n_windows < self.n_windows))
+
+
 # Cell
 @patch
 def _collate_fn(self: TimeSeriesLoader, batch: Union[List, Dict[str, t.Tensor], t.Tensor]):
@@ -75,7 +106,20 @@ def _collate_fn(self: TimeSeriesLoader, batch: Union[List, Dict[str, t.Tensor],
 
     elem_type = type(elem)
 
-    if isinstance(elem, t.Tensor):
+    if isinstance(elem, np.ndarray):
+        # Windows positions from WindowsDataset.__getitems__,
+        # draws the windows before gathering them
+        windows_idxs = np.concatenate(batch)
+        self._sample_w_idxs(n_windows=len(windows_idxs))
+        if self.w_idxs is not None:
+            windows_idxs = windows_idxs[self.w_idxs]
+        return self.dataset._gather_windows(windows_idxs=windows_idxs)
+
+    elif isinstance(elem, t.Tensor):
+        # Left pads temporal tensors of ragged datasets to the longest one
+        length = max(x.size(-1) for x in batch)
+        if elem.dim() > 1 and any(x.size(-1) != length for x in batch):
+            batch = [t.nn.functional.pad(x, (length - x.size(-1), 0)) for x in batch]
         out = None
         if t.utils.data.get_worker_info() is not None:
             # If we're in a background process, concatenate directly into a
@@ -89,16 +133,138 @@ def _collate_fn(self: TimeSeriesLoader, batch: Union[List, Dict[str, t.Tensor],
     elif isinstance(elem, Mapping):
         n_windows = [elem_['Y'].size(0) for elem_ in batch]
         n_windows = sum(n_windows)
-        if self.eq_batch_size and self.batch_size is not None:
-            self.w_idxs = np.random.choice(n_windows, size=self.batch_size,
-                                           replace=(n_windows < self.batch_size))
-        if not self.eq_batch_size and self.n_windows is not None:
-            self.w_idxs = np.random.choice(n_windows, size=self.n_windows,
-                                           replace=(n_windows < self.n_windows))
+        self._sample_w_idxs(n_windows=n_windows)
         return {key: self.collate_fn([d[key] for d in batch]) for key in elem}
 
     raise TypeError(f'Unknown {elem_type}')
 
+# Cell
+class LengthBucketSampler(Sampler):
+    """
+    Batch sampler of a `TimeSeriesDataset` that groups time series
+    of similar length, and similar first sampleable stamp, in the same
+    batches. Models trained on complete time series, like ESRNN,
+    trim or pad every batch to a common range, so batches of series
+    with similar lengths waste less of it than random batches.
+    """
+
+    def __init__(self, dataset: TimeSeriesDataset,
+                 batch_size: int,
+                 shuffle: bool = True,
+                 pool_batches: Optional[int] = None,
+                 drop_last: bool = False) -> 'LengthBucketSampler':
+        """
+        Parameters
+        ----------
+        dataset: TimeSeriesDataset
+            Stored time series.
+        batch_size: int
+            Number of time series of each batch.
+        shuffle: bool
+            If `True`, every epoch draws the series of each pool at random,
+            breaks ties between series of equal length at random
+            and shuffles the order of the batches.
+        pool_batches: int
+            Number of batches of each pool of random series sorted by length.
+            Smaller pools keep the batches closer to a random shuffle.
+            Default None: a single pool with all series, the tightest buckets.
+        drop_last: bool
+            If `True`, drops the last batch of each pool when it is incomplete.
+        """
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.pool_batches = pool_batches
+        self.drop_last = drop_last
+        self.len_series = np.asarray(dataset.len_series)
+        self.n_series = len(self.len_series)
+
+        # First stamp with sample_mask of each series in left padded tensors,
+        # max_len for series without sampleable stamps
+        offsets = dataset.ts_offsets
+        sample_mask = dataset._get_channel_values('sample_mask')
+        stamps = np.arange(offsets[-1]) - np.repeat(offsets[:-1], self.len_series)
+        stamps = np.where(sample_mask > 0, stamps, np.repeat(self.len_series, self.len_series))
+        first_sampleable = np.minimum.reduceat(stamps, offsets[:-1]) if offsets[-1] else stamps
+        self.first_sampleable = dataset.max_len - self.len_series + first_sampleable
+
+        self.batches: Optional[List[np.ndarray]] = None
+
+
+# Cell
+@patch
+def _get_batches(self: LengthBucketSampler) -> List[np.ndarray]:
+    """Splits the series of each pool, sorted by length
+    and first sampleable stamp, in batches."""
+    idxs = np.random.permutation(self.n_series) if self.shuffle else np.arange(self.n_series)
+    pool_size = self.n_series if self.pool_batches is None else self.pool_batches * self.batch_size
+
+    batches = []
+    for start in range(0, self.n_series, max(pool_size, 1)):
+        pool = idxs[start:(start + pool_size)]
+        # Stable sort, random tie breaks when pools are shuffled
+        pool = pool[np.lexsort((self.first_sampleable[pool], self.len_series[pool]))]
+        pool_batches = [pool[i:(i + self.batch_size)] for i in range(0, len(pool), self.batch_size)]
+        if self.drop_last and len(pool_batches[-1]) < self.batch_size:
+            pool_batches = pool_batches[:-1]
+        batches += pool_batches
+
+    if self.shuffle:
+        batches = [batches[i] for i in np.random.permutation(len(batches))]
+
+    return batches
+
+
+# Cell
+@patch
+def __iter__(self: LengthBucketSampler):
+    self.batches = self._get_batches()
+    for batch in self.batches:
+        yield batch.tolist()
+
+
+# Cell
+@patch
+def __len__(self: LengthBucketSampler) -> int:
+    pool_size = self.n_series if self.pool_batches is None else self.pool_batches * self.batch_size
+    n_pools, remainder = divmod(self.n_series, max(pool_size, 1))
+    if self.drop_last:
+        return n_pools * (pool_size // self.batch_size) + remainder // self.batch_size
+
+    return n_pools * -(-pool_size // self.batch_size) + -(-remainder // self.batch_size)
+
+
+# Cell
+@patch
+def padding_fraction(self: LengthBucketSampler,
+                     batches: List[np.ndarray]) -> float:
+    """Fraction of the stamps of the batches, padded to their
+    longest series, that are padding."""
+    if not batches:
+        return 0.
+    len_series = [self.len_series[batch] for batch in batches]
+    padded = sum(len(lens) * lens.max() for lens in len_series)
+
+    return 1 - sum(lens.sum() for lens in len_series) / padded
+
+
+# Cell
+@patch
+def padding_saved(self: LengthBucketSampler, seed: int = 1) -> float:
+    """Padding fraction of random batches of batch_size series, drawn
+    with `seed`, minus the padding fraction of the batches of the last
+    epoch. The global numpy random state is left unchanged."""
+    if self.batches is not None:
+        batches = self.batches
+    else:
+        state = np.random.get_state()
+        batches = self._get_batches()
+        np.random.set_state(state)
+    idxs = np.random.default_rng(seed).permutation(self.n_series)
+    random_batches = [idxs[i:(i + self.batch_size)] for i in range(0, self.n_series, self.batch_size)]
+
+    return self.padding_fraction(random_batches) - self.padding_fraction(batches)
+
+
 # Cell
 class FastTimeSeriesLoader:
     """
@@ -114,7 +280,10 @@ class FastTimeSeriesLoader:
     def __init__(self, dataset: TimeSeriesDataset, batch_size: int = 32,
                  eq_batch_size: bool = False,
                  n_windows: Optional[int] = None,
-                 shuffle: bool = False) -> 'FastTimeSeriesLoader':
+                 shuffle: bool = False,
+                 num_workers: int = 0,
+                 pin_memory: bool = False,
+                 prefetch_factor: int = 2) -> 'FastTimeSeriesLoader':
         """Initialize a FastTimeSeriesLoader.
 
         The TimeSeriesDataset constructs all the trainable windows
@@ -136,6 +305,14 @@ class FastTimeSeriesLoader:
         shuffle: bool
             If `True`, shuffle the data *in-place* whenever an
             iterator is created out of this object.
+        num_workers: int
+            Number of worker processes that build the batches.
+            Default 0: batches are built in the main process.
+        pin_memory: bool
+            If `True`, batches are copied to pinned memory.
+            Only used when num_workers > 0.
+        prefetch_factor: int
+            Number of batches prefetched by each worker.
         """
         self.dataset = dataset
         self.dataset_len = len(dataset)
@@ -143,6 +320,9 @@ class FastTimeSeriesLoader:
         self.eq_batch_size = eq_batch_size
         self.n_windows = n_windows
         self.shuffle = shuffle
+        self.num_workers = num_workers
+        self.pin_memory = pin_memory
+        self.prefetch_factor = prefetch_factor
         self.idxs = np.arange(self.dataset_len)
 
         # Calculate # batches
@@ -159,6 +339,16 @@ def __iter__(self: FastTimeSeriesLoader):
         self.idxs = np.random.permutation(self.dataset_len)
 
     self.i = 0
+    if self.num_workers > 0:
+        # Workers build the batches of this epoch and fill a bounded queue
+        if getattr(self.dataset, 'ts_tensor', None) is not None:
+            self.dataset.ts_tensor.share_memory_()
+        loader = DataLoader(dataset=self, batch_size=None, shuffle=False,
+                            num_workers=self.num_workers, pin_memory=self.pin_memory,
+                            prefetch_factor=self.prefetch_factor,
+                            worker_init_fn=_worker_init_fn)
+        return iter(loader)
+
     return self
 
 # Cell
@@ -174,11 +364,26 @@ def _check_batch_size(self: FastTimeSeriesLoader, batch: t.Tensor):
 def __next__(self: FastTimeSeriesLoader):
     if self.i >= self.dataset_len:
         raise StopIteration
-    idxs = self.idxs[self.i:(self.i + self.batch_size)].tolist()
-    batch = self.dataset[idxs]
+    batch = self[self.i // self.batch_size]
     self.i += self.batch_size
 
-    n_windows = batch['Y'].size(0)
+    return batch
+
+# Cell
+@patch
+def __getitem__(self: FastTimeSeriesLoader, batch_idx: int) -> Dict[str, t.Tensor]:
+    """Builds the batch_idx batch of the current epoch,
+    in the main process or in a worker process."""
+    idxs = self.idxs[(batch_idx * self.batch_size):((batch_idx + 1) * self.batch_size)].tolist()
+
+    if isinstance(self.dataset, WindowsDataset):
+        # Draws the windows before gathering them
+        windows_idxs = self.dataset._get_windows_idxs(idx=idxs)
+        n_windows = len(windows_idxs)
+    else:
+        batch = self.dataset[idxs]
+        n_windows = batch['Y'].size(0)
+
     if self.eq_batch_size and self.batch_size is not None:
         self.w_idxs = np.random.choice(n_windows, size=self.batch_size,
                                        replace=(n_windows < self.batch_size))
@@ -187,6 +392,11 @@ def __next__(self: FastTimeSeriesLoader):
         self.w_idxs = np.random.choice(n_windows, size=self.n_windows,
                                        replace=(n_windows < self.n_windows))
 
+    if isinstance(self.dataset, WindowsDataset):
+        if self.w_idxs is not None:
+            windows_idxs = windows_idxs[self.w_idxs]
+        return self.dataset._gather_windows(windows_idxs=windows_idxs)
+
     return {key: self._check_batch_size(batch[key]) for key in batch}
 
 # Cell
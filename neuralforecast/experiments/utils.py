@@ -19,6 +19,7 @@ os.environ.update(ENV_VARS)
 # Cell
 import time
 import pickle
+import hashlib
 from typing import Tuple
 from functools import partial
 
@@ -26,7 +27,7 @@ import numpy as np
 import pandas as pd
 
 import torch as t
-from torch.utils.data import DataLoader
+from torch.utils.data import BatchSampler, DataLoader, RandomSampler, SequentialSampler
 
 import logging
 import pytorch_lightning as pl
@@ -34,15 +35,20 @@ pl.utilities.distributed.log.setLevel(logging.ERROR)
 
 from hyperopt import fmin, tpe, hp, Trials, STATUS_OK
 
-from ..data.scalers import Scaler
+from ..data.scalers import PanelScaler
 from ..data.tsdataset import (
     TimeSeriesDataset,
     WindowsDataset,
     IterateWindowsDataset,
-    BaseDataset
+    BaseDataset,
+    SeriesMetaData,
+    _align_panel,
+    _sort_panel,
+    _tail_mask
 )
 
-from ..data.tsloader import TimeSeriesLoader
+from ..data.tsloader import LengthBucketSampler, TimeSeriesLoader
+from ..losses.numpy import get_accumulator
 from ..models.esrnn.esrnn import ESRNN
 from ..models.rnn.rnn import RNN
 from ..models.esrnn.mqesrnn import MQESRNN
@@ -77,31 +83,20 @@ def get_mask_dfs(Y_df: pd.DataFrame,
         Test mask dataframe.
     """
 
-    # train mask
-    train_mask_df = Y_df.copy()[['unique_id', 'ds']]
-    train_mask_df.sort_values(by=['unique_id', 'ds'], inplace=True)
-    train_mask_df.reset_index(drop=True, inplace=True)
+    # Masks of the sorted rows from the last positions of each time series
+    order, _, offsets = _sort_panel(Y_df)
+    out_mask = _tail_mask(offsets, ds_in_val + ds_in_test)
+    test_mask = _tail_mask(offsets, ds_in_test)
 
-    train_mask_df['sample_mask'] = 1
-    train_mask_df['available_mask'] = 1
+    def sorted_mask_df(sample_mask):
+        return pd.DataFrame({'unique_id': Y_df['unique_id'].array[order],
+                             'ds': Y_df['ds'].array[order],
+                             'sample_mask': sample_mask.astype(np.int64),
+                             'available_mask': np.ones(len(Y_df), dtype=np.int64)}, copy=False)
 
-    idx_out = train_mask_df.groupby('unique_id').tail(ds_in_val+ds_in_test).index
-    train_mask_df.loc[idx_out, 'sample_mask'] = 0
-
-    # test mask
-    test_mask_df = train_mask_df.copy()
-    test_mask_df['sample_mask'] = 0
-    idx_test = test_mask_df.groupby('unique_id').tail(ds_in_test).index
-    test_mask_df.loc[idx_test, 'sample_mask'] = 1
-
-    # validation mask
-    val_mask_df = train_mask_df.copy()
-    val_mask_df['sample_mask'] = 1
-    val_mask_df['sample_mask'] = val_mask_df['sample_mask'] - train_mask_df['sample_mask']
-    val_mask_df['sample_mask'] = val_mask_df['sample_mask'] - test_mask_df['sample_mask']
-
-    assert len(train_mask_df)==len(Y_df), \
-        f'The mask_df length {len(train_mask_df)} is not equal to Y_df length {len(Y_df)}'
+    train_mask_df = sorted_mask_df(~out_mask)
+    test_mask_df = sorted_mask_df(test_mask)
+    val_mask_df = sorted_mask_df(out_mask & ~test_mask)
 
     return train_mask_df, val_mask_df, test_mask_df
 
@@ -156,8 +151,7 @@ def get_random_mask_dfs(Y_df: pd.DataFrame, ds_in_test: int,
     val_uids = np.random.choice(uids, n_uids, replace=False)
 
     # Validation avoids test
-    idx_test = train_mask_df.groupby('unique_id').tail(ds_in_test).index
-    available_ds = train_mask_df.loc[~train_mask_df.index.isin(idx_test)]['ds'].unique()
+    available_ds = train_mask_df.loc[test_mask_df['sample_mask'] == 0, 'ds'].unique()
     val_init_ds = np.random.choice(available_ds, n_val_windows, replace=False)
 
     # Creates windows
@@ -165,7 +159,7 @@ def get_random_mask_dfs(Y_df: pd.DataFrame, ds_in_test: int,
     val_ds = np.concatenate(val_ds)
 
     # Cleans random windows from train mask
-    val_idx = train_mask_df.query('unique_id in @val_uids & ds in @val_ds').index
+    val_idx = train_mask_df['unique_id'].isin(val_uids) & train_mask_df['ds'].isin(val_ds)
     train_mask_df.loc[val_idx, 'sample_mask'] = 0
     val_mask_df.loc[val_idx, 'sample_mask'] = 1
 
@@ -174,9 +168,10 @@ def get_random_mask_dfs(Y_df: pd.DataFrame, ds_in_test: int,
 # Cell
 def scale_data(Y_df: pd.DataFrame, X_df: pd.DataFrame,
                 mask_df: pd.DataFrame, normalizer_y: str,
-                normalizer_x: str) -> Tuple[pd.DataFrame, pd.DataFrame, Scaler]:
+                normalizer_x: str) -> Tuple[pd.DataFrame, pd.DataFrame, PanelScaler]:
     """
-    Scales input data accordingly to given normalizer parameters.
+    Scales input data accordingly to given normalizer parameters,
+    with the statistics of each time series.
 
     Parameters
     ----------
@@ -185,7 +180,7 @@ def scale_data(Y_df: pd.DataFrame, X_df: pd.DataFrame,
     X_df: pd.DataFrame
         Exogenous time series with columns ['unique_id', 'ds', 'y']
     mask_df: pd.DataFrame
-        Mask dataframe.
+        Mask dataframe sorted by ['unique_id', 'ds'].
     normalizer_y: str
         Normalizer for scaling Y_df.
     normalizer_x: str
@@ -197,36 +192,64 @@ def scale_data(Y_df: pd.DataFrame, X_df: pd.DataFrame,
         Scaled target time series.
     X_df: pd.DataFrame
         Scaled exogenous time series with columns.
-    scaler_y: Scaler
-        Scaler object for Y_df.
+    scaler_y: PanelScaler
+        Scaler object for Y_df, statistics sorted by unique_id.
     """
     mask = mask_df['available_mask'].values * mask_df['sample_mask'].values
+    y_order, _, offsets = _sort_panel(Y_df)
 
     if normalizer_y is not None:
-        scaler_y = Scaler(normalizer=normalizer_y)
-        Y_df['y'] = scaler_y.scale(x=Y_df['y'].values, mask=mask)
+        scaler_y = PanelScaler(normalizer=normalizer_y)
+        y = np.empty(len(Y_df))
+        y[y_order] = scaler_y.scale(x=Y_df['y'].values[y_order], mask=mask, offsets=offsets)
+        Y_df['y'] = y
     else:
         scaler_y = None
 
     if normalizer_x is not None:
+        x_order = _align_panel(X_df, Y_df, y_order, 'X_df')
         X_cols = [col for col in X_df.columns if col not in ['unique_id','ds']]
         for col in X_cols:
-            scaler_x = Scaler(normalizer=normalizer_x)
-            X_df[col] = scaler_x.scale(x=X_df[col].values, mask=mask)
+            scaler_x = PanelScaler(normalizer=normalizer_x)
+            x = np.empty(len(X_df))
+            x[x_order] = scaler_x.scale(x=X_df[col].values[x_order], mask=mask, offsets=offsets)
+            X_df[col] = x
 
     return Y_df, X_df, scaler_y
 
+
 # Cell
+def _fingerprint(*dfs: pd.DataFrame) -> str:
+    """Hash of the content of dataframes, None dataframes included."""
+    fingerprint = hashlib.sha1()
+    for df in dfs:
+        if df is not None:
+            fingerprint.update(pd.util.hash_pandas_object(df, index=False).values.tobytes())
+            fingerprint.update(' '.join(map(str, df.columns)).encode())
+        fingerprint.update(b'|')
+
+    return fingerprint.hexdigest()
+
 def create_datasets(mc: dict, S_df: pd.DataFrame,
                     Y_df: pd.DataFrame, X_df: pd.DataFrame, f_cols: list,
-                    ds_in_test: int, ds_in_val: int, verbose: bool=False) -> Tuple[BaseDataset, BaseDataset, BaseDataset, Scaler]:
+                    ds_in_test: int, ds_in_val: int, verbose: bool=False,
+                    datasets_cache: dict=None) -> Tuple[BaseDataset, BaseDataset, BaseDataset, PanelScaler]:
     """
     Creates train, validation and test datasets.
 
+    With datasets_cache the masks, scaling and time series tensors of
+    'simple' mode datasets are built once per data, splits and normalizers,
+    later calls with the same ones only build the windows of mc.
+
     Parameters
     ----------
     mc: dict
         Model configuration.
+        Optional key 'static_lookup', only for nbeats and nhits in 'simple'
+        and 'full' mode, keeps the static variables of each series in the
+        dataset s_tensor instead of in every window, default False.
+        The models gather them from their static_table, which is not saved
+        in checkpoints: set it to the s_tensor after loading a model.
     S_df: pd.DataFrame
         Static exogenous variables with columns ['unique_id', 'ds']
         and static variables.
@@ -240,6 +263,9 @@ def create_datasets(mc: dict, S_df: pd.DataFrame,
         Number of ds in test.
     ds_in_val: int
         Number of ds in validation.
+    datasets_cache: dict
+        Cache of datasets shared between calls, e.g. hyperopt trials.
+        Default None: datasets are not cached.
 
     Returns
     -------
@@ -249,10 +275,35 @@ def create_datasets(mc: dict, S_df: pd.DataFrame,
         Validation dataset.
     test_dataset: BaseDataset
         Test dataset.
-    scaler_y: Scaler
+    scaler_y: PanelScaler
         Scaler object for Y_df.
     """
 
+    # NBEATS and NHITS can gather the static variables of their batches from the dataset s_tensor
+    static_lookup = mc.get('static_lookup', False) and mc.get('model') in ['nbeats', 'nhits'] \
+                    and mc['mode'] in ['simple', 'full']
+
+    #------------------------------------------- Cached Datasets --------------------------------------------#
+    if datasets_cache is not None and mc['mode'] == 'simple':
+        key = (_fingerprint(Y_df, X_df, S_df), tuple(f_cols or []), ds_in_val, ds_in_test,
+               mc['normalizer_y'], mc['normalizer_x'], static_lookup)
+        if key in datasets_cache:
+            train_dataset, valid_dataset, test_dataset, scaler_y = datasets_cache[key]
+            train_dataset = train_dataset.with_windows(input_size=int(mc['n_time_in']),
+                                                       output_size=int(mc['n_time_out']),
+                                                       sample_freq=int(mc['idx_to_sample_freq']),
+                                                       complete_windows=mc['complete_windows'])
+            valid_dataset = valid_dataset.with_windows(input_size=int(mc['n_time_in']),
+                                                       output_size=int(mc['n_time_out']),
+                                                       sample_freq=int(mc['val_idx_to_sample_freq']),
+                                                       complete_windows=True)
+            if test_dataset is not None:
+                test_dataset = test_dataset.with_windows(input_size=int(mc['n_time_in']),
+                                                         output_size=int(mc['n_time_out']),
+                                                         sample_freq=int(mc['val_idx_to_sample_freq']),
+                                                         complete_windows=True)
+            return train_dataset, valid_dataset, test_dataset, scaler_y
+
     #------------------------------------- Available and Validation Mask ------------------------------------#
     train_mask_df, valid_mask_df, test_mask_df = get_mask_dfs(Y_df=Y_df,
                                                               ds_in_val=ds_in_val,
@@ -271,7 +322,7 @@ def create_datasets(mc: dict, S_df: pd.DataFrame,
                                        output_size=int(mc['n_time_out']),
                                        sample_freq=int(mc['idx_to_sample_freq']),
                                        complete_windows=mc['complete_windows'],
-                                       verbose=verbose)
+                                       static_lookup=static_lookup, verbose=verbose)
 
         valid_dataset = WindowsDataset(S_df=S_df, Y_df=Y_df, X_df=X_df,
                                        mask_df=valid_mask_df, f_cols=f_cols,
@@ -279,7 +330,7 @@ def create_datasets(mc: dict, S_df: pd.DataFrame,
                                        output_size=int(mc['n_time_out']),
                                        sample_freq=int(mc['val_idx_to_sample_freq']),
                                        complete_windows=True,
-                                       verbose=verbose)
+                                       static_lookup=static_lookup, verbose=verbose)
 
         test_dataset = WindowsDataset(S_df=S_df, Y_df=Y_df, X_df=X_df,
                                       mask_df=test_mask_df, f_cols=f_cols,
@@ -287,7 +338,7 @@ def create_datasets(mc: dict, S_df: pd.DataFrame,
                                       output_size=int(mc['n_time_out']),
                                       sample_freq=int(mc['val_idx_to_sample_freq']),
                                       complete_windows=True,
-                                      verbose=verbose)
+                                      static_lookup=static_lookup, verbose=verbose)
     if mc['mode'] == 'iterate_windows':
         train_dataset = IterateWindowsDataset(S_df=S_df, Y_df=Y_df, X_df=X_df,
                                               mask_df=train_mask_df, f_cols=f_cols,
@@ -312,23 +363,26 @@ def create_datasets(mc: dict, S_df: pd.DataFrame,
                                           mask_df=train_mask_df, f_cols=f_cols,
                                           input_size=int(mc['n_time_in']),
                                           output_size=int(mc['n_time_out']),
-                                          verbose=verbose)
+                                          static_lookup=static_lookup, verbose=verbose)
 
         valid_dataset = TimeSeriesDataset(S_df=S_df, Y_df=Y_df, X_df=X_df,
                                           mask_df=valid_mask_df, f_cols=f_cols,
                                           input_size=int(mc['n_time_in']),
                                           output_size=int(mc['n_time_out']),
-                                          verbose=verbose)
+                                          static_lookup=static_lookup, verbose=verbose)
 
         test_dataset = TimeSeriesDataset(S_df=S_df, Y_df=Y_df, X_df=X_df,
                                          mask_df=test_mask_df, f_cols=f_cols,
                                          input_size=int(mc['n_time_in']),
                                          output_size=int(mc['n_time_out']),
-                                         verbose=verbose)
+                                         static_lookup=static_lookup, verbose=verbose)
 
     if ds_in_test == 0:
         test_dataset = None
 
+    if datasets_cache is not None and mc['mode'] == 'simple':
+        datasets_cache[key] = (train_dataset, valid_dataset, test_dataset, scaler_y)
+
     return train_dataset, valid_dataset, test_dataset, scaler_y
 
 # Cell
@@ -342,6 +396,10 @@ def instantiate_loaders(mc: dict,
     ----------
     mc: dict
         Model configuration.
+        Optional key 'num_workers' sets the number of worker processes
+        that prefetch batches, default 0.
+        Optional key 'length_buckets', only in 'full' mode, batches
+        train series of similar length with `LengthBucketSampler`, default False.
     train_dataset: BaseDataset
         Train dataset.
     val_dataset: BaseDataset
@@ -359,44 +417,68 @@ def instantiate_loaders(mc: dict,
         Test loader.
     """
 
+    # Batches prefetched by worker processes
+    loader_kwargs = dict(num_workers=int(mc.get('num_workers', 0)),
+                         pin_memory=t.cuda.is_available())
+
     if mc['mode'] in ['simple', 'full'] :
         n_windows = mc['n_windows'] if mc['mode']=='simple' else None
-        train_loader = TimeSeriesLoader(dataset=train_dataset,
-                                        batch_size=int(mc['batch_size']),
-                                        n_windows=n_windows,
-                                        eq_batch_size=False,
-                                        shuffle=True)
+        if mc['mode'] == 'full' and mc.get('length_buckets', False):
+            # Batches of series of similar length, less padding to trim
+            train_sampler = LengthBucketSampler(dataset=train_dataset,
+                                                batch_size=int(mc['batch_size']),
+                                                shuffle=True)
+            train_loader = TimeSeriesLoader(dataset=train_dataset,
+                                            batch_sampler=train_sampler,
+                                            **loader_kwargs)
+        else:
+            train_loader = TimeSeriesLoader(dataset=train_dataset,
+                                            batch_size=int(mc['batch_size']),
+                                            n_windows=n_windows,
+                                            eq_batch_size=False,
+                                            shuffle=True,
+                                            **loader_kwargs)
         if val_dataset is not None:
             val_loader = TimeSeriesLoader(dataset=val_dataset,
                                         batch_size=1,
-                                        shuffle=False)
+                                        shuffle=False,
+                                        **loader_kwargs)
         else:
             val_loader = None
 
         if test_dataset is not None:
             test_loader = TimeSeriesLoader(dataset=test_dataset,
                                         batch_size=1,
-                                        shuffle=False)
+                                        shuffle=False,
+                                        **loader_kwargs)
         else:
             test_loader = None
 
     elif mc['mode'] == 'iterate_windows':
+        # Batch samplers as samplers, the datasets gather the windows of each batch at once
+        train_sampler = BatchSampler(RandomSampler(train_dataset),
+                                     batch_size=int(mc['batch_size']),
+                                     drop_last=True)
         train_loader =DataLoader(dataset=train_dataset,
-                                 batch_size=int(mc['batch_size']),
-                                 shuffle=True,
-                                 drop_last=True)
+                                 sampler=train_sampler,
+                                 batch_size=None,
+                                 **loader_kwargs)
 
         if val_dataset is not None:
             val_loader = DataLoader(dataset=val_dataset,
-                                    batch_size=1,
-                                    shuffle=False)
+                                    sampler=BatchSampler(SequentialSampler(val_dataset),
+                                                         batch_size=1, drop_last=False),
+                                    batch_size=None,
+                                    **loader_kwargs)
         else:
             val_loader = None
 
         if test_dataset is not None:
             test_loader = DataLoader(dataset=test_dataset,
-                                     batch_size=1,
-                                     shuffle=False)
+                                     sampler=BatchSampler(SequentialSampler(test_dataset),
+                                                          batch_size=1, drop_last=False),
+                                     batch_size=None,
+                                     **loader_kwargs)
         else:
             test_loader = None
 
@@ -411,6 +493,8 @@ def instantiate_nbeats(mc: dict) -> NBEATS:
     ----------
     mc: dict
         Model configuration.
+        Optional key 'window_normalizer' normalizes each window
+        in the model, default None.
 
     Returns
     -------
@@ -449,7 +533,8 @@ def instantiate_nbeats(mc: dict) -> NBEATS:
                   loss_hypar=float(mc['loss_hypar']),
                   loss_valid=mc['loss_valid'],
                   frequency=mc['frequency'],
-                  random_seed=int(mc['random_seed']))
+                  random_seed=int(mc['random_seed']),
+                  window_normalizer=mc.get('window_normalizer', None))
     return model
 
 # Cell
@@ -602,6 +687,8 @@ def instantiate_nhits(mc: dict) -> NHITS:
     ----------
     mc: dict
         Model configuration.
+        Optional key 'window_normalizer' normalizes each window
+        in the model, default None.
 
     Returns
     -------
@@ -645,7 +732,8 @@ def instantiate_nhits(mc: dict) -> NHITS:
                   loss_hypar=float(mc['loss_hypar']),
                   loss_valid=mc['loss_valid'],
                   frequency=mc['frequency'],
-                  random_seed=int(mc['random_seed']))
+                  random_seed=int(mc['random_seed']),
+                  window_normalizer=mc.get('window_normalizer', None))
     return model
 
 # Cell
@@ -657,6 +745,8 @@ def instantiate_mqnhits(mc: dict) -> MQNHITS:
     ----------
     mc: dict
         Model configuration.
+        Optional key 'window_normalizer' normalizes each window
+        in the model, default None.
 
     Returns
     -------
@@ -701,7 +791,8 @@ def instantiate_mqnhits(mc: dict) -> MQNHITS:
                     loss_hypar=float(mc['loss_hypar']),
                     loss_valid=mc['loss_valid'],
                     frequency=mc['frequency'],
-                    random_seed=int(mc['random_seed']))
+                    random_seed=int(mc['random_seed']),
+                    window_normalizer=mc.get('window_normalizer', None))
 
     return model
 
@@ -780,10 +871,60 @@ def instantiate_model(mc: dict) -> pl.LightningModule:
                   'autoformer': instantiate_autoformer}
     return MODEL_DICT[mc['model']](mc)
 
+# Internal Cell
+class _PredictionCallback(pl.Callback):
+    """
+    Takes the outputs of each predicted batch in the original scale,
+    updating the accumulators and keeping them if return_values.
+    """
+    def __init__(self, mc: dict, loader: DataLoader, scaler_y: PanelScaler,
+                 accumulators: dict, return_values: bool):
+        self.mc = mc
+        self.loader = loader
+        self.scaler_y = scaler_y
+        self.accumulators = accumulators
+        self.return_values = return_values
+        self.outputs = []
+
+    def on_predict_batch_end(self, trainer, pl_module, outputs, batch, batch_idx, dataloader_idx=0):
+        y_true, y_hat, mask = [output.cpu().numpy() for output in outputs[:3]]
+
+        # IterateWindows batches of shape (windows, pred_len, n_series) to rows of each window and series
+        series_last = isinstance(self.loader.dataset, IterateWindowsDataset)
+        if series_last:
+            shape = y_true.shape
+            y_true, y_hat, mask = [np.moveaxis(output, -1, 1).reshape(-1, shape[1])
+                                   for output in (y_true, y_hat, mask)]
+
+        # Time series of each row, windows datasets give the series of each window
+        idxs = batch['idxs'].cpu().numpy().reshape(-1)
+        if isinstance(self.loader.dataset, (WindowsDataset, IterateWindowsDataset)):
+            assert len(idxs) == len(y_true), f'{len(y_true)} predicted rows of {len(idxs)} windows'
+            series = idxs
+        else:
+            # Models make the windows of TimeSeriesDataset batches, the rows of
+            # different time series can not be told apart
+            assert len(idxs) == 1, f'Batches of {len(idxs)} time series, predict one time series per batch'
+            series = np.repeat(idxs, len(y_true))
+        if self.mc['normalizer_y'] is not None:
+            y_true = self.scaler_y.inv_scale(x=y_true, idxs=series)
+            y_hat = self.scaler_y.inv_scale(x=y_hat, idxs=series)
+
+        for accumulator in self.accumulators.values():
+            accumulator.update(y=y_true, y_hat=y_hat, weights=mask, series=series)
+
+        if series_last:
+            y_true, y_hat, mask = [np.moveaxis(output.reshape(shape[0], shape[2], shape[1]), 1, -1)
+                                   for output in (y_true, y_hat, mask)]
+        if self.return_values:
+            self.outputs.append((y_true, y_hat, mask))
+
 # Cell
 def predict(mc: dict, model: pl.LightningModule,
             trainer: pl.Trainer, loader: DataLoader,
-            scaler_y: Scaler) -> Tuple[np.array, np.array, np.array, np.array]:
+            scaler_y: PanelScaler,
+            accumulators: dict = None,
+            return_values: bool = True) -> Tuple[np.array, np.array, np.array, SeriesMetaData]:
     """
     Predicts results on dataset using trained model.
 
@@ -797,8 +938,13 @@ def predict(mc: dict, model: pl.LightningModule,
         Trainer object.
     loader: DataLoader
         Data loader.
-    scaler_y: Scaler
+    scaler_y: PanelScaler
         Scaler object for target time series.
+    accumulators: dict
+        Metric accumulators of losses.numpy updated with each predicted batch.
+    return_values: bool
+        If false the predictions are only passed to the accumulators
+        and y_true, y_hat and mask are None.
 
     Returns
     -------
@@ -808,30 +954,31 @@ def predict(mc: dict, model: pl.LightningModule,
         Predicted values from dataset.
     mask: np.array
         Masks for values.
-    meta_data: np.array
-        Metada from dataset.
+    meta_data: SeriesMetaData
+        Metada from dataset, unique_id and ds of each time series.
     """
-    outputs = trainer.predict(model, loader)
-    y_true, y_hat, mask = [t.cat(output).cpu().numpy() for output in zip(*outputs)]
+    callback = _PredictionCallback(mc=mc, loader=loader, scaler_y=scaler_y,
+                                   accumulators=accumulators or {}, return_values=return_values)
+    trainer.callbacks.append(callback)
+    try:
+        trainer.predict(model, loader, return_predictions=False)
+    finally:
+        trainer.callbacks.remove(callback)
     meta_data = loader.dataset.meta_data
 
+    if not return_values:
+        return None, None, None, meta_data
 
-    # Scale to original scale
-    if mc['normalizer_y'] is not None:
-        y_true_shape = y_true.shape
-        y_true = scaler_y.inv_scale(x=y_true.flatten())
-        y_true = np.reshape(y_true, y_true_shape)
-
-        y_hat = scaler_y.inv_scale(x=y_hat.flatten())
-        y_hat = np.reshape(y_hat, y_true_shape)
+    y_true, y_hat, mask = [np.concatenate(output) for output in zip(*callback.outputs)]
 
     return y_true, y_hat, mask, meta_data
 
 # Cell
 def fit(mc: dict, Y_df: pd.DataFrame, X_df: pd.DataFrame =None, S_df: pd.DataFrame =None,
         ds_in_val: int =0, ds_in_test: int =0,
-        f_cols: list =[], verbose: bool = False) -> Tuple[pl.LightningModule, pl.Trainer,
-                                                          DataLoader, DataLoader, Scaler] or pl.LightningModule:
+        f_cols: list =[], verbose: bool = False,
+        datasets_cache: dict = None) -> Tuple[pl.LightningModule, pl.Trainer,
+                                                          DataLoader, DataLoader, PanelScaler] or pl.LightningModule:
     """
     Traines model on given dataset.
 
@@ -852,6 +999,8 @@ def fit(mc: dict, Y_df: pd.DataFrame, X_df: pd.DataFrame =None, S_df: pd.DataFra
         Number of ds in test.
     f_cols: list
         List of exogenous variables of the future.
+    datasets_cache: dict
+        Cache of datasets shared between calls, see create_datasets.
 
     Returns
     -------
@@ -863,7 +1012,7 @@ def fit(mc: dict, Y_df: pd.DataFrame, X_df: pd.DataFrame =None, S_df: pd.DataFra
         Validation loader.
     test_loader: DataLoader
         Test loader.
-    scaler_y: Scaler
+    scaler_y: PanelScaler
         Scaler object for target time series.
     """
 
@@ -880,7 +1029,8 @@ def fit(mc: dict, Y_df: pd.DataFrame, X_df: pd.DataFrame =None, S_df: pd.DataFra
                                                                          f_cols=f_cols,
                                                                          ds_in_val=ds_in_val,
                                                                          ds_in_test=ds_in_test,
-                                                                         verbose=verbose)
+                                                                         verbose=verbose,
+                                                                         datasets_cache=datasets_cache)
     mc['n_x'], mc['n_s'] = train_dataset.get_n_variables()
 
     #------------------------------------------- Instantiate & fit -------------------------------------------#
@@ -889,6 +1039,8 @@ def fit(mc: dict, Y_df: pd.DataFrame, X_df: pd.DataFrame =None, S_df: pd.DataFra
                                                                 val_dataset=val_dataset,
                                                                 test_dataset=test_dataset)
     model = instantiate_model(mc=mc)
+    if train_dataset.static_lookup:
+        model.static_table = train_dataset.s_tensor
     callbacks = []
     if mc['early_stop_patience'] and ds_in_val > 0:
         early_stopping = pl.callbacks.EarlyStopping(monitor='val_loss', min_delta=1e-4,
@@ -916,7 +1068,11 @@ def fit(mc: dict, Y_df: pd.DataFrame, X_df: pd.DataFrame =None, S_df: pd.DataFra
 # Cell
 def model_fit_predict(mc: dict,
                         S_df: pd.DataFrame, Y_df: pd.DataFrame, X_df: pd.DataFrame,
-                        f_cols: list, ds_in_val: int, ds_in_test: int, verbose: bool) -> dict:
+                        f_cols: list, ds_in_val: int, ds_in_test: int, verbose: bool,
+                        datasets_cache: dict = None,
+                        val_accumulators: dict = None,
+                        test_accumulators: dict = None,
+                        return_forecasts: bool = True) -> dict:
     """
     Traines model on train dataset, then calculates predictions
     on test dataset.
@@ -935,6 +1091,14 @@ def model_fit_predict(mc: dict,
         Number of ds in validation.
     ds_in_test: int
         Number of ds in test.
+    datasets_cache: dict
+        Cache of datasets shared between calls, see create_datasets.
+    val_accumulators: dict
+        Metric accumulators updated with the validation predictions.
+    test_accumulators: dict
+        Metric accumulators updated with the test predictions.
+    return_forecasts: bool
+        If false the predictions are only passed to the accumulators.
 
     Returns
     -------
@@ -945,20 +1109,25 @@ def model_fit_predict(mc: dict,
     #------------------------------------------------ Fit ------------------------------------------------#
     model, trainer, val_loader, test_loader, scaler_y = fit(
         mc, S_df=S_df, Y_df=Y_df, X_df=X_df,
-        f_cols=[], ds_in_val=ds_in_val, ds_in_test=ds_in_test, verbose=verbose
+        f_cols=[], ds_in_val=ds_in_val, ds_in_test=ds_in_test, verbose=verbose,
+        datasets_cache=datasets_cache
     )
     #------------------------------------------------ Predict ------------------------------------------------#
     results = {}
 
     if ds_in_val > 0:
-        y_true, y_hat, mask, meta_data = predict(mc, model, trainer, val_loader, scaler_y)
+        y_true, y_hat, mask, meta_data = predict(mc, model, trainer, val_loader, scaler_y,
+                                                 accumulators=val_accumulators,
+                                                 return_values=return_forecasts)
         val_values = (('val_y_true', y_true), ('val_y_hat', y_hat),
                       ('val_mask', mask), ('val_meta_data', meta_data))
         results.update(val_values)
 
     # Predict test if available
     if ds_in_test > 0:
-        y_true, y_hat, mask, meta_data = predict(mc, model, trainer, test_loader, scaler_y)
+        y_true, y_hat, mask, meta_data = predict(mc, model, trainer, test_loader, scaler_y,
+                                                 accumulators=test_accumulators,
+                                                 return_values=return_forecasts)
         test_values = (('test_y_true', y_true), ('test_y_hat', y_hat),
                        ('test_mask', mask), ('test_meta_data', meta_data))
         results.update(test_values)
@@ -975,7 +1144,8 @@ def evaluate_model(mc: dict, loss_function_val: callable, loss_functions_test: d
                    trials: Trials,
                    results_dir: str,
                    step_save_progress: int =5,
-                   loss_kwargs: list =None, verbose: bool=False) -> dict:
+                   loss_kwargs: list =None, verbose: bool=False,
+                   datasets_cache: dict=None) -> dict:
     """
     Evaluate model on given dataset.
 
@@ -1013,6 +1183,8 @@ def evaluate_model(mc: dict, loss_function_val: callable, loss_functions_test: d
         Every n-th step is saved in file.
     loss_kwargs: List
         Loss function arguments.
+    datasets_cache: dict
+        Cache of datasets shared between calls, see create_datasets.
 
     Returns
     -------
@@ -1030,37 +1202,41 @@ def evaluate_model(mc: dict, loss_function_val: callable, loss_functions_test: d
         print(pd.Series(mc))
         print(47*'=' + '\n')
 
-    # Some asserts due to work in progress
-    n_series = Y_df['unique_id'].nunique()
-    if n_series > 1:
-        assert mc['normalizer_y'] is None,\
-            'Data scaling not implemented with multiple time series'
-        assert mc['normalizer_x'] is None,\
-            'Data scaling not implemented with multiple time series'
-
     assert ds_in_test % mc['val_idx_to_sample_freq']==0,\
         'outsample size should be multiple of val_idx_to_sample_freq'
 
+    # Losses accumulated as each batch is predicted
+    if mc['loss_valid'] == 'MQ':
+        val_accumulator = get_accumulator(loss_function_val, quantiles=np.array(mc['quantiles']))
+    else:
+        val_accumulator = get_accumulator(loss_function_val, **loss_kwargs)
+    test_accumulators = {}
+    if ds_in_test > 0:
+        for loss_name, loss_function in loss_functions_test.items():
+            if loss_name == 'MQ':
+                test_accumulators[loss_name] = get_accumulator(loss_function,
+                                                               quantiles=np.array(mc['quantiles']))
+            else:
+                test_accumulators[loss_name] = get_accumulator(loss_function)
+
     # Make predictions
     start = time.time()
     results, _, trainer = model_fit_predict(mc=mc,
-                                                S_df=S_df,
-                                                Y_df=Y_df,
-                                                X_df=X_df,
-                                                f_cols=f_cols,
-                                                ds_in_val=ds_in_val,
-                                                ds_in_test=ds_in_test,
-                                                verbose=verbose)
+                                            S_df=S_df,
+                                            Y_df=Y_df,
+                                            X_df=X_df,
+                                            f_cols=f_cols,
+                                            ds_in_val=ds_in_val,
+                                            ds_in_test=ds_in_test,
+                                            verbose=verbose,
+                                            datasets_cache=datasets_cache,
+                                            val_accumulators={'loss': val_accumulator},
+                                            test_accumulators=test_accumulators,
+                                            return_forecasts=return_forecasts)
     run_time = time.time() - start
 
     # Evaluate predictions
-    if mc['loss_valid'] == 'MQ':
-        val_loss = loss_function_val(y=results['val_y_true'], y_hat=results['val_y_hat'],
-                                     quantiles=np.array(mc['quantiles']),
-                                     weights=results['val_mask'])
-    else:
-        val_loss = loss_function_val(y=results['val_y_true'], y_hat=results['val_y_hat'],
-                                     weights=results['val_mask'], **loss_kwargs)
+    val_loss = val_accumulator.compute()
 
     results_output = {'loss': val_loss,
                       'mc': mc,
@@ -1069,15 +1245,8 @@ def evaluate_model(mc: dict, loss_function_val: callable, loss_functions_test: d
 
     # Evaluation in test (if provided)
     if ds_in_test > 0:
-        test_loss_dict = {}
-        for loss_name, loss_function in loss_functions_test.items():
-            if loss_name == 'MQ':
-                test_loss_dict[loss_name] = loss_function(y=results['test_y_true'], y_hat=results['test_y_hat'],
-                                                          quantiles=np.array(mc['quantiles']),
-                                                          weights=results['test_mask'])
-            else:
-                test_loss_dict[loss_name] = loss_function(y=results['test_y_true'], y_hat=results['test_y_hat'],
-                                                        weights=results['test_mask'])
+        test_loss_dict = {loss_name: accumulator.compute()
+                          for loss_name, accumulator in test_accumulators.items()}
         results_output['test_losses'] = test_loss_dict
 
     if return_forecasts and ds_in_test > 0:
@@ -1152,6 +1321,8 @@ def hyperopt_tunning(space: dict, hyperopt_max_evals: int,
         If true return forecast on test.
     return_model: bool
         If true return models.
+        With static_lookup set the static_table of the returned model
+        to the s_tensor of the train dataset, see `create_datasets`.
     save_trials: bool
         If true save progres in file.
     results_dir: str
@@ -1174,7 +1345,9 @@ def hyperopt_tunning(space: dict, hyperopt_max_evals: int,
     if save_trials or return_model:
         os.makedirs(results_dir, exist_ok = True)
 
+    # Trials share the datasets of the data, only the windows are rebuilt
     trials = Trials()
+    datasets_cache = {}
     fmin_objective = partial(evaluate_model,
                              loss_function_val=loss_function_val,
                              loss_functions_test=loss_functions_test,
@@ -1184,7 +1357,8 @@ def hyperopt_tunning(space: dict, hyperopt_max_evals: int,
                              save_trials=save_trials, trials=trials,
                              results_dir=results_dir,
                              step_save_progress=step_save_progress,
-                             loss_kwargs=loss_kwargs or {}, verbose=verbose)
+                             loss_kwargs=loss_kwargs or {}, verbose=verbose,
+                             datasets_cache=datasets_cache)
 
     fmin(fmin_objective, space=space, algo=tpe.suggest,
          max_evals=hyperopt_max_evals, trials=trials, verbose=verbose)
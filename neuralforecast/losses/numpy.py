@@ -1,9 +1,12 @@
 # AUTOGENERATED! DO NOT EDIT! File to edit: nbs/losses__numpy.ipynb (unless otherwise specified).
 
-__all__ = ['mae', 'mse', 'rmse', 'mape', 'smape', 'mase', 'rmae', 'quantile_loss', 'mqloss']
+__all__ = ['mae', 'mse', 'rmse', 'mape', 'smape', 'mase', 'rmae', 'quantile_loss', 'mqloss', 'panel_metrics',
+           'PANEL_METRICS', 'MetricAccumulator', 'MAEAccumulator', 'MSEAccumulator', 'RMSEAccumulator',
+           'MAPEAccumulator', 'SMAPEAccumulator', 'MASEAccumulator', 'RMAEAccumulator', 'QuantileLossAccumulator',
+           'MQLossAccumulator', 'LossAccumulator', 'get_accumulator', 'ACCUMULATORS']
 
 # Cell
-from typing import Optional, Union
+from typing import Callable, Dict, Optional, Tuple, Union
 
 import numpy as np
 
@@ -469,4 +472,357 @@ def mqloss(y: np.ndarray, y_hat: np.ndarray,
     weights = np.repeat(np.expand_dims(weights, axis=-1), repeats=n_q, axis=-1)
     mqloss  = np.average(mqloss, weights=weights, axis=axis)
 
-    return mqloss
\ No newline at end of file
+    return mqloss
+
+# Cell
+def _seasonal_naive_scales(y_train: np.ndarray,
+                           train_offsets: np.ndarray,
+                           seasonality: int,
+                           horizon: int = 0) -> np.ndarray:
+    """
+    Mean absolute error of the seasonal naive predictions
+    of each time series of y_train, in one pass over the segments
+    of train_offsets. The last horizon values of each time series,
+    its test values, are left out.
+    """
+    len_series = np.diff(train_offsets)
+    len_train = len_series - horizon
+    series = np.repeat(np.arange(len(len_series)), len_series)[seasonality:]
+    position = np.arange(seasonality, len(y_train)) - train_offsets[series]
+    valid = (position >= seasonality) & (position < len_train[series])
+    errors = np.abs(y_train[seasonality:] - y_train[:-seasonality])[valid]
+    scales = np.bincount(series[valid], weights=errors, minlength=len(len_series))
+    scales = scales / np.maximum(len_train - seasonality, 0)
+
+    return scales
+
+
+# Cell
+PANEL_METRICS = ('mae', 'mse', 'rmse', 'mape', 'smape', 'mase', 'quantile_loss')
+
+def panel_metrics(y: np.ndarray, y_hat: np.ndarray,
+                  offsets: Optional[np.ndarray] = None,
+                  mask: Optional[np.ndarray] = None,
+                  metrics: Tuple[str] = ('mae', 'mse', 'rmse', 'mape', 'smape'),
+                  y_train: Optional[np.ndarray] = None,
+                  train_offsets: Optional[np.ndarray] = None,
+                  seasonality: int = 1,
+                  q: float = 0.5,
+                  chunk_size: int = 2**20) -> Tuple[Dict[str, np.ndarray], Dict[str, float]]:
+    """
+    Calculates the metrics of the forecasts of each time series of a panel
+    and of the whole panel in a single pass over chunks of y and y_hat.
+    The metrics match `mae`, `mse`, `rmse`, `mape`, `smape`, `mase` and
+    `quantile_loss` with the mask as weights, computed on the points of
+    each time series and on all the points of the panel.
+
+        Parameters
+        ----------
+        y: numpy array.
+            Observed values, of shape (n_series, horizon) or the
+            values of all time series one after the other.
+        y_hat: numpy array.
+            Predicted values, of the shape of y.
+        offsets: numpy array, optional.
+            Position of the first value of each time series in y and
+            its total length, of shape (n_series + 1,). The default,
+            offsets=None, takes the rows of y as time series.
+        mask: numpy array, optional.
+            Weights of the values of y, 0 for the values not evaluated.
+            Nan values of y, e.g. padding, are left out.
+        metrics: tuple of str.
+            Metrics to calculate, among PANEL_METRICS.
+        y_train: numpy array, optional.
+            Insample values of the time series, required by mase.
+        train_offsets: numpy array, optional.
+            Position of the first value of each time series in y_train.
+            The default, train_offsets=None, takes the rows of y_train as
+            time series.
+        seasonality: int.
+            Main frequency of the time series for mase.
+        q: float.
+            Quantile of y_hat for quantile_loss.
+        chunk_size: int.
+            Values of y evaluated at a time.
+
+        Returns
+        -------
+        per_series: dict of numpy arrays.
+            Metrics of each time series, nan without weights.
+        panel: dict of floats.
+            Metrics of all the values of the panel.
+    """
+    unknown = set(metrics) - set(PANEL_METRICS)
+    if unknown:
+        raise Exception(f'Unknown metrics {unknown}, available metrics {PANEL_METRICS}')
+
+    if offsets is None:
+        y = np.atleast_2d(y)
+        offsets = np.arange(y.shape[0] + 1) * y.shape[1]
+    y, y_hat = np.reshape(y, -1), np.reshape(y_hat, -1)
+    assert y.shape == y_hat.shape, f'Wrong y_hat dimension y_hat.shape {y_hat.shape}, y.shape {y.shape}'
+    assert offsets[-1] == len(y), f'Offsets of {offsets[-1]} values for {len(y)} values of y'
+    if mask is not None:
+        mask = np.reshape(mask, -1)
+    n_series = len(offsets) - 1
+
+    if 'mase' in metrics:
+        assert y_train is not None, 'y_train is required by mase'
+        if train_offsets is None:
+            y_train = np.atleast_2d(y_train)
+            train_offsets = np.arange(y_train.shape[0] + 1) * y_train.shape[1]
+        scales = _seasonal_naive_scales(np.reshape(y_train, -1).astype(np.float64),
+                                        train_offsets, seasonality)
+
+    # Metrics accumulated as weighted sums of each time series
+    sums = {metric: np.zeros(n_series) for metric in metrics if metric != 'rmse'}
+    if 'rmse' in metrics:
+        sums['mse'] = np.zeros(n_series)
+    weights_sums = {metric: np.zeros(n_series) for metric in sums}
+    for start in range(0, len(y), chunk_size):
+        end = min(start + chunk_size, len(y))
+        first, last = np.searchsorted(offsets, [start, end - 1], side='right') - 1
+        chunk_len = np.diff(np.clip(offsets[first:last + 2], start, end))
+        series = np.repeat(np.arange(first, last + 1), chunk_len)
+
+        y_chunk = y[start:end].astype(np.float64)
+        y_hat_chunk = y_hat[start:end].astype(np.float64)
+        weights = np.ones(end - start) if mask is None else mask[start:end].astype(np.float64)
+        delta_y = y_chunk - y_hat_chunk
+        abs_delta_y = np.abs(delta_y)
+
+        terms = {}
+        if 'mae' in sums:
+            terms['mae'] = abs_delta_y
+        if 'mse' in sums:
+            terms['mse'] = delta_y ** 2
+        if 'mape' in sums:
+            terms['mape'] = _divide_no_nan(abs_delta_y, np.abs(y_chunk))
+        if 'smape' in sums:
+            terms['smape'] = _divide_no_nan(abs_delta_y, np.abs(y_chunk) + np.abs(y_hat_chunk))
+        if 'mase' in sums:
+            terms['mase'] = abs_delta_y / scales[series]
+        if 'quantile_loss' in sums:
+            terms['quantile_loss'] = np.maximum(q * delta_y, (q - 1) * delta_y)
+
+        series = series - first
+        for metric, term in terms.items():
+            # Nan values, e.g. the padding of wide panels, are left out
+            missing = np.isnan(term)
+            metric_weights = np.where(missing, 0., weights)
+            term = np.where(missing, 0., term)
+            sums[metric][first:last + 1] += np.bincount(series, weights=term * metric_weights,
+                                                        minlength=last - first + 1)
+            weights_sums[metric][first:last + 1] += np.bincount(series, weights=metric_weights,
+                                                                minlength=last - first + 1)
+
+    factors = {'mape': 100, 'smape': 200}
+    per_series, panel = {}, {}
+    with np.errstate(invalid='ignore', divide='ignore'):
+        for metric, metric_sum in sums.items():
+            factor = factors.get(metric, 1)
+            per_series[metric] = factor * metric_sum / weights_sums[metric]
+            panel[metric] = factor * metric_sum.sum() / weights_sums[metric].sum()
+    if 'rmse' in metrics:
+        per_series['rmse'], panel['rmse'] = np.sqrt(per_series['mse']), np.sqrt(panel['mse'])
+    per_series = {metric: per_series[metric] for metric in metrics}
+    panel = {metric: panel[metric] for metric in metrics}
+
+    return per_series, panel
+
+# Cell
+class MetricAccumulator:
+    """
+    Weighted average of the errors of a metric over batches of
+    y and y_hat, for the whole stream and each time series.
+    """
+    factor: float = 1.
+    ignore_nan: bool = False
+
+    def __init__(self):
+        self.errors_sum = 0.
+        self.weights_sum = 0.
+        self.series_errors_sum = np.zeros(0)
+        self.series_weights_sum = np.zeros(0)
+
+    def errors(self, y: np.ndarray, y_hat: np.ndarray) -> np.ndarray:
+        """Errors of each value of y."""
+        raise NotImplementedError
+
+    def update(self, y: np.ndarray, y_hat: np.ndarray,
+               weights: Optional[np.ndarray] = None,
+               series: Optional[Union[int, np.ndarray]] = None) -> None:
+        """
+        Adds the errors of a batch.
+
+            Parameters
+            ----------
+            y: numpy array.
+                Observed values.
+            y_hat: numpy array.
+                Predicted values.
+            weights: numpy array, optional.
+                Weights for weighted average.
+            series: int or numpy array, optional.
+                Time series of the batch or of each row of y.
+                The default, series=None, only updates the whole stream.
+        """
+        y, y_hat = np.asarray(y, dtype=np.float64), np.asarray(y_hat, dtype=np.float64)
+        errors = self.errors(y, y_hat)
+        weights = np.ones(errors.shape) if weights is None else np.asarray(weights, dtype=np.float64)
+        if self.ignore_nan:
+            weights = np.where(np.isnan(errors), 0, weights)
+            errors = np.nan_to_num(errors, nan=0.)
+        errors = errors * weights
+        self.errors_sum += errors.sum()
+        self.weights_sum += weights.sum()
+
+        if series is None:
+            return
+        series = np.broadcast_to(series, len(y))
+        n_series = series.max() + 1
+        if n_series > len(self.series_errors_sum):
+            pad = n_series - len(self.series_errors_sum)
+            self.series_errors_sum = np.append(self.series_errors_sum, np.zeros(pad))
+            self.series_weights_sum = np.append(self.series_weights_sum, np.zeros(pad))
+        self.series_errors_sum[:n_series] += np.bincount(series, weights=errors.reshape(len(y), -1).sum(1),
+                                                         minlength=n_series)
+        self.series_weights_sum[:n_series] += np.bincount(series, weights=weights.reshape(len(y), -1).sum(1),
+                                                          minlength=n_series)
+
+    def compute(self) -> float:
+        """Metric of all the batches."""
+        return self.factor * self.errors_sum / self.weights_sum
+
+    def compute_series(self) -> np.ndarray:
+        """Metric of each time series, nan without weights."""
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return self.factor * self.series_errors_sum / self.series_weights_sum
+
+# Cell
+class MAEAccumulator(MetricAccumulator):
+    """Streaming `mae`."""
+    ignore_nan = True
+
+    def errors(self, y, y_hat):
+        return np.abs(y - y_hat)
+
+class MSEAccumulator(MetricAccumulator):
+    """Streaming `mse`."""
+    ignore_nan = True
+
+    def errors(self, y, y_hat):
+        return (y - y_hat) ** 2
+
+class RMSEAccumulator(MSEAccumulator):
+    """Streaming `rmse`."""
+
+    def compute(self):
+        return np.sqrt(super().compute())
+
+    def compute_series(self):
+        return np.sqrt(super().compute_series())
+
+class MAPEAccumulator(MetricAccumulator):
+    """Streaming `mape`."""
+    factor = 100.
+
+    def errors(self, y, y_hat):
+        return _divide_no_nan(np.abs(y - y_hat), np.abs(y))
+
+class SMAPEAccumulator(MetricAccumulator):
+    """Streaming `smape`."""
+    factor = 200.
+
+    def errors(self, y, y_hat):
+        return _divide_no_nan(np.abs(y - y_hat), np.abs(y) + np.abs(y_hat))
+
+class MASEAccumulator(MetricAccumulator):
+    """Streaming `mase`, scaled by the seasonal naive errors of y_train."""
+
+    def __init__(self, y_train: np.ndarray, seasonality: int):
+        super().__init__()
+        y_train = np.asarray(y_train)
+        self.scale = np.mean(np.abs(y_train[:-seasonality] - y_train[seasonality:]))
+
+    def errors(self, y, y_hat):
+        return np.abs(y - y_hat) / self.scale
+
+class RMAEAccumulator(MetricAccumulator):
+    """Streaming `rmae`, the ratio of the mae of y_hat1 and y_hat2."""
+
+    def __init__(self):
+        super().__init__()
+        self.mae1, self.mae2 = MAEAccumulator(), MAEAccumulator()
+
+    def update(self, y, y_hat1, y_hat2, weights=None, series=None):
+        self.mae1.update(y, y_hat1, weights=weights, series=series)
+        self.mae2.update(y, y_hat2, weights=weights, series=series)
+
+    def compute(self):
+        return self.mae1.compute() / self.mae2.compute()
+
+    def compute_series(self):
+        return self.mae1.compute_series() / self.mae2.compute_series()
+
+class QuantileLossAccumulator(MetricAccumulator):
+    """Streaming `quantile_loss` of quantile q."""
+    ignore_nan = True
+
+    def __init__(self, q: float = 0.5):
+        super().__init__()
+        self.q = q
+
+    def errors(self, y, y_hat):
+        delta_y = y - y_hat
+        return np.maximum(self.q * delta_y, (self.q - 1) * delta_y)
+
+class MQLossAccumulator(MetricAccumulator):
+    """Streaming `mqloss`, y_hat with the quantiles in the last axis."""
+
+    def __init__(self, quantiles: np.ndarray):
+        super().__init__()
+        self.quantiles = np.asarray(quantiles)
+
+    def errors(self, y, y_hat):
+        error = y_hat - np.expand_dims(y, axis=-1)
+        loss = self.quantiles * np.maximum(-error, 0) + (1 - self.quantiles) * np.maximum(error, 0)
+        return loss.mean(-1)
+
+# Cell
+class LossAccumulator(MetricAccumulator):
+    """
+    Accumulator of any loss function with arguments y, y_hat and weights,
+    keeps the batches and calls it on all of them.
+    """
+
+    def __init__(self, loss_function: Callable, **loss_kwargs):
+        self.loss_function = loss_function
+        self.loss_kwargs = loss_kwargs
+        self.batches = []
+
+    def update(self, y, y_hat, weights=None, series=None):
+        self.batches.append((np.asarray(y), np.asarray(y_hat),
+                             np.ones(np.shape(y)) if weights is None else np.asarray(weights)))
+
+    def compute(self):
+        y, y_hat, weights = [np.concatenate(values) for values in zip(*self.batches)]
+        return self.loss_function(y=y, y_hat=y_hat, weights=weights, **self.loss_kwargs)
+
+    def compute_series(self):
+        raise NotImplementedError('Loss of each time series not available')
+
+ACCUMULATORS = {mae: MAEAccumulator, mse: MSEAccumulator, rmse: RMSEAccumulator,
+                mape: MAPEAccumulator, smape: SMAPEAccumulator, mase: MASEAccumulator,
+                rmae: RMAEAccumulator, quantile_loss: QuantileLossAccumulator,
+                mqloss: MQLossAccumulator}
+
+def get_accumulator(loss_function: Callable, **loss_kwargs) -> MetricAccumulator:
+    """
+    Streaming accumulator of loss_function with the loss_kwargs of the function,
+    the batches of functions outside of the numpy losses are kept in memory.
+    """
+    if loss_function in ACCUMULATORS:
+        return ACCUMULATORS[loss_function](**loss_kwargs)
+
+    return LossAccumulator(loss_function, **loss_kwargs)
\ No newline at end of file
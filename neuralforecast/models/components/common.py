@@ -1,7 +1,7 @@
 # AUTOGENERATED! DO NOT EDIT! File to edit: nbs/models_components__common.ipynb (unless otherwise specified).
 
 __all__ = ['Chomp1d', 'CausalConv1d', 'ACTIVATIONS', 'TimeDistributed2d', 'TimeDistributed3d', 'RepeatVector',
-           'L1Regularizer']
+           'L1Regularizer', 'WindowNormalizer', 'NORMALIZERS']
 
 # Cell
 import torch as t
@@ -146,4 +146,82 @@ class L1Regularizer(nn.Module):
         return x
 
     def regularization(self):
-        return self.l1_lambda * t.norm(self.weight, 1)
\ No newline at end of file
+        return self.l1_lambda * t.norm(self.weight, 1)
+
+# Cell
+NORMALIZERS = ['std', 'invariant', 'norm', 'norm1', 'median']
+
+def _masked_median(x, mask):
+    """
+    Receives x and mask inputs of dim [N,T] and returns the [N,1]
+    median of the masked values of each row, averaging the two middle
+    values of even counts. Rows without masked values get 0.
+    """
+    n = mask.sum(dim=1, keepdim=True).long()
+    x_sorted = x.masked_fill(mask == 0, float('inf')).sort(dim=1).values
+    low = x_sorted.gather(1, ((n - 1) // 2).clamp(min=0))
+    high = x_sorted.gather(1, (n // 2).clamp(max=x.size(1) - 1))
+    return t.where(n > 0, (low + high) / 2, t.zeros_like(low))
+
+class WindowNormalizer(nn.Module):
+    """
+    Normalizes each window of a batch with the statistics of its own
+    insample values and denormalizes the forecasts with them, on the
+    device of the batch. The statistics of each normalizer are the ones
+    of `Scaler`, written as (y - shift) / scale, with arcsinh on top
+    for 'invariant'. Windows without masked values keep shift 0 and
+    scale 1, and constant windows are only shifted.
+    : param normalizer: str, an item from NORMALIZERS.
+    """
+    def __init__(self, normalizer, eps=1e-6):
+        super(WindowNormalizer, self).__init__()
+        assert normalizer in NORMALIZERS, f'{normalizer} is not in {NORMALIZERS}'
+        self.normalizer = normalizer
+        self.eps = eps
+
+    def forward(self, y, mask):
+        """
+        Receives y and mask inputs of dim [N,T], returns the normalized
+        y of dim [N,T] and the [N,1] shift and scale of each window.
+        """
+        mask = mask.to(y.dtype)
+        n = mask.sum(dim=1, keepdim=True)
+        if self.normalizer == 'std':
+            shift = (y * mask).sum(dim=1, keepdim=True) / n.clamp(min=1)
+            scale = ((((y - shift) * mask)**2).sum(dim=1, keepdim=True) / n.clamp(min=1)).sqrt()
+        elif self.normalizer in ['norm', 'norm1']:
+            y_min = y.masked_fill(mask == 0, float('inf')).amin(dim=1, keepdim=True)
+            y_max = y.masked_fill(mask == 0, float('-inf')).amax(dim=1, keepdim=True)
+            shift, scale = y_min, y_max - y_min
+            if self.normalizer == 'norm1':
+                shift, scale = shift + scale / 2, scale / 2
+        else:
+            shift = _masked_median(y, mask)
+            scale = _masked_median((y - shift).abs(), mask) / 0.6744897501960817
+
+        shift = t.where(n > 0, shift, t.zeros_like(shift))
+        scale = t.where((n > 0) & (scale > self.eps), scale, t.ones_like(scale))
+        y = (y - shift) / scale
+        if self.normalizer == 'invariant':
+            y = t.arcsinh(y)
+        return y, shift, scale
+
+    def inverse(self, y_hat, shift, scale):
+        """
+        Receives forecasts y_hat of dim [N,...] and the [N,1] shift and scale
+        of each window, returns y_hat in the original scale.
+        """
+        shape = (-1,) + (1,) * (y_hat.dim() - 1)
+        if self.normalizer == 'invariant':
+            y_hat = t.sinh(y_hat)
+        return y_hat * scale.view(shape) + shift.view(shape)
+
+    def inverse_decomposition(self, block_forecasts, shift, scale):
+        """
+        Receives block_forecasts of dim [N,B,...] with the level of each window
+        in the first block, denormalizes the level and rescales the other blocks.
+        Blocks add up to the forecast except for 'invariant'.
+        """
+        shape = (-1,) + (1,) * (block_forecasts.dim() - 1)
+        level = self.inverse(block_forecasts[:, :1], shift, scale)
+        return t.cat([level, block_forecasts[:, 1:] * scale.view(shape)], dim=1)
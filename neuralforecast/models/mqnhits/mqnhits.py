@@ -18,9 +18,9 @@ from torch import optim
 import pytorch_lightning as pl
 
 from ..components.tcn import _TemporalConvNet
-from ..components.common import Chomp1d, RepeatVector
+from ..components.common import Chomp1d, RepeatVector, WindowNormalizer
 from ...losses.utils import LossFunction
-from ...data.tsdataset import WindowsDataset
+from ...data.tsdataset import WindowsDataset, _tail_panel
 from ...data.tsloader import TimeSeriesLoader
 
 # Cell
@@ -211,10 +211,12 @@ class _NHITS(nn.Module):
                  activation,
                  initialization,
                  batch_normalization,
-                 shared_weights):
+                 shared_weights,
+                 window_normalizer=None):
         super().__init__()
 
         self.n_time_out = n_time_out
+        self.window_normalizer = None if window_normalizer is None else WindowNormalizer(window_normalizer)
         self.n_quantiles = n_quantiles
 
         blocks = self.create_stack(stack_types=stack_types,
@@ -303,12 +305,19 @@ class _NHITS(nn.Module):
         outsample_x_t = X[:, :, -self.n_time_out:]
         outsample_mask = outsample_mask[:, -self.n_time_out:]
 
+        # Normalizes each window with the statistics of its insample
+        if self.window_normalizer is not None:
+            insample_y, y_shift, y_scale = self.window_normalizer(insample_y, insample_mask)
+
         if return_decomposition:
             forecast, block_forecasts = self.forecast_decomposition(insample_y=insample_y,
                                                                     insample_x_t=insample_x_t,
                                                                     insample_mask=insample_mask,
                                                                     outsample_x_t=outsample_x_t,
                                                                     x_s=S)
+            if self.window_normalizer is not None:
+                forecast = self.window_normalizer.inverse(forecast, y_shift, y_scale)
+                block_forecasts = self.window_normalizer.inverse_decomposition(block_forecasts, y_shift, y_scale)
             return outsample_y, forecast, block_forecasts, outsample_mask
 
         else:
@@ -317,6 +326,8 @@ class _NHITS(nn.Module):
                                      insample_mask=insample_mask,
                                      outsample_x_t=outsample_x_t,
                                      x_s=S)
+            if self.window_normalizer is not None:
+                forecast = self.window_normalizer.inverse(forecast, y_shift, y_scale)
             return outsample_y, forecast, outsample_mask
 
     def forecast(self, insample_y: t.Tensor, insample_x_t: t.Tensor, insample_mask: t.Tensor,
@@ -392,7 +403,8 @@ class MQNHITS(pl.LightningModule):
                  loss_hypar: float,
                  loss_valid: str,
                  frequency: str,
-                 random_seed: int):
+                 random_seed: int,
+                 window_normalizer: str = None):
         """
         MQN-HiTS model.
 
@@ -470,6 +482,11 @@ class MQNHITS(pl.LightningModule):
             random_seed: int
                 random_seed for pseudo random pytorch initializer and
                 numpy random generator.
+            window_normalizer: str
+                Normalizer of each window with the statistics of its insample,
+                forecasts are denormalized in the model.
+                An item from ['std', 'invariant', 'norm', 'norm1', 'median'].
+                Default None: windows are not normalized.
         """
 
         super(MQNHITS, self).__init__()
@@ -518,6 +535,7 @@ class MQNHITS(pl.LightningModule):
         self.weight_decay = weight_decay
         self.lr_decay_step_size = lr_decay_step_size
         self.random_seed = random_seed
+        self.window_normalizer = window_normalizer
 
         # Data parameters
         self.frequency = frequency
@@ -542,7 +560,8 @@ class MQNHITS(pl.LightningModule):
                             activation=self.activation,
                             initialization=self.initialization,
                             batch_normalization=self.batch_normalization,
-                            shared_weights=self.shared_weights)
+                            shared_weights=self.shared_weights,
+                            window_normalizer=self.window_normalizer)
 
     def training_step(self, batch, batch_idx):
         S = batch['S']
@@ -660,6 +679,12 @@ def forecast(self: MQNHITS, Y_df: pd.DataFrame, X_df: pd.DataFrame = None, S_df:
     index = pd.MultiIndex.from_product([Y_df['unique_id'].unique(), forecast_dates], names=['unique_id', 'ds'])
     forecast_df = pd.DataFrame({'y':[0]}, index=index).reset_index() # Pad the future with zeros, model needs this
 
+    # Only the last window of each series is forecasted,
+    # the dataset is built from its last n_time_in + n_time_out stamps
+    Y_df = _tail_panel(Y_df, n=self.n_time_in)
+    if X_df is not None:
+        X_df = _tail_panel(X_df, n=self.n_time_in + self.n_time_out)
+
     Y_df = Y_df.append(forecast_df).sort_values(['unique_id','ds']).reset_index(drop=True)
 
     # Dataset, loader and trainer
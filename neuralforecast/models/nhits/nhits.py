@@ -18,9 +18,9 @@ from torch import optim
 import pytorch_lightning as pl
 
 from ..components.tcn import _TemporalConvNet
-from ..components.common import Chomp1d, RepeatVector
+from ..components.common import Chomp1d, RepeatVector, WindowNormalizer
 from ...losses.utils import LossFunction
-from ...data.tsdataset import WindowsDataset
+from ...data.tsdataset import WindowsDataset, _tail_panel
 from ...data.tsloader import TimeSeriesLoader
 
 # Cell
@@ -256,7 +256,8 @@ class _NHITSBlock(nn.Module):
         self.basis = basis
 
     def forward(self, insample_y: t.Tensor, insample_x_t: t.Tensor,
-                outsample_x_t: t.Tensor, x_s: t.Tensor) -> Tuple[t.Tensor, t.Tensor]:
+                outsample_x_t: t.Tensor, x_s: t.Tensor,
+                x_s_idxs: t.Tensor = None) -> Tuple[t.Tensor, t.Tensor]:
 
         insample_y = insample_y.unsqueeze(1)
         insample_y = self.pooling_layer(insample_y)
@@ -270,6 +271,9 @@ class _NHITSBlock(nn.Module):
         # Static exogenous
         if (self.n_s > 0) and (self.n_s_hidden > 0):
             x_s = self.static_encoder(x_s)
+            if x_s_idxs is not None:
+                # Static variables encoded once per series, gathered for each window
+                x_s = x_s[x_s_idxs]
             insample_y = t.cat((insample_y, x_s), 1)
 
         # Compute local projection weights and projection
@@ -302,10 +306,12 @@ class _NHITS(nn.Module):
                  activation,
                  initialization,
                  batch_normalization,
-                 shared_weights):
+                 shared_weights,
+                 window_normalizer=None):
         super().__init__()
 
         self.n_time_out = n_time_out
+        self.window_normalizer = None if window_normalizer is None else WindowNormalizer(window_normalizer)
 
         blocks = self.create_stack(stack_types=stack_types,
                                    n_blocks=n_blocks,
@@ -391,7 +397,7 @@ class _NHITS(nn.Module):
 
     def forward(self, S: t.Tensor, Y: t.Tensor, X: t.Tensor,
                 insample_mask: t.Tensor, outsample_mask: t.Tensor,
-                return_decomposition: bool=False):
+                return_decomposition: bool=False, S_idxs: t.Tensor=None):
 
         # insample
         insample_y    = Y[:, :-self.n_time_out]
@@ -403,12 +409,19 @@ class _NHITS(nn.Module):
         outsample_x_t = X[:, :, -self.n_time_out:]
         outsample_mask = outsample_mask[:, -self.n_time_out:]
 
+        # Normalizes each window with the statistics of its insample
+        if self.window_normalizer is not None:
+            insample_y, y_shift, y_scale = self.window_normalizer(insample_y, insample_mask)
+
         if return_decomposition:
             forecast, block_forecasts = self.forecast_decomposition(insample_y=insample_y,
                                                                     insample_x_t=insample_x_t,
                                                                     insample_mask=insample_mask,
                                                                     outsample_x_t=outsample_x_t,
-                                                                    x_s=S)
+                                                                    x_s=S, x_s_idxs=S_idxs)
+            if self.window_normalizer is not None:
+                forecast = self.window_normalizer.inverse(forecast, y_shift, y_scale)
+                block_forecasts = self.window_normalizer.inverse_decomposition(block_forecasts, y_shift, y_scale)
             return outsample_y, forecast, block_forecasts, outsample_mask
 
         else:
@@ -416,11 +429,13 @@ class _NHITS(nn.Module):
                                      insample_x_t=insample_x_t,
                                      insample_mask=insample_mask,
                                      outsample_x_t=outsample_x_t,
-                                     x_s=S)
+                                     x_s=S, x_s_idxs=S_idxs)
+            if self.window_normalizer is not None:
+                forecast = self.window_normalizer.inverse(forecast, y_shift, y_scale)
             return outsample_y, forecast, outsample_mask
 
     def forecast(self, insample_y: t.Tensor, insample_x_t: t.Tensor, insample_mask: t.Tensor,
-                 outsample_x_t: t.Tensor, x_s: t.Tensor):
+                 outsample_x_t: t.Tensor, x_s: t.Tensor, x_s_idxs: t.Tensor=None):
 
         residuals = insample_y.flip(dims=(-1,))
         insample_x_t = insample_x_t.flip(dims=(-1,))
@@ -429,14 +444,14 @@ class _NHITS(nn.Module):
         forecast = insample_y[:, -1:] # Level with Naive1
         for i, block in enumerate(self.blocks):
             backcast, block_forecast = block(insample_y=residuals, insample_x_t=insample_x_t,
-                                             outsample_x_t=outsample_x_t, x_s=x_s)
+                                             outsample_x_t=outsample_x_t, x_s=x_s, x_s_idxs=x_s_idxs)
             residuals = (residuals - backcast) * insample_mask
             forecast = forecast + block_forecast
 
         return forecast
 
     def forecast_decomposition(self, insample_y: t.Tensor, insample_x_t: t.Tensor, insample_mask: t.Tensor,
-                               outsample_x_t: t.Tensor, x_s: t.Tensor):
+                               outsample_x_t: t.Tensor, x_s: t.Tensor, x_s_idxs: t.Tensor=None):
 
         residuals = insample_y.flip(dims=(-1,))
         insample_x_t = insample_x_t.flip(dims=(-1,))
@@ -450,7 +465,7 @@ class _NHITS(nn.Module):
         forecast = level
         for i, block in enumerate(self.blocks):
             backcast, block_forecast = block(insample_y=residuals, insample_x_t=insample_x_t,
-                                             outsample_x_t=outsample_x_t, x_s=x_s)
+                                             outsample_x_t=outsample_x_t, x_s=x_s, x_s_idxs=x_s_idxs)
             residuals = (residuals - backcast) * insample_mask
             forecast = forecast + block_forecast
             block_forecasts.append(block_forecast)
@@ -491,7 +506,8 @@ class NHITS(pl.LightningModule):
                  loss_hypar: float,
                  loss_valid: str,
                  frequency: str,
-                 random_seed: int):
+                 random_seed: int,
+                 window_normalizer: str = None):
         """
         N-HiTS model.
 
@@ -569,6 +585,11 @@ class NHITS(pl.LightningModule):
             random_seed: int
                 random_seed for pseudo random pytorch initializer and
                 numpy random generator.
+            window_normalizer: str
+                Normalizer of each window with the statistics of its insample,
+                forecasts are denormalized in the model.
+                An item from ['std', 'invariant', 'norm', 'norm1', 'median'].
+                Default None: windows are not normalized.
         """
 
         super(NHITS, self).__init__()
@@ -615,10 +636,12 @@ class NHITS(pl.LightningModule):
         self.weight_decay = weight_decay
         self.lr_decay_step_size = lr_decay_step_size
         self.random_seed = random_seed
+        self.window_normalizer = window_normalizer
 
         # Data parameters
         self.frequency = frequency
         self.return_decomposition = False
+        self.static_table = None # static variables of datasets with static_lookup, not saved in checkpoints
 
         self.model = _NHITS(n_time_in=self.n_time_in,
                             n_time_out=self.n_time_out,
@@ -638,16 +661,30 @@ class NHITS(pl.LightningModule):
                             activation=self.activation,
                             initialization=self.initialization,
                             batch_normalization=self.batch_normalization,
-                            shared_weights=self.shared_weights)
+                            shared_weights=self.shared_weights,
+                            window_normalizer=self.window_normalizer)
+
+    def _get_static(self, batch):
+        """Static variables of the batch and the position of the
+        series of each window in them. Batches without 'S', from datasets
+        with static_lookup, gather the rows of their series once from
+        static_table, which stays in the device of the model."""
+        if 'S' in batch:
+            return batch['S'], None
+        assert self.static_table is not None, 'Set static_table to the s_tensor of the static_lookup dataset'
+        if self.static_table.device != self.device:
+            self.static_table = self.static_table.to(self.device)
+        idxs, S_idxs = t.unique(batch['idxs'], return_inverse=True)
+        return self.static_table[idxs], S_idxs
 
     def training_step(self, batch, batch_idx):
-        S = batch['S']
+        S, S_idxs = self._get_static(batch)
         Y = batch['Y']
         X = batch['X']
         sample_mask = batch['sample_mask']
         available_mask = batch['available_mask']
 
-        outsample_y, forecast, outsample_mask = self.model(S=S, Y=Y, X=X,
+        outsample_y, forecast, outsample_mask = self.model(S=S, S_idxs=S_idxs, Y=Y, X=X,
                                                            insample_mask=available_mask,
                                                            outsample_mask=sample_mask,
                                                            return_decomposition=False)
@@ -662,13 +699,13 @@ class NHITS(pl.LightningModule):
         return loss
 
     def validation_step(self, batch, idx):
-        S = batch['S']
+        S, S_idxs = self._get_static(batch)
         Y = batch['Y']
         X = batch['X']
         sample_mask = batch['sample_mask']
         available_mask = batch['available_mask']
 
-        outsample_y, forecast, outsample_mask = self.model(S=S, Y=Y, X=X,
+        outsample_y, forecast, outsample_mask = self.model(S=S, S_idxs=S_idxs, Y=Y, X=X,
                                                            insample_mask=available_mask,
                                                            outsample_mask=sample_mask,
                                                            return_decomposition=False)
@@ -688,20 +725,20 @@ class NHITS(pl.LightningModule):
         random.seed(self.random_seed) #TODO: interaccion rara con window_sampling de validacion
 
     def forward(self, batch):
-        S = batch['S']
+        S, S_idxs = self._get_static(batch)
         Y = batch['Y']
         X = batch['X']
         sample_mask = batch['sample_mask']
         available_mask = batch['available_mask']
 
         if self.return_decomposition:
-            outsample_y, forecast, block_forecast, outsample_mask = self.model(S=S, Y=Y, X=X,
+            outsample_y, forecast, block_forecast, outsample_mask = self.model(S=S, S_idxs=S_idxs, Y=Y, X=X,
                                                                      insample_mask=available_mask,
                                                                      outsample_mask=sample_mask,
                                                                      return_decomposition=True)
             return outsample_y, forecast, block_forecast, outsample_mask
 
-        outsample_y, forecast, outsample_mask = self.model(S=S, Y=Y, X=X,
+        outsample_y, forecast, outsample_mask = self.model(S=S, S_idxs=S_idxs, Y=Y, X=X,
                                                            insample_mask=available_mask,
                                                            outsample_mask=sample_mask,
                                                            return_decomposition=False)
@@ -756,6 +793,12 @@ def forecast(self: NHITS, Y_df: pd.DataFrame, X_df: pd.DataFrame = None, S_df: p
     index = pd.MultiIndex.from_product([Y_df['unique_id'].unique(), forecast_dates], names=['unique_id', 'ds'])
     forecast_df = pd.DataFrame({'y':[0]}, index=index).reset_index()
 
+    # Only the last window of each series is forecasted,
+    # the dataset is built from its last n_time_in + n_time_out stamps
+    Y_df = _tail_panel(Y_df, n=self.n_time_in)
+    if X_df is not None:
+        X_df = _tail_panel(X_df, n=self.n_time_in + self.n_time_out)
+
     Y_df = Y_df.append(forecast_df).sort_values(['unique_id','ds']).reset_index(drop=True)
 
     # Dataset, loader and trainer